@@ -13,8 +13,12 @@ python3 $TASKS_DIR/recreate_collection.py
 
 python3 $TASKS_DIR/import_pages.py
 python3 $TASKS_DIR/import_text_files.py
+# Remove chunks of deleted pages and files, forget them in meta (any sync mode)
+python3 $TASKS_DIR/reconcile.py
 #python3 $TASKS_DIR/import_sites.py
 #python3 $TASKS_DIR/fetch_files.py
 #python3 $TASKS_DIR/import_files.py
+# fetch_files + import_files overlapped in one streaming process
+#python3 $TASKS_DIR/pipeline_files.py
 
 # exec "$@"
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Chunking throughput: native chunker (src.common.chunker) against langchain
+RecursiveCharacterTextSplitter.
+
+Texts are .txt files under a directory (text written next to the parsed
+files in `blob_dir`) or generated ones. Every text is split by langchain, by
+Chunker.split() and by Chunker.split_stream() fed with `--piece` chars at
+a time. Chunk size, overlap and separators are from settings. Throughput
+of each one and equivalence of the chunks are reported, exit code is 1 if
+split() gives other chunks than langchain.
+
+    python3 -m src.benchmarks.chunker
+    python3 -m src.benchmarks.chunker --dir /opt/catsearch/download/blobs --limit 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections.abc import Iterator
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.common.chunker import Chunker
+from src.common.settings import settings
+
+WORDS: list[str] = [
+    'документ', 'файл', 'страница', 'сайт', 'поиск', 'текст', 'данные', 'отчет', 'приказ', 'год',
+    'document', 'search', 'page', 'report', '2024', '15.03', 'N', 'и', 'в', 'на',
+]
+
+
+def read_dir(path: str, limit: int) -> Iterator[tuple[str, str]]:
+    names: list[str] = sorted(
+        os.path.join(root, name) for root, _, files in os.walk(path) for name in files if name.endswith('.txt')
+    )
+    for name in names[:limit]:
+        with open(name, encoding='utf-8', errors='replace') as f:
+            yield name, f.read()
+
+
+def generate(count: int, size: int) -> Iterator[tuple[str, str]]:
+    """
+    Texts of paragraphs of sentences, some of them without paragraph breaks
+    """
+    rnd = random.Random(0)
+    for i in range(count):
+        paragraphs: list[str] = []
+        length: int = 0
+        while length < size:
+            sentences: list[str] = [
+                ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 25))) + rnd.choice('.!?')
+                for _ in range(rnd.randint(1, 12))
+            ]
+            paragraphs.append(rnd.choice((' ', '\n')).join(sentences))
+            length += len(paragraphs[-1]) + 2
+        yield f"generated-{i}", ('\n\n' if i % 4 else '\n').join(paragraphs)
+
+
+def pieces(text: str, size: int) -> Iterator[str]:
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Native chunker against langchain splitter")
+    parser.add_argument('--dir', help="Directory with .txt files (recursive) instead of generated texts")
+    parser.add_argument('--limit', type=int, default=100, help="Texts to split")
+    parser.add_argument('--size', type=int, default=200_000, help="Size of a generated text")
+    parser.add_argument('--piece', type=int, default=4096, help="Size of a stream piece")
+    args = parser.parse_args()
+
+    texts = read_dir(args.dir, args.limit) if args.dir else generate(args.limit, args.size)
+    chunker = Chunker()
+    count, size, chunks, same, same_stream = 0, 0, 0, 0, 0
+    lc_time, native_time, stream_time = 0.0, 0.0, 0.0
+    for name, text in texts:
+        start = time.perf_counter()
+        expected: list[str] = RecursiveCharacterTextSplitter(
+            chunk_size=settings.text_chunk_size,
+            chunk_overlap=settings.text_chunk_overlap,
+            separators=settings.text_chunk_separators,
+        ).split_text(text)
+        lc_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual: list[str] = [chunk.text for chunk in chunker.split(text)]
+        native_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        streamed: list[str] = [chunk.text for chunk in chunker.split_stream(pieces(text, args.piece))]
+        stream_time += time.perf_counter() - start
+
+        count += 1
+        size += len(text)
+        chunks += len(expected)
+        if actual == expected:
+            same += 1
+        else:
+            print(f"{name}: split() differs: {len(actual)} chunks, langchain {len(expected)}")
+        if streamed == expected:
+            same_stream += 1
+
+    if not count:
+        print("No texts")
+        return 0
+    mb: float = size / 1024 / 1024
+    print(f"\nTexts: {count}, {mb:.1f} MB, {chunks} chunks")
+    print(f"langchain:      {lc_time:.3f}s, {mb / lc_time:.1f} MB/s")
+    print(f"split:          {native_time:.3f}s, {mb / native_time:.1f} MB/s, x{lc_time / native_time:.1f}")
+    print(f"split_stream:   {stream_time:.3f}s, {mb / stream_time:.1f} MB/s, x{lc_time / stream_time:.1f}")
+    print(f"Same chunks: split {same}/{count}, split_stream {same_stream}/{count}")
+    return 0 if same == count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
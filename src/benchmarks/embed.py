@@ -0,0 +1,131 @@
+"""
+Client side embeddings: fake Ollama embed API and throughput of
+src.common.embed by batch size.
+
+The fake server answers POST /api/embed like Ollama: a vector per input
+text, derived from the text hash (same text - same vector), after
+`--delay` ms per request plus `--item-delay` ms per text. It stands in for
+Ollama to run the spider with embed_mode = 'client' without a model:
+
+    python3 -m src.benchmarks.embed --serve --port 11434
+
+Without --serve the fake server is started in the background (or
+`--endpoint` of a real Ollama is used) and `--count` generated chunks are
+embedded with every batch size of `--batch`. The embedding cache is off
+unless `--cache` (it needs the spider DB). Exit code is 1 if vectors
+don't match the texts.
+
+    python3 -m src.benchmarks.embed --batch 1 8 32 --workers 2
+    python3 -m src.benchmarks.embed --endpoint http://ollama:11434 --count 500
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.common import embed
+from src.common.settings import settings
+
+
+def fake_vector(text: str, dim: int) -> list[float]:
+    """
+    Deterministic unit vector of the text
+    """
+    seed: int = struct.unpack('<Q', hashlib.sha256(text.encode()).digest()[:8])[0]
+    rnd = random.Random(seed)
+    vector: list[float] = [rnd.gauss(0, 1) for _ in range(dim)]
+    norm: float = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+
+def make_handler(dim: int, delay: float, item_delay: float) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/api/embed':
+                self.send_error(404)
+                return
+            body: dict = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            texts: list[str] = [body['input']] if isinstance(body['input'], str) else body['input']
+            time.sleep((delay + item_delay * len(texts)) / 1000)
+            data: bytes = json.dumps({
+                'model': body.get('model'),
+                'embeddings': [fake_vector(text, dim) for text in texts],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int, dim: int, delay: float, item_delay: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('0.0.0.0', port), make_handler(dim, delay, item_delay))
+    server.daemon_threads = True
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fake Ollama embed API and embedding throughput")
+    parser.add_argument('--serve', action='store_true', help="Only run the fake server")
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--dim', type=int, default=768, help="Vector size of the fake server")
+    parser.add_argument('--delay', type=float, default=20, help="Fake latency per request, ms")
+    parser.add_argument('--item-delay', type=float, default=5, help="Fake latency per text, ms")
+    parser.add_argument('--endpoint', help="Real embed API instead of the fake server")
+    parser.add_argument('--count', type=int, default=1000, help="Chunks to embed")
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8, 32, 64], help="Batch sizes")
+    parser.add_argument('--workers', type=int, default=settings.embed_workers, help="Parallel requests")
+    parser.add_argument('--cache', action='store_true', help="Use the embedding cache in the spider DB")
+    args = parser.parse_args()
+
+    if args.serve:
+        print(f"Fake embed API on :{args.port}, {args.dim} dimensions")
+        serve(args.port, args.dim, args.delay, args.item_delay).serve_forever()
+        return 0
+
+    if args.endpoint:
+        settings.embed_api_endpoint = args.endpoint
+    else:
+        server = serve(0, args.dim, args.delay, args.item_delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        settings.embed_api_endpoint = f"http://127.0.0.1:{server.server_port}"
+    settings.embed_workers = args.workers
+    settings.embed_cache_enabled = args.cache
+
+    rnd = random.Random(0)
+    chunks: list[str] = [
+        ' '.join(str(rnd.randint(0, 10 ** 6)) for _ in range(100)) for _ in range(args.count)
+    ]
+    print(f"{'batch':>6} {'time, s':>8} {'chunks/s':>9} {'batches':>8} {'cached':>7}")
+    ok: bool = True
+    for batch_size in args.batch:
+        settings.embed_batch_size = batch_size
+        embed._session = None       # Pool sized to the workers
+        stats: dict = defaultdict(int)
+        start = time.perf_counter()
+        result: list[tuple[str, list[float]]] = list(embed.embed_stream(chunks, lambda text: text, stats))
+        elapsed: float = time.perf_counter() - start
+        if not args.endpoint and not args.cache:     # Cached vectors are float32
+            ok &= [text for text, _ in result] == chunks and all(
+                vector == fake_vector(text, args.dim) for text, vector in result[:50]
+            )
+        print(
+            f"{batch_size:>6} {elapsed:>8.3f} {len(result) / elapsed:>9.0f}"
+            f" {stats['embed_batches']:>8} {stats['embed_cache_hits']:>7}"
+        )
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+HTML to markdown: lxml converter (src.common.html2md) against markdownify.
+
+Page bodies are taken from pages_page of our sites (or from .html files of
+a directory). Both converters run on every body: time of each one and
+equivalence of the outputs are reported. Outputs are equivalent when they
+are the same after collapsing whitespace. Exit code is 1 if any body is
+converted differently. Equivalence on fixed samples is checked by
+tests/test_html2md.py.
+
+    python3 -m src.benchmarks.html2md --limit 500
+    python3 -m src.benchmarks.html2md --dir /tmp/pages --show 3
+"""
+import argparse
+import os
+import sys
+import time
+from collections.abc import Iterator
+
+from markdownify import markdownify as md
+
+from src.common.html2md import html2markdown
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def read_pages(limit: int) -> Iterator[tuple[str, str]]:
+    """
+    (page id, body) of the pages of our sites
+    """
+    from sqlalchemy import select, cast, Text
+
+    from src.common.db import DbConnManager
+    from src.common.settings import settings
+    from src.models.vk_cms import Page, SiteServiceObject
+
+    query = select(
+        Page.id, Page.body,
+    ).join(
+        SiteServiceObject,
+        SiteServiceObject.external_id == cast(Page.id, Text),
+    ).where(
+        SiteServiceObject.site_id.in_(settings.site_ids),
+    ).limit(limit)
+    with DbConnManager(settings.vk_db_conn_str_cms) as conn:
+        for row in conn.execute(query):
+            if row.body and row.body.get('data'):
+                yield str(row.id), row.body['data']
+
+
+def read_dir(path: str, limit: int) -> Iterator[tuple[str, str]]:
+    names: list[str] = sorted(name for name in os.listdir(path) if name.endswith(('.html', '.htm')))
+    for name in names[:limit]:
+        with open(os.path.join(path, name), encoding='utf-8', errors='replace') as f:
+            yield name, f.read()
+
+
+def show_diff(name: str, expected: str, actual: str) -> None:
+    expected, actual = normalize(expected), normalize(actual)
+    i: int = next(
+        (i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), min(len(expected), len(actual))
+    )
+    print(f"\n{name}:\n  markdownify: {expected[max(0, i - 60):i + 60]!r}\n  lxml:        {actual[max(0, i - 60):i + 60]!r}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="lxml HTML to markdown against markdownify")
+    parser.add_argument('--dir', help="Directory with .html files instead of pages_page")
+    parser.add_argument('--limit', type=int, default=1000, help="Pages to convert")
+    parser.add_argument('--show', type=int, default=5, help="Differences to print")
+    args = parser.parse_args()
+
+    pages = read_dir(args.dir, args.limit) if args.dir else read_pages(args.limit)
+    count, size, exact, equivalent, shown = 0, 0, 0, 0, 0
+    md_time, lxml_time = 0.0, 0.0
+    for name, body in pages:
+        start = time.perf_counter()
+        expected: str = md(body, heading_style="ATX")
+        md_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual: str = html2markdown(body)
+        lxml_time += time.perf_counter() - start
+
+        count += 1
+        size += len(body)
+        if expected == actual:
+            exact += 1
+            equivalent += 1
+        elif normalize(expected) == normalize(actual):
+            equivalent += 1
+        elif shown < args.show:
+            shown += 1
+            show_diff(name, expected, actual)
+
+    if not count:
+        print("No pages")
+        return 0
+    print(f"\nPages: {count}, HTML: {size / 1024 / 1024:.1f} MB")
+    print(f"markdownify: {md_time:.3f}s, {count / md_time:.0f} pages/s")
+    print(f"lxml:        {lxml_time:.3f}s, {count / lxml_time:.0f} pages/s, x{md_time / lxml_time:.1f}")
+    print(f"Same output: {exact}/{count}, equivalent: {equivalent}/{count}")
+    return 0 if equivalent == count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Cold start of the tasks: import time and count of loaded modules.
+
+Every task module is imported in a fresh interpreter, `--repeat` times,
+the median is reported. Heavy third-party packages a task isn't expected
+to load are reported as regressions, exit code is 1 then.
+
+    python3 -m src.benchmarks.import_time
+    python3 -m src.benchmarks.import_time --repeat 5 wait_dbs fetch_files
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+TASKS_DIR: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tasks')
+ROOT_DIR: str = os.path.dirname(os.path.dirname(TASKS_DIR))
+
+# Heavy packages, loaded only on the paths which need them
+HEAVY: tuple[str, ...] = (
+    'langchain', 'langchain_core', 'langchain_text_splitters', 'markdownify',
+    'weaviate', 'requests', 'pandas', 'PyPDF2', 'openpyxl', 'lxml', 'bs4',
+)
+
+# Text processing (src.common.text) with what it pulls in
+TEXT: set[str] = {
+    'langchain', 'langchain_core', 'langchain_text_splitters', 'markdownify', 'bs4', 'lxml', 'requests',
+}
+
+# Task -> heavy packages it's allowed to load on import
+ALLOWED: dict[str, set[str]] = {
+    'wait_dbs':             {'weaviate'},
+    'import_sites':         set(),
+    'fetch_files':          {'requests'},
+    'reconcile':            {'weaviate'},
+    'recreate_collection':  {'weaviate'},
+    'import_pages':         {'weaviate', *TEXT},
+    'import_text_files':    {'weaviate', *TEXT},
+    'import_files':         {'weaviate', *TEXT},
+    'pipeline_files':       {'weaviate', *TEXT},
+}
+
+# Runs in the child: imports the module, prints time and loaded modules
+PROBE: str = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'time': elapsed, 'modules': sorted(set(sys.modules) - before)}}))
+"""
+
+
+def probe(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=ROOT_DIR,
+        env={**os.environ, 'PYTHONPATH': ROOT_DIR, 'PYTHONDONTWRITEBYTECODE': ''},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(task: str, repeat: int) -> dict:
+    runs: list[dict] = [probe(f"src.tasks.{task}") for _ in range(repeat)]
+    modules: list[str] = runs[-1]['modules']
+    heavy: set[str] = {name.split('.', maxsplit=1)[0] for name in modules} & set(HEAVY)
+    return {
+        'time': statistics.median(run['time'] for run in runs),
+        'modules': len(modules),
+        'heavy': sorted(heavy),
+        'unexpected': sorted(heavy - ALLOWED.get(task, set(HEAVY))),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cold start time and module count of the tasks")
+    parser.add_argument('tasks', nargs='*', help="Task names, all tasks by default")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help="Print results as json")
+    args = parser.parse_args()
+
+    tasks: list[str] = args.tasks or sorted(
+        name[:-3] for name in os.listdir(TASKS_DIR) if name.endswith('.py') and name != '__init__.py'
+    )
+    results: dict[str, dict] = {task: measure(task, args.repeat) for task in tasks}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'task':<22} {'time, s':>8} {'modules':>8}  heavy")
+        for task, res in results.items():
+            unexpected: str = f"  UNEXPECTED: {', '.join(res['unexpected'])}" if res['unexpected'] else ''
+            print(f"{task:<22} {res['time']:>8.3f} {res['modules']:>8}  {', '.join(res['heavy'])}{unexpected}")
+    return 1 if any(res['unexpected'] for res in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
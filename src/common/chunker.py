@@ -0,0 +1,224 @@
+from collections import deque
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple
+
+from src.common.settings import settings
+
+# Native recursive character chunker. Same chunks as langchain
+# RecursiveCharacterTextSplitter (keep_separator=True, strip_whitespace=True,
+# plain separators, len as length) but works on offsets of the source text:
+# pieces aren't copied until a chunk is yielded, chunks are yielded lazily
+# and carry their start/end offsets.
+
+STREAM_WINDOW: int = 64 * 1024      # text read from the stream before splitting
+STREAM_LIMIT: int = 16              # windows buffered waiting for a separator
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int      # Offset of the chunk in the source text (stream)
+    end: int
+
+
+class Chunker:
+    """
+    Splits text by the first separator found in it, merges pieces up to
+    `chunk_size` chars with `chunk_overlap` chars of overlap. Pieces of
+    `chunk_size` and longer are split again by the next separators.
+    Separator is kept at the start of the piece it precedes.
+    """
+    def __init__(
+            self,
+            chunk_size: int | None = None,
+            chunk_overlap: int | None = None,
+            separators: Iterable[str] | None = None,
+    ):
+        self.chunk_size: int = settings.text_chunk_size if chunk_size is None else chunk_size
+        self.chunk_overlap: int = settings.text_chunk_overlap if chunk_overlap is None else chunk_overlap
+        self.separators: list[str] = list(settings.text_chunk_separators if separators is None else separators)
+        assert 0 <= self.chunk_overlap <= self.chunk_size, \
+            f"Chunk overlap {self.chunk_overlap} doesn't fit chunk size {self.chunk_size}"
+
+    @staticmethod
+    def _choose(text: str, start: int, end: int, separators: list[str]) -> tuple[str, list[str]]:
+        """
+        Separator to split text[start:end] by and the separators left for its long pieces
+        """
+        for i, separator in enumerate(separators):
+            if separator == '':
+                return '', []
+            if text.find(separator, start, end) >= 0:
+                return separator, separators[i + 1:]
+        return separators[-1] if separators else '', []
+
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> Iterator[tuple[int, int]]:
+        """
+        Pieces of text[start:end] as (start, end), each one starts with the separator
+        """
+        if not separator:
+            yield from ((i, i + 1) for i in range(start, end))
+            return
+        prev: int = start
+        pos: int = text.find(separator, start, end)
+        while pos >= 0:
+            if pos > prev:
+                yield prev, pos
+            prev = pos
+            pos = text.find(separator, pos + len(separator), end)
+        if end > prev:
+            yield prev, end
+
+    @staticmethod
+    def _chunk(text: str, start: int, end: int, offset: int) -> Chunk | None:
+        """
+        text[start:end] without surrounding whitespace, None if nothing is left
+        """
+        part: str = text[start:end]
+        stripped: str = part.strip()
+        if not stripped:
+            return None
+        lead: int = len(part) - len(part.lstrip())
+        return Chunk(stripped, offset + start + lead, offset + start + lead + len(stripped))
+
+    def _split(self, text: str, start: int, end: int, separators: list[str], offset: int) -> Iterator[Chunk]:
+        """
+        Recursive split of text[start:end]. `offset` is the offset of `text` in the source.
+        """
+        separator, rest = self._choose(text, start, end, separators)
+        merger = _Merger(self, text, offset)
+        for piece_start, piece_end in self._pieces(text, start, end, separator):
+            if piece_end - piece_start < self.chunk_size:
+                if chunk := merger.add(piece_start, piece_end):
+                    yield chunk
+                continue
+            if chunk := merger.flush():
+                yield chunk
+            if rest:
+                yield from self._split(text, piece_start, piece_end, rest, offset)
+            else:
+                # Nothing to split by: the piece goes as is, not stripped
+                yield Chunk(text[piece_start:piece_end], offset + piece_start, offset + piece_end)
+        if chunk := merger.flush():
+            yield chunk
+
+    def split(self, text: str) -> Iterator[Chunk]:
+        """
+        Chunks of the text with their offsets
+        """
+        return self._split(text, 0, len(text), self.separators, 0)
+
+    def split_stream(self, stream: Iterable[str], window: int = STREAM_WINDOW) -> Iterator[Chunk]:
+        """
+        Chunks of the text read piece by piece from the stream, offsets are
+        from the start of the stream. At most a few windows of text are kept.
+
+        The top level separator is the first one found in the first window.
+        Chunks are the same as of split() for the whole text if that separator
+        is the first one found in the whole text and it occurs at least every
+        `STREAM_LIMIT` windows. Otherwise a piece is cut at the buffer limit.
+
+        Not used by the import tasks: they chunk page by page with split()
+        (split_text()), a page or a piece of a document is small enough. It's
+        measured by src.benchmarks.chunker only.
+        """
+        buffer: str = ''
+        offset: int = 0             # Stream offset of buffer[0]
+        done: int = 0               # Text before buffer[done] is split
+        separator: str | None = None
+        rest: list[str] = []
+        merger: _Merger | None = None
+        stream = iter(stream)
+
+        while True:
+            text: str | None = next(stream, None)
+            final: bool = text is None
+            if text:
+                buffer += text
+            if not final and len(buffer) - done < window:
+                continue
+
+            if separator is None:
+                separator, rest = self._choose(buffer, done, len(buffer), self.separators)
+                merger = _Merger(self, buffer, offset)
+
+            pieces: list[tuple[int, int]] = list(self._pieces(buffer, done, len(buffer), separator))
+            if not final and separator:
+                if len(pieces) > 1:
+                    pieces.pop()    # Last piece may go on in the next text of the stream
+                elif len(buffer) - done < window * STREAM_LIMIT:
+                    continue
+
+            merger.text = buffer
+            for piece_start, piece_end in pieces:
+                if piece_end - piece_start < self.chunk_size:
+                    if chunk := merger.add(piece_start, piece_end):
+                        yield chunk
+                    continue
+                if chunk := merger.flush():
+                    yield chunk
+                if rest:
+                    yield from self._split(buffer, piece_start, piece_end, rest, offset)
+                else:
+                    yield Chunk(buffer[piece_start:piece_end], offset + piece_start, offset + piece_end)
+            if pieces:
+                done = pieces[-1][1]
+
+            if final:
+                if chunk := merger.flush():
+                    yield chunk
+                return
+
+            # Drop the split text, the merger still needs its current pieces
+            keep: int = min(done, merger.first())
+            buffer = buffer[keep:]
+            offset += keep
+            done -= keep
+            merger.shift(keep)
+
+
+class _Merger:
+    """
+    Merges consecutive short pieces into chunks with overlap.
+    A chunk is returned when the next piece doesn't fit in it.
+    """
+    def __init__(self, chunker: Chunker, text: str, offset: int):
+        self.chunker: Chunker = chunker
+        self.text: str = text
+        self.offset: int = offset
+        self.current: deque[tuple[int, int]] = deque()
+        self.total: int = 0
+
+    def add(self, start: int, end: int) -> Chunk | None:
+        size: int = end - start
+        chunk: Chunk | None = None
+        if self.current and self.total + size > self.chunker.chunk_size:
+            chunk = self.chunker._chunk(self.text, self.current[0][0], self.current[-1][1], self.offset)
+            # Keep the tail of the chunk as overlap with the next one
+            while self.total > self.chunker.chunk_overlap or (
+                    self.total + size > self.chunker.chunk_size and self.total > 0
+            ):
+                first_start, first_end = self.current.popleft()
+                self.total -= first_end - first_start
+        self.current.append((start, end))
+        self.total += size
+        return chunk
+
+    def flush(self) -> Chunk | None:
+        chunk: Chunk | None = None
+        if self.current:
+            chunk = self.chunker._chunk(self.text, self.current[0][0], self.current[-1][1], self.offset)
+        self.current.clear()
+        self.total = 0
+        return chunk
+
+    def first(self) -> int:
+        return self.current[0][0] if self.current else len(self.text)
+
+    def shift(self, count: int) -> None:
+        """
+        First `count` chars of the text are dropped
+        """
+        self.text = self.text[count:]
+        self.offset += count
+        self.current = deque((start - count, end - count) for start, end in self.current)
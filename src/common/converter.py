@@ -0,0 +1,178 @@
+import asyncio
+import codecs
+import os
+import signal
+import threading
+from collections.abc import AsyncIterator, Iterable, Iterator
+
+from src.common.log import logger
+from src.common.settings import settings
+
+# External CLI converters (antiword, ...) run as asyncio subprocesses in one
+# background event loop. At most `converter_workers` children run at once,
+# each one is killed with its process group when it exceeds
+# `converter_timeout` seconds or `converter_max_output_mb` of stdout.
+# At most `converter_queue_size` pieces of stdout are buffered per child:
+# then it isn't read until the consumer takes them (back-pressure).
+
+READ_SIZE: int = 64 * 1024          # stdout read size
+STDERR_LIMIT: int = 4 * 1024        # stderr kept for the error message
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_pid: int | None = None
+_semaphore: asyncio.Semaphore | None = None
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Event loop of the converters. Started on first use, once per process.
+    """
+    global _loop, _loop_pid, _semaphore
+    with _lock:
+        # A forked child inherits the loop object but not its thread
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _semaphore = asyncio.Semaphore(settings.converter_workers)
+            threading.Thread(target=_loop.run_forever, name='converter', daemon=True).start()
+        return _loop
+
+
+def _kill(proc: asyncio.subprocess.Process) -> None:
+    """
+    Kills the child with everything it spawned
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def convert(
+        args: list[str],
+        timeout: float | None = None,
+        max_output_mb: int | None = None,
+) -> AsyncIterator[str]:
+    """
+    Runs the converter and yields its stdout as text while it's read.
+
+    Raises AssertionError if the converter exits with an error, runs longer
+    than `timeout` seconds or writes more than `max_output_mb` to stdout.
+    Only time waiting for the converter counts: not the time the consumer
+    holds the output.
+    """
+    timeout = settings.converter_timeout if timeout is None else timeout
+    max_output_mb = settings.converter_max_output_mb if max_output_mb is None else max_output_mb
+    max_output: int = max_output_mb * 1024 * 1024
+    name: str = os.path.basename(args[0])
+    loop = asyncio.get_running_loop()
+
+    async with _semaphore:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,     # Own process group to kill
+        )
+        remaining: float = timeout
+        stderr_task = asyncio.ensure_future(proc.stderr.read(STDERR_LIMIT))
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        size: int = 0
+        try:
+            while True:
+                start: float = loop.time()
+                chunk: bytes = await asyncio.wait_for(proc.stdout.read(READ_SIZE), remaining)
+                remaining -= loop.time() - start
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_output:
+                    raise AssertionError(f"{name} output exceeds {max_output_mb} MB: {args[-1]}")
+                if text := decoder.decode(chunk):
+                    yield text
+            if text := decoder.decode(b'', final=True):
+                yield text
+
+            returncode: int = await asyncio.wait_for(proc.wait(), max(remaining, 0))
+            if returncode != 0:
+                stderr: str = (await stderr_task).decode(errors='replace').strip()
+                raise AssertionError(f"{name} exited with {returncode}: {args[-1]}: {stderr}")
+        except TimeoutError:
+            raise AssertionError(f"{name} timed out after {timeout}s: {args[-1]}")
+        finally:
+            if proc.returncode is None:
+                logger.warning(f"Killing {name}: {args[-1]}")
+                _kill(proc)
+                # Unread stdout keeps the transport open: drain it till EOF
+                while await proc.stdout.read(READ_SIZE):
+                    pass
+                await proc.wait()
+            stderr_task.cancel()
+
+
+def run_converter(
+        args: list[str],
+        timeout: float | None = None,
+        max_output_mb: int | None = None,
+) -> Iterator[str]:
+    """
+    Synchronous interface to convert().
+
+    The converter is scheduled right away, not on the first next(): callers
+    starting a few converters before reading them get them run in parallel.
+    Leaving the iterator before the end kills the converter. Output not
+    taken yet is bounded by `converter_queue_size` pieces.
+    """
+    loop = _get_loop()
+    output: asyncio.Queue = asyncio.Queue(settings.converter_queue_size)
+
+    async def pump():
+        stream: AsyncIterator[str] = convert(args, timeout, max_output_mb)
+        try:
+            async for text in stream:
+                await output.put(text)
+        except Exception as e:
+            await output.put(e)
+            return
+        finally:
+            await stream.aclose()   # Kills the converter if pump is cancelled
+        await output.put(None)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), loop)
+
+    def read() -> Iterator[str]:
+        try:
+            while (item := asyncio.run_coroutine_threadsafe(output.get(), loop).result()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    return read()
+
+
+def group_paragraphs(stream: Iterable[str], size: int) -> Iterator[str]:
+    """
+    Regroups streamed text into pieces of about `size` chars.
+    Pieces are cut at paragraph breaks, at line breaks if there are none.
+    The breaks at the cuts aren't part of the pieces: consumers keep pieces
+    apart (write_text_pages() writes a blank line after each one).
+    """
+    buffer: str = ''
+    for text in stream:
+        buffer += text
+        while len(buffer) >= size:
+            cut: int = buffer.find('\n\n', size)
+            if cut < 0 and len(buffer) >= size * 4:
+                # No paragraph breaks: line break or hard cut
+                cut = buffer.find('\n', size)
+                cut = size * 4 if cut < 0 else cut
+            if cut < 0:
+                break   # Wait for the end of the paragraph
+            yield buffer[:cut]
+            buffer = buffer[cut:].lstrip('\n')
+    if buffer:
+        yield buffer
@@ -1,21 +1,105 @@
+import json
+import threading
+import time
 import traceback
+from datetime import datetime, UTC
 from typing import Union
+from collections import defaultdict
 from collections.abc import Iterable
 
-from sqlalchemy import create_engine, Row
+from sqlalchemy import create_engine, event, func, Engine, Row, any_, bindparam, delete, desc, tuple_, update
 from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Query, Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import Delete, select
 
 from src.common.log import logger
 from src.common.settings import settings
-from src.models.cat_meta import SpiderFile
+from src.models.cat_meta import Checkpoint, DeadLetter, EmbeddingCache, SpiderFile, SpiderPage, Status
 from src.models.vk_filestorage import StorageObject, StorageVersion
 from src.models.vk_cms import Site
 
 
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool which measures how long checkout waits for a connection.
+    """
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            metrics = self._metrics
+            metrics['checkouts'] += 1
+            metrics['checkout_wait_s'] += wait
+            metrics['checkout_wait_max_s'] = max(metrics['checkout_wait_max_s'], wait)
+
+
+# Process-wide registry: one engine (connection pool) per connection string
+_engines: dict[tuple[str, bool], Engine] = {}
+_session_factories: dict[Engine, sessionmaker] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(conn_str: str, echo: bool = False) -> Engine:
+    """
+    Returns cached engine for the connection string. Creates it on first use.
+    """
+    key = (conn_str, echo)
+    if (engine := _engines.get(key)) is not None:
+        return engine
+    with _engines_lock:
+        if (engine := _engines.get(key)) is not None:
+            return engine
+        engine = create_engine(
+            conn_str,
+            echo=echo,
+            poolclass=MeteredQueuePool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            pool_pre_ping=settings.db_pool_pre_ping,
+            execution_options={'max_row_buffer': settings.db_max_row_buffer},
+        )
+        metrics: dict = defaultdict(int)
+        engine.pool._metrics = metrics
+
+        @event.listens_for(engine.pool, 'checkout')
+        def on_checkout(dbapi_conn, conn_record, conn_proxy) -> None:
+            conn_record.info['checkout_ts'] = time.perf_counter()
+
+        @event.listens_for(engine.pool, 'checkin')
+        def on_checkin(dbapi_conn, conn_record) -> None:
+            if (start := conn_record.info.pop('checkout_ts', None)) is not None:
+                metrics['hold_s'] += time.perf_counter() - start
+
+        _session_factories[engine] = sessionmaker(bind=engine)
+        _engines[key] = engine
+        return engine
+
+
+def get_pool_stats() -> dict:
+    """
+    Connection pool metrics per database: checkouts, waiting for checkout
+    and holding of connections (seconds).
+    """
+    return {
+        engine.url.render_as_string(hide_password=True): {
+            **{k: round(v, 6) for k, v in engine.pool._metrics.items()},
+            'status': engine.pool.status(),
+        }
+        for engine in _engines.values()
+    }
+
+
 class DbConnManager:
+    """
+    Short-lived session over the shared connection pool.
+    """
     def __init__(self, conn_str, echo=False):
         self.conn_str = conn_str
         self.echo = echo
@@ -23,9 +107,8 @@ class DbConnManager:
         self._logger = logger
 
     def __enter__(self):
-        self.engine = create_engine(self.conn_str, echo=self.echo)
-        session_factory = sessionmaker(bind=self.engine)
-        self.session: Session = session_factory()
+        self.engine = get_engine(self.conn_str, echo=self.echo)
+        self.session: Session = _session_factories[self.engine]()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -50,7 +133,7 @@ class DbConnManager:
 def file_register(
         conn: DbConnManager,
         data: StorageObject | StorageVersion,
-        filename: str,
+        filename: str | None,
         status_id: int
 ) -> bool:
     with DbConnManager(conn.conn_str) as conn:
@@ -100,6 +183,323 @@ def file_get_status(conn: DbConnManager, file_id: str) -> int:
         return res.status_id
 
 
+def file_set_status_by_blob(conn: DbConnManager, blob_hash: str, status_id: int) -> int:
+    """
+    Set status of all files referring to the blob. Returns count of files.
+    """
+    with DbConnManager(conn.conn_str) as conn:
+        count: int = conn.session.query(SpiderFile).filter(SpiderFile.blob_hash == blob_hash).update(
+            {SpiderFile.status_id: status_id}
+        )
+        conn.commit()
+        return count
+
+
+def _any_id(file_ids: Iterable) -> any_:
+    """
+    `= ANY(:ids)` with one array parameter instead of IN (...) list.
+    """
+    return any_(bindparam('file_ids', list(file_ids), type_=postgresql.ARRAY(postgresql.UUID)))
+
+
+def file_register_many(
+        conn: DbConnManager,
+        rows: Iterable[StorageObject | StorageVersion],
+        status_id: int,
+) -> set:
+    """
+    Register chunk of files with one INSERT ... ON CONFLICT DO NOTHING.
+    Returns ids of newly registered files.
+
+    Batch helpers run on `conn` itself, without a new engine per call.
+    `conn` must not hold an open streaming cursor: commit closes it.
+    """
+    values: list[dict] = [
+        {
+            'storage_object_id': row.id,
+            'storage_object_name': row.name,
+            'storage_object_site_id': row.site_id,
+            'storage_version_size': row.size,
+            'storage_version_link': row.link,
+            'status_id': status_id,
+        }
+        for row in rows
+    ]
+    if not values:
+        return set()
+    query = insert(SpiderFile).values(values).on_conflict_do_nothing(
+        index_elements=[SpiderFile.storage_object_id],
+    ).returning(SpiderFile.storage_object_id)
+    registered: set = set(conn.session.execute(query).scalars())
+    conn.commit()
+    return registered
+
+
+def file_set_status_many(conn: DbConnManager, file_ids: Iterable, status_id: int) -> int:
+    """
+    Set status of chunk of files with one UPDATE. Returns count of files.
+    """
+    return file_update_many(conn, file_ids, status_id=status_id)
+
+
+def file_update_many(conn: DbConnManager, file_ids: Iterable, **values) -> int:
+    """
+    Set the same column values for chunk of files with one UPDATE.
+    Returns count of files.
+    """
+    query = update(SpiderFile).where(
+        SpiderFile.storage_object_id == _any_id(file_ids),
+    ).values(
+        {getattr(SpiderFile, name): value for name, value in values.items()}
+    )
+    count: int = conn.session.execute(query).rowcount
+    conn.commit()
+    return count
+
+
+def file_get_many(conn: DbConnManager, file_ids: Iterable) -> dict:
+    """
+    Bulk lookup of registered files. Returns {storage_object_id: Row}.
+    """
+    query = select(
+        SpiderFile.storage_object_id,
+        SpiderFile.storage_version_link,
+        SpiderFile.blob_hash,
+        SpiderFile.etag,
+        SpiderFile.last_modified,
+        SpiderFile.status_id,
+    ).where(
+        SpiderFile.storage_object_id == _any_id(file_ids),
+    )
+    return {row.storage_object_id: row for row in conn.session.execute(query)}
+
+
+def file_select_many(conn: DbConnManager, file_ids: Iterable, status_ids: Iterable[int]) -> list[SpiderFile]:
+    """
+    Bulk select of registered files having one of the statuses.
+    Files without content (failed downloads have error status too) aren't selected.
+    """
+    query = select(SpiderFile).where(
+        SpiderFile.storage_object_id == _any_id(file_ids),
+        SpiderFile.status_id.in_(status_ids),
+        SpiderFile.target_path.is_not(None),
+    )
+    return list(conn.session.execute(query).scalars())
+
+
+def file_find_blobs(conn: DbConnManager, links: Iterable[str]) -> dict:
+    """
+    Bulk lookup of already downloaded blobs. Returns {(link, size): blob_hash}.
+    """
+    query = select(
+        SpiderFile.storage_version_link,
+        SpiderFile.storage_version_size,
+        SpiderFile.blob_hash,
+    ).where(
+        SpiderFile.storage_version_link == any_(
+            bindparam('links', list(links), type_=postgresql.ARRAY(postgresql.TEXT))
+        ),
+        SpiderFile.blob_hash.is_not(None),
+    )
+    return {
+        (row.storage_version_link, row.storage_version_size): row.blob_hash
+        for row in conn.session.execute(query)
+    }
+
+
+def file_get_present(conn: DbConnManager) -> dict[str, str]:
+    """
+    Registered files not marked as deleted: their chunks may be in the
+    collection. Returns {storage_object_id: name}.
+    """
+    query = select(
+        SpiderFile.storage_object_id,
+        SpiderFile.storage_object_name,
+    ).where(
+        SpiderFile.status_id != Status.deleted.value,
+    )
+    return {str(row.storage_object_id): row.storage_object_name for row in conn.session.execute(query)}
+
+
+def page_register_many(conn: DbConnManager, rows: Iterable[Row]) -> int:
+    """
+    Register chunk of imported pages (page_id, name, site_id) with one
+    INSERT ... ON CONFLICT DO UPDATE. Returns count of pages.
+    """
+    values: dict = {
+        row.page_id: {'page_id': row.page_id, 'page_name': row.name, 'site_id': str(row.site_id)}
+        for row in rows
+    }
+    if not values:
+        return 0
+    query = insert(SpiderPage).values(list(values.values()))
+    query = query.on_conflict_do_update(
+        index_elements=[SpiderPage.page_id],
+        set_={'page_name': query.excluded.page_name, 'site_id': query.excluded.site_id},
+    )
+    conn.session.execute(query)
+    conn.commit()
+    return len(values)
+
+
+def page_get_all(conn: DbConnManager) -> dict[str, str]:
+    """
+    Registered pages: {page_id: name}
+    """
+    query = select(SpiderPage.page_id, SpiderPage.page_name)
+    return {str(row.page_id): row.page_name for row in conn.session.execute(query)}
+
+
+def page_delete_many(conn: DbConnManager, page_ids: Iterable) -> int:
+    """
+    Forget removed pages with one DELETE. Returns count of pages.
+    """
+    count: int = conn.session.execute(
+        delete(SpiderPage).where(
+            SpiderPage.page_id == any_(bindparam('page_ids', list(page_ids), type_=postgresql.ARRAY(postgresql.UUID))),
+        )
+    ).rowcount
+    conn.commit()
+    return count
+
+
+def get_watermark(source: str) -> datetime:
+    """
+    Rows of the source changed after the watermark have to be imported.
+    In full sync mode everything is imported.
+    """
+    if settings.sync_mode != 'incremental':
+        return datetime.fromtimestamp(0, UTC)
+    with DbConnManager(settings.db_conn_str) as conn:
+        watermark: datetime = Checkpoint.get_last(conn, source)
+    logger.info(f"Watermark of {source}: {watermark}")
+    return watermark
+
+
+def set_watermark(source: str, ts: datetime) -> None:
+    with DbConnManager(settings.db_conn_str) as conn:
+        Checkpoint.log(conn, source, ts)
+    logger.info(f"New watermark of {source}: {ts}")
+
+
+def _any_hash(text_hashes: Iterable[str]) -> any_:
+    return any_(bindparam('text_hashes', list(text_hashes), type_=postgresql.ARRAY(postgresql.VARCHAR)))
+
+
+def embed_cache_get_many(conn: DbConnManager, model: str, text_hashes: Iterable[str]) -> dict[str, bytes]:
+    """
+    Bulk lookup of cached vectors. Returns {text_hash: vector}, found
+    vectors are marked as used.
+    """
+    text_hashes = list(text_hashes)
+    query = select(
+        EmbeddingCache.text_hash,
+        EmbeddingCache.vector,
+    ).where(
+        EmbeddingCache.model == model,
+        EmbeddingCache.text_hash == _any_hash(text_hashes),
+    )
+    vectors: dict[str, bytes] = {row.text_hash: row.vector for row in conn.session.execute(query)}
+    if vectors:
+        conn.session.execute(
+            update(EmbeddingCache).where(
+                EmbeddingCache.model == model,
+                EmbeddingCache.text_hash == _any_hash(vectors),
+            ).values(used_ts=func.now())
+        )
+        conn.commit()
+    return vectors
+
+
+def embed_cache_put_many(conn: DbConnManager, model: str, vectors: dict[str, bytes]) -> None:
+    """
+    Store vectors with one INSERT ... ON CONFLICT DO NOTHING
+    """
+    if not vectors:
+        return
+    query = insert(EmbeddingCache).values([
+        {'model': model, 'text_hash': text_hash, 'vector': vector, 'used_ts': func.now()}
+        for text_hash, vector in vectors.items()
+    ]).on_conflict_do_nothing(
+        index_elements=[EmbeddingCache.model, EmbeddingCache.text_hash],
+    )
+    conn.session.execute(query)
+    conn.commit()
+
+
+def embed_cache_evict(conn: DbConnManager, max_size: int) -> int:
+    """
+    Keeps `max_size` most recently used vectors. Returns count of evicted ones.
+
+    Rows past `max_size` are evicted by primary key: rows used at the same
+    time as the last kept one stay.
+    """
+    evicted = select(
+        EmbeddingCache.model,
+        EmbeddingCache.text_hash,
+    ).order_by(
+        desc(EmbeddingCache.used_ts),
+    ).offset(max_size)
+    count: int = conn.session.execute(
+        delete(EmbeddingCache).where(tuple_(EmbeddingCache.model, EmbeddingCache.text_hash).in_(evicted))
+    ).rowcount
+    conn.commit()
+    return count
+
+
+def dead_letter_put_many(conn: DbConnManager, collection: str, objects: Iterable[dict]) -> int:
+    """
+    Records objects which weren't written to weaviate. An object is
+    {'uuid', 'error', 'properties'}, properties are stored as JSON.
+    """
+    rows: list[dict] = [
+        {
+            'collection': collection,
+            'object_id': str(item['properties'].get('object_id')),
+            'chunk_uuid': item['uuid'],
+            'error': item['error'],
+            # Dates and uuids of the properties as strings
+            'properties': json.loads(json.dumps(item['properties'], default=str)),
+        }
+        for item in objects
+    ]
+    if rows:
+        conn.session.execute(insert(DeadLetter).values(rows))
+        conn.commit()
+    return len(rows)
+
+
+def dead_letter_get_ids(conn: DbConnManager, collection: str, object_type: str) -> list[str]:
+    """
+    Source objects (pages, files) of the type with dead-lettered chunks:
+    they are imported again whatever the watermark.
+    """
+    query = select(
+        DeadLetter.object_id,
+    ).where(
+        DeadLetter.collection == collection,
+        DeadLetter.properties['type'].astext == object_type,
+    ).distinct()
+    return [row.object_id for row in conn.session.execute(query)]
+
+
+def dead_letter_delete_many(conn: DbConnManager, collection: str, object_ids: Iterable[str]) -> int:
+    """
+    Forget dead-lettered chunks of the source objects written again
+    """
+    object_ids = [str(object_id) for object_id in object_ids]
+    if not object_ids:
+        return 0
+    count: int = conn.session.execute(
+        delete(DeadLetter).where(
+            DeadLetter.collection == collection,
+            DeadLetter.object_id == any_(bindparam('object_ids', object_ids, type_=postgresql.ARRAY(postgresql.TEXT))),
+        )
+    ).rowcount
+    conn.commit()
+    return count
+
+
 def get_sites(full: bool = True) -> Iterable[Row]:
     with (DbConnManager(settings.vk_db_conn_str_cms) as conn):
         query = select(
@@ -135,6 +535,21 @@ def get_storage_object(storage_object_id: str) -> StorageObject:
         return result
 
 
+def get_deleted_files() -> list:
+    """
+    Ids of soft-deleted files of our sites in filestorage
+    """
+    with DbConnManager(settings.vk_db_conn_str_filestorage) as conn:
+        query = select(
+            StorageObject.id,
+        ).where(
+            StorageObject.type == 1,                        # Type file
+            StorageObject.site_id.in_(settings.site_ids),   # Our sites
+            StorageObject.deleted_at.is_not(None),
+        )
+        return list(conn.session.execute(query).scalars())
+
+
 def compile_sql(query: Union[type[Query], type[Delete]]):
     if isinstance(query, Query):
         return str(query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
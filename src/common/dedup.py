@@ -0,0 +1,110 @@
+import random
+import re
+import zlib
+from array import array
+from collections.abc import Hashable
+
+from src.common.settings import settings
+
+# Near-duplicate chunks: MinHash signatures of word shingles, LSH index of
+# signature bands. Chunks sharing a band with an indexed one are compared
+# by their signatures: share of equal MinHash values estimates Jaccard
+# similarity of their shingle sets.
+
+MASK: int = (1 << 64) - 1           # Permutations: multiply-shift, high 32 bits of 64
+WORD = re.compile(r'\w+')
+
+
+class NearDuplicates:
+    """
+    Index of the chunks seen in a run.
+
+    check() returns the key of an earlier chunk with estimated similarity
+    at least `threshold`, None if there is no such chunk: then the chunk is
+    indexed under its key. With `bands` bands of `num_perm / bands` rows
+    pairs well below the threshold are rarely compared at all.
+    """
+    def __init__(
+            self,
+            threshold: float | None = None,
+            num_perm: int | None = None,
+            bands: int | None = None,
+            shingle: int | None = None,
+    ):
+        self.threshold: float = settings.dedup_threshold if threshold is None else threshold
+        self.num_perm: int = settings.dedup_num_perm if num_perm is None else num_perm
+        self.bands: int = settings.dedup_bands if bands is None else bands
+        self.shingle: int = settings.dedup_shingle if shingle is None else shingle
+        assert self.num_perm % self.bands == 0, f"{self.num_perm} permutations don't split into {self.bands} bands"
+        self.rows: int = self.num_perm // self.bands
+
+        rnd = random.Random(42)     # Same permutations in every run
+        self.perms: list[tuple[int, int]] = [
+            (rnd.getrandbits(64) | 1, rnd.getrandbits(64)) for _ in range(self.num_perm)
+        ]
+        self.buckets: dict[tuple[int, int], list[int]] = {}
+        self.signatures: list[array] = []
+        self.keys: list[Hashable] = []
+
+    def signature(self, text: str) -> array | None:
+        """
+        MinHash of the word shingles of the text, None if it has no words
+        """
+        words: list[str] = WORD.findall(text.lower())
+        if not words:
+            return None
+        size: int = min(self.shingle, len(words))
+        hashes: set[int] = {
+            zlib.crc32(' '.join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)
+        }
+        return array('L', (
+            min([(a * h + b) & MASK for h in hashes]) >> 32 for a, b in self.perms
+        ))
+
+    def similarity(self, first: array, second: array) -> float:
+        return sum(x == y for x, y in zip(first, second)) / self.num_perm
+
+    def check(self, text: str, key: Hashable) -> Hashable | None:
+        signature: array | None = self.signature(text)
+        if signature is None:
+            return None
+        bands: list[tuple[int, int]] = [
+            (band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+        candidates: set[int] = {i for band in bands for i in self.buckets.get(band, ())}
+        for i in sorted(candidates):
+            if self.similarity(signature, self.signatures[i]) >= self.threshold:
+                return self.keys[i]
+
+        i: int = len(self.signatures)
+        self.signatures.append(signature)
+        self.keys.append(key)
+        for band in bands:
+            self.buckets.setdefault(band, []).append(i)
+        return None
+
+
+def run_duplicates() -> NearDuplicates | None:
+    """
+    Index of the task run if chunks are deduplicated, None otherwise.
+
+    Only a full rebuild is deduplicated: the copy of a passage isn't stored,
+    so after an incremental update or a prune of the kept chunk the passage
+    would be lost until the next rebuild. An incremental run inserts all chunks.
+    """
+    if settings.dedup_enabled and settings.sync_mode == 'full':
+        return NearDuplicates()
+    return None
+
+
+def run_blobs() -> set[str] | None:
+    """
+    Blobs imported in the task run if storage objects with the same content
+    are imported once (under the first of them), None otherwise.
+
+    Full sync mode only, like run_duplicates(): the other objects have no
+    chunks of their own, an update or a removal of the first one would lose
+    the content. An incremental run imports every object with its own chunks.
+    """
+    return set() if settings.sync_mode == 'full' else None
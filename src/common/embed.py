@@ -0,0 +1,130 @@
+import threading
+from array import array
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.common.db import DbConnManager, embed_cache_evict, embed_cache_get_many, embed_cache_put_many
+from src.common.log import logger
+from src.common.settings import settings
+from src.common.utils import make_text_hash
+
+# Client side embeddings (embed_mode = 'client'): chunks are sent to the
+# Ollama embed API in batches of `embed_batch_size`, at most `embed_workers`
+# requests at once, vectors are passed to weaviate with the objects.
+# The model is the one of the collection vectorizer (weaviate_model):
+# queries are still vectorized by weaviate. With `embed_cache_enabled`
+# vectors are kept in Postgres by (model, text hash): only cache misses
+# are sent to the API, texts unchanged since an earlier run aren't.
+
+T = TypeVar('T')
+
+_session: requests.Session | None = None
+_evict_lock = threading.Lock()
+_cached_since_evict: int = 0
+
+
+def get_session() -> requests.Session:
+    """
+    Keep-alive session shared by the embedding requests
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.embed_workers)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def embed_texts(texts: list[str]) -> list[list[float]]:
+    """
+    Vectors of the texts, one request
+    """
+    response = get_session().post(
+        f"{settings.embed_api_endpoint}/api/embed",
+        json={'model': settings.weaviate_model, 'input': texts},
+        timeout=settings.embed_timeout,
+    )
+    if response.status_code != 200:
+        raise AssertionError(f"Embedding failed: {response.status_code} {response.text[:500]}")
+    embeddings: list[list[float]] = response.json()['embeddings']
+    if len(embeddings) != len(texts):
+        raise AssertionError(f"Embedding failed: {len(embeddings)} vectors for {len(texts)} texts")
+    return embeddings
+
+
+def _evict(count: int) -> None:
+    """
+    Evicts least recently used vectors once 1% of the cache size is added
+    """
+    global _cached_since_evict
+    with _evict_lock:
+        _cached_since_evict += count
+        if _cached_since_evict < max(1, settings.embed_cache_size // 100):
+            return
+        _cached_since_evict = 0
+    with DbConnManager(settings.db_conn_str) as conn:
+        if evicted := embed_cache_evict(conn, settings.embed_cache_size):
+            logger.info(f"Evicted from embedding cache: {evicted}")
+
+
+def embed_cached(texts: list[str]) -> tuple[list[list[float]], int]:
+    """
+    Vectors of the texts: from the cache, misses from the embed API.
+    Returns vectors and count of cache hits.
+    """
+    if not settings.embed_cache_enabled:
+        return embed_texts(texts), 0
+
+    model: str = settings.weaviate_model
+    hashes: list[str] = [make_text_hash(text) for text in texts]
+    with DbConnManager(settings.db_conn_str) as conn:
+        cached: dict[str, bytes] = embed_cache_get_many(conn, model, hashes)
+    vectors: dict[str, list[float]] = {
+        text_hash: array('f', vector).tolist() for text_hash, vector in cached.items()
+    }
+    missing: dict[str, str] = {
+        text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in vectors
+    }
+    if missing:
+        vectors.update(zip(missing, embed_texts(list(missing.values()))))
+        with DbConnManager(settings.db_conn_str) as conn:
+            embed_cache_put_many(conn, model, {
+                text_hash: array('f', vectors[text_hash]).tobytes() for text_hash in missing
+            })
+        _evict(len(missing))
+    return [vectors[text_hash] for text_hash in hashes], len(texts) - len(missing)
+
+
+def embed_stream(
+        items: Iterable[T], text: Callable[[T], str], stats: dict,
+) -> Iterator[tuple[T, list[float]]]:
+    """
+    Items with vectors of their text, in the order of the items.
+
+    Items are consumed lazily: a batch is sent as soon as it's filled, the
+    next batches are filled while up to `embed_workers` requests are running.
+    """
+    items = iter(items)
+    pending: deque[tuple[list[T], Future]] = deque()
+    with ThreadPoolExecutor(settings.embed_workers, thread_name_prefix='embed') as pool:
+        while True:
+            if batch := list(islice(items, settings.embed_batch_size)):
+                pending.append((batch, pool.submit(embed_cached, [text(item) for item in batch])))
+                stats['embed_batches'] += 1
+            if not pending:
+                break
+            if batch and len(pending) <= settings.embed_workers:
+                continue    # Keep all workers busy
+            done, future = pending.popleft()
+            vectors, hits = future.result()
+            stats['embedded'] += len(done)
+            stats['embed_cache_hits'] += hits
+            yield from zip(done, vectors)
+
@@ -0,0 +1,431 @@
+import re
+from collections.abc import Callable
+from typing import NamedTuple
+
+from lxml import etree
+from lxml import html as lxml_html
+
+# HTML to markdown on lxml tree.
+# Follows markdownify (heading_style=ATX, other options by default) rule by
+# rule, so the output is the same, but parsing and walking the tree are done
+# by libxml2 instead of BeautifulSoup. Also returns the sections: offsets of
+# the headings in the markdown text.
+
+re_heading = re.compile(r'h(\d+)')
+re_line_with_content = re.compile(r'^(.*)', flags=re.MULTILINE)
+re_whitespace = re.compile(r'[\t ]+')
+re_all_whitespace = re.compile(r'[\t \r\n]+')
+re_newline_whitespace = re.compile(r'[\t \r\n]*[\r\n][\t \r\n]*')
+re_pre_lstrip = re.compile(r'^[ \n]*\n')
+re_pre_rstrip = re.compile(r'[ \n]*$')
+re_extract_newlines = re.compile(r'^(\n*)((?:.*[^\n])?)(\n*)$', flags=re.DOTALL)
+re_backtick_runs = re.compile(r'`+')
+
+# Block elements: whitespace inside and around them is dropped
+BLOCKS: frozenset[str] = frozenset((
+    'p', 'blockquote', 'article', 'div', 'section', 'ol', 'ul', 'li',
+    'dl', 'dt', 'dd', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th',
+))
+BULLETS: str = '*+-'
+# Marks the start of a heading in the text while it's built. Removed from the result.
+SECTION_MARK: str = '\x00'
+
+PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+
+class Section(NamedTuple):
+    start: int      # Offset of the heading in markdown text
+    level: int      # 1-6
+    title: str
+
+
+def _name(node) -> str | None:
+    """
+    Tag name of the element, None for text, comments, processing instructions
+    """
+    if node is None or isinstance(node, str) or not isinstance(node.tag, str):
+        return None
+    return node.tag
+
+
+def _block_inside(name: str | None) -> bool:
+    return name is not None and (name in BLOCKS or re_heading.match(name) is not None)
+
+
+def _block_outside(name: str | None) -> bool:
+    return _block_inside(name) or name == 'pre'
+
+
+def _previous_element(el) -> etree.ElementBase | None:
+    for sibling in el.itersiblings(preceding=True):
+        if isinstance(sibling.tag, str):
+            return sibling
+    return None
+
+
+def _next_content(el) -> str | etree.ElementBase | None:
+    """
+    Next sibling which is an element or non-whitespace text
+    """
+    if el.tail and el.tail.strip():
+        return el.tail
+    for sibling in el.itersiblings():
+        if isinstance(sibling.tag, str):
+            return sibling
+        if sibling.tail and sibling.tail.strip():
+            return sibling.tail
+    return None
+
+
+def _colspan(cell) -> int:
+    colspan: str = cell.get('colspan', '')
+    return max(1, min(1000, int(colspan))) if colspan.isdigit() else 1
+
+
+def _chomp(text: str) -> tuple[str, str, str]:
+    prefix: str = ' ' if text and text[0] == ' ' else ''
+    suffix: str = ' ' if text and text[-1] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+def _inline(markup: str) -> Callable:
+    def convert(el, text: str, parent_tags: frozenset) -> str:
+        if '_noformat' in parent_tags:
+            return text
+        prefix, suffix, text = _chomp(text)
+        if not text:
+            return ''
+        return f"{prefix}{markup}{text}{markup}{suffix}"
+    return convert
+
+
+def convert_a(el, text: str, parent_tags: frozenset) -> str:
+    if '_noformat' in parent_tags:
+        return text
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    href: str | None = el.get('href')
+    title: str | None = el.get('title')
+    if text.replace(r'\_', '_') == href and not title:
+        return f"<{href}>"
+    title_part: str = ' "%s"' % title.replace('"', r'\"') if title else ''
+    return f"{prefix}[{text}]({href}{title_part}){suffix}" if href else text
+
+
+def convert_blockquote(el, text: str, parent_tags: frozenset) -> str:
+    text = (text or '').strip(' \t\r\n')
+    if '_inline' in parent_tags:
+        return ' ' + text + ' '
+    if not text:
+        return '\n'
+    text = re_line_with_content.sub(lambda m: '> ' + m.group(1) if m.group(1) else '>', text)
+    return '\n' + text + '\n\n'
+
+
+def convert_br(el, text: str, parent_tags: frozenset) -> str:
+    if '_inline' in parent_tags:
+        return text + ' ' if text else ' '
+    return '  \n' + text
+
+
+def convert_code(el, text: str, parent_tags: frozenset) -> str:
+    if '_noformat' in parent_tags:
+        return text
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    max_backticks: int = max((len(run) for run in re_backtick_runs.findall(text)), default=0)
+    delimiter: str = '`' * (max_backticks + 1)
+    if max_backticks > 0:
+        text = ' ' + text + ' '
+    return f"{prefix}{delimiter}{text}{delimiter}{suffix}"
+
+
+def convert_div(el, text: str, parent_tags: frozenset) -> str:
+    if '_inline' in parent_tags:
+        return ' ' + text.strip() + ' '
+    text = text.strip()
+    return f"\n\n{text}\n\n" if text else ''
+
+
+def convert_dd(el, text: str, parent_tags: frozenset) -> str:
+    text = (text or '').strip()
+    if '_inline' in parent_tags:
+        return ' ' + text + ' '
+    if not text:
+        return '\n'
+    text = re_line_with_content.sub(lambda m: '    ' + m.group(1) if m.group(1) else '', text)
+    return ':' + text[1:] + '\n'
+
+
+def convert_dt(el, text: str, parent_tags: frozenset) -> str:
+    text = re_all_whitespace.sub(' ', (text or '').strip())
+    if '_inline' in parent_tags:
+        return ' ' + text + ' '
+    if not text:
+        return '\n'
+    return f"\n\n{text}\n"
+
+
+def convert_heading(el, text: str, parent_tags: frozenset) -> str:
+    if '_inline' in parent_tags:
+        return text
+    level: int = max(1, min(6, int(re_heading.match(el.tag).group(1))))
+    text = re_all_whitespace.sub(' ', text.strip())
+    return f"\n\n{SECTION_MARK}{'#' * level} {text}\n\n"
+
+
+def convert_hr(el, text: str, parent_tags: frozenset) -> str:
+    return '\n\n---\n\n'
+
+
+def convert_img(el, text: str, parent_tags: frozenset) -> str:
+    alt: str = el.get('alt') or ''
+    if '_inline' in parent_tags:
+        return alt
+    src: str = el.get('src') or ''
+    title: str = el.get('title') or ''
+    title_part: str = ' "%s"' % title.replace('"', r'\"') if title else ''
+    return f"![{alt}]({src}{title_part})"
+
+
+def convert_video(el, text: str, parent_tags: frozenset) -> str:
+    if '_inline' in parent_tags:
+        return text
+    src: str = el.get('src') or next(
+        (source.get('src') for source in el.iterdescendants('source') if source.get('src') is not None), ''
+    )
+    poster: str = el.get('poster') or ''
+    if src and poster:
+        return f"[![{text}]({poster})]({src})"
+    if src:
+        return f"[{text}]({src})"
+    if poster:
+        return f"![{text}]({poster})"
+    return text
+
+
+def convert_list(el, text: str, parent_tags: frozenset) -> str:
+    next_sibling = _next_content(el)
+    before_paragraph: bool = next_sibling is not None and _name(next_sibling) not in ('ul', 'ol')
+    if 'li' in parent_tags:
+        return '\n' + text.rstrip()
+    return '\n\n' + text + ('\n' if before_paragraph else '')
+
+
+def convert_li(el, text: str, parent_tags: frozenset) -> str:
+    text = (text or '').strip()
+    if not text:
+        return '\n'
+    parent = el.getparent()
+    if parent is not None and parent.tag == 'ol':
+        start: str = parent.get('start') or ''
+        number: int = int(start) if start.isnumeric() else 1
+        bullet: str = f"{number + sum(1 for _ in el.itersiblings('li', preceding=True))}."
+    else:
+        depth: int = sum(1 for _ in el.iterancestors('ul')) - 1
+        bullet = BULLETS[depth % len(BULLETS)]
+    bullet += ' '
+    indent: str = ' ' * len(bullet)
+    text = re_line_with_content.sub(lambda m: indent + m.group(1) if m.group(1) else '', text)
+    return bullet + text[len(bullet):] + '\n'
+
+
+def convert_p(el, text: str, parent_tags: frozenset) -> str:
+    if '_inline' in parent_tags:
+        return ' ' + text.strip(' \t\r\n') + ' '
+    text = text.strip(' \t\r\n')
+    return f"\n\n{text}\n\n" if text else ''
+
+
+def convert_pre(el, text: str, parent_tags: frozenset) -> str:
+    if not text:
+        return ''
+    text = re_pre_rstrip.sub('', re_pre_lstrip.sub('', text))
+    return f"\n\n```\n{text}\n```\n\n"
+
+
+def convert_q(el, text: str, parent_tags: frozenset) -> str:
+    return '"' + text + '"'
+
+
+def convert_table(el, text: str, parent_tags: frozenset) -> str:
+    return '\n\n' + text.strip() + '\n\n'
+
+
+def convert_caption(el, text: str, parent_tags: frozenset) -> str:
+    return text.strip() + '\n\n'
+
+
+def convert_figcaption(el, text: str, parent_tags: frozenset) -> str:
+    return '\n\n' + text.strip() + '\n\n'
+
+
+def convert_cell(el, text: str, parent_tags: frozenset) -> str:
+    return ' ' + text.strip().replace('\n', ' ') + ' |' * _colspan(el)
+
+
+def convert_tr(el, text: str, parent_tags: frozenset) -> str:
+    cells: list = list(el.iter('td', 'th'))
+    parent = el.getparent()
+    is_first_row: bool = _previous_element(el) is None
+    is_headrow: bool = (
+        all(cell.tag == 'th' for cell in cells)
+        or (parent.tag == 'thead' and sum(1 for _ in parent.iter('tr')) == 1)
+    )
+    is_head_row_missing: bool = is_first_row and (
+        parent.tag != 'tbody' or next(parent.getparent().iter('thead'), None) is None
+    )
+    full_colspan: int = sum(_colspan(cell) for cell in cells)
+    overline, underline = '', ''
+    if is_headrow and is_first_row:
+        underline = '| ' + ' | '.join(['---'] * full_colspan) + ' |\n'
+    elif is_head_row_missing or (is_first_row and (
+            parent.tag == 'table' or (parent.tag == 'tbody' and _previous_element(parent) is None)
+    )):
+        overline = '| ' + ' | '.join([''] * full_colspan) + ' |\n'
+        overline += '| ' + ' | '.join(['---'] * full_colspan) + ' |\n'
+    return overline + '|' + text + '\n' + underline
+
+
+# Tag -> conversion of its converted content. Tags without conversion are passed as is.
+CONVERTERS: dict[str, Callable] = {
+    'a': convert_a,
+    'b': _inline('**'),
+    'strong': _inline('**'),
+    'em': _inline('*'),
+    'i': _inline('*'),
+    'del': _inline('~~'),
+    's': _inline('~~'),
+    'sub': _inline(''),
+    'sup': _inline(''),
+    'blockquote': convert_blockquote,
+    'br': convert_br,
+    'code': convert_code,
+    'kbd': convert_code,
+    'samp': convert_code,
+    'div': convert_div,
+    'article': convert_div,
+    'section': convert_div,
+    'dl': convert_div,
+    'dd': convert_dd,
+    'dt': convert_dt,
+    'hr': convert_hr,
+    'img': convert_img,
+    'video': convert_video,
+    'ul': convert_list,
+    'ol': convert_list,
+    'li': convert_li,
+    'p': convert_p,
+    'pre': convert_pre,
+    'q': convert_q,
+    'table': convert_table,
+    'caption': convert_caption,
+    'figcaption': convert_figcaption,
+    'td': convert_cell,
+    'th': convert_cell,
+    'tr': convert_tr,
+}
+
+
+def _process_text(text: str, prev, nxt, parent: str, parent_tags: frozenset) -> str:
+    if 'pre' not in parent_tags:
+        text = re_whitespace.sub(' ', re_newline_whitespace.sub('\n', text))
+    if '_noformat' not in parent_tags:
+        text = text.replace('*', r'\*').replace('_', r'\_')
+    if _block_outside(_name(prev)) or (prev is None and _block_inside(parent)):
+        text = text.lstrip(' \t\r\n')
+    if _block_outside(_name(nxt)) or (nxt is None and _block_inside(parent)):
+        text = text.rstrip()
+    return text
+
+
+def _process_tag(el, parent_tags: frozenset) -> str:
+    name: str = el.tag
+    if name in ('script', 'style'):
+        return ''
+
+    # Child nodes: text, elements with their tails
+    nodes: list = [el.text] if el.text else []
+    for child in el:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+
+    child_tags = {name}
+    if name in ('td', 'th') or re_heading.match(name):
+        child_tags.add('_inline')
+    if name in ('pre', 'code', 'kbd', 'samp'):
+        child_tags.add('_noformat')
+    child_tags: frozenset = parent_tags | child_tags
+
+    remove_inside: bool = _block_inside(name)
+    strings: list[str] = []
+    last: int = len(nodes) - 1
+    for i, node in enumerate(nodes):
+        prev = nodes[i - 1] if i > 0 else None
+        nxt = nodes[i + 1] if i < last else None
+        if isinstance(node, str):
+            if not node.strip() and (
+                    (remove_inside and (prev is None or nxt is None))
+                    or _block_outside(_name(prev)) or _block_outside(_name(nxt))
+            ):
+                continue
+            string: str = _process_text(node, prev, nxt, name, child_tags)
+        elif isinstance(node.tag, str):
+            string = _process_tag(node, child_tags)
+        else:
+            continue    # Comment, processing instruction
+        if string:
+            strings.append(string)
+
+    if 'pre' in child_tags:
+        text: str = ''.join(strings)
+    else:
+        # Collapse newlines at child element boundaries: not more than 2
+        parts: list[str] = ['']
+        for string in strings:
+            leading, content, trailing = re_extract_newlines.match(string).groups()
+            if parts[-1] and leading:
+                leading = '\n' * min(2, max(len(parts.pop()), len(leading)))
+            parts.extend((leading, content, trailing))
+        text = ''.join(parts)
+
+    convert: Callable | None = CONVERTERS.get(name)
+    if convert is None and re_heading.match(name):
+        convert = convert_heading
+    return convert(el, text, parent_tags) if convert is not None else text
+
+
+def _convert(html: str) -> str:
+    html = html.replace(SECTION_MARK, '')
+    if not html.strip():
+        return ''
+    try:
+        root = lxml_html.document_fromstring(html.encode('utf-8'), parser=PARSER)
+    except etree.ParserError:   # Nothing but comments, etc.
+        return ''
+    return _process_tag(root, frozenset()).strip('\n')
+
+
+def html2markdown(html: str) -> str:
+    """
+    HTML >> Markdown: headings (ATX), lists, tables, links, emphasis
+    """
+    return _convert(html).replace(SECTION_MARK, '')
+
+
+def html2markdown_sections(html: str) -> tuple[str, list[Section]]:
+    """
+    HTML >> Markdown with sections: offsets, levels and titles of the headings
+    """
+    parts: list[str] = _convert(html).split(SECTION_MARK)
+    sections: list[Section] = []
+    offset: int = len(parts[0])
+    for part in parts[1:]:
+        heading: str = part.split('\n', maxsplit=1)[0]
+        title: str = heading.lstrip('#')
+        sections.append(Section(offset, len(heading) - len(title), title.strip()))
+        offset += len(part)
+    return ''.join(parts), sections
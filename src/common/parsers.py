@@ -0,0 +1,320 @@
+import mimetypes
+import os
+import zipfile
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from typing import NamedTuple
+
+from src.common.converter import group_paragraphs, run_converter
+from src.common.log import logger
+from src.common.settings import settings
+from src.models.cat_meta import SpiderFile
+
+# Parsers of downloaded files by MIME type. The type is sniffed from the
+# magic bytes, the file name is used only when the content tells nothing.
+# Backends (PyPDF2, openpyxl, ...) are imported by the parser on first use.
+
+MIME_PDF: str = 'application/pdf'
+MIME_DOC: str = 'application/msword'
+MIME_XLS: str = 'application/vnd.ms-excel'
+MIME_PPT: str = 'application/vnd.ms-powerpoint'
+MIME_DOCX: str = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+MIME_XLSX: str = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MIME_PPTX: str = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+MIME_ZIP: str = 'application/zip'
+MIME_OLE: str = 'application/x-ole-storage'
+MIME_UNKNOWN: str = 'application/octet-stream'
+
+# Magic bytes -> MIME type
+MAGIC: tuple[tuple[bytes, str], ...] = (
+    (b'%PDF-', MIME_PDF),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', MIME_OLE),
+    (b'PK\x03\x04', MIME_ZIP),
+    (b'{\\rtf', 'application/rtf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+)
+MAGIC_LEN: int = max(len(magic) for magic, _ in MAGIC)
+
+# OLE2 compound file (.doc, .xls, .ppt): stream name -> MIME type
+OLE_STREAMS: dict[str, str] = {
+    'WordDocument': MIME_DOC,
+    'Workbook': MIME_XLS,
+    'Book': MIME_XLS,
+    'PowerPoint Document': MIME_PPT,
+}
+OLE_DIR_SECTORS: int = 8    # Directory sectors scanned for the stream names
+
+# Zip container (Office Open XML): member -> MIME type
+ZIP_MEMBERS: dict[str, str] = {
+    'word/document.xml': MIME_DOCX,
+    'xl/workbook.xml': MIME_XLSX,
+    'ppt/presentation.xml': MIME_PPTX,
+}
+
+# Chars of .doc text per piece read from antiword
+DOC_PIECE_SIZE: int = 64 * 1024
+
+
+class Parser(NamedTuple):
+    name: str
+    # Bump the version when output of the parser changes:
+    # parsed text cache is invalidated for this parser only.
+    version: int
+    # (file, stats) -> (page number, text)
+    parse: Callable[[SpiderFile, dict], Iterator[tuple[int | None, str]]]
+
+
+# MIME type -> parser
+PARSERS: dict[str, Parser] = {}
+
+
+def register_parser(*mime_types: str, version: int = 1) -> Callable:
+    """
+    Decorator registering the function as the parser of the MIME types
+    """
+    def decorator(func: Callable) -> Callable:
+        parser = Parser(func.__name__, version, func)
+        for mime_type in mime_types:
+            PARSERS[mime_type] = parser
+        return func
+    return decorator
+
+
+def _sniff_ole(f) -> str:
+    """
+    Type of OLE2 compound file by the names of its streams
+    """
+    f.seek(0)
+    header: bytes = f.read(512)
+    sector_size: int = 1 << int.from_bytes(header[0x1E:0x20], 'little')
+    dir_sector: int = int.from_bytes(header[0x30:0x34], 'little')
+    # Directory sectors are usually contiguous, the FAT chain isn't followed
+    f.seek((dir_sector + 1) * sector_size)
+    directory: bytes = f.read(sector_size * OLE_DIR_SECTORS)
+    for i in range(0, len(directory) - 127, 128):
+        name_len: int = int.from_bytes(directory[i + 64:i + 66], 'little')
+        name: str = directory[i:i + max(name_len - 2, 0)].decode('utf-16-le', errors='ignore')
+        if name in OLE_STREAMS:
+            return OLE_STREAMS[name]
+    return MIME_OLE
+
+
+def _sniff_zip(file_path: str) -> str:
+    """
+    Type of zip container by its members. Only the central directory is read.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            names: set[str] = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return MIME_ZIP
+    for member, mime_type in ZIP_MEMBERS.items():
+        if member in names:
+            return mime_type
+    return MIME_ZIP
+
+
+def sniff_mime(file_path: str, file_name: str | None = None) -> str:
+    """
+    MIME type of the file by its magic bytes.
+    Falls back to the file name if the content is not recognised.
+    MIME_UNKNOWN if there is no file: nothing to parse whatever the name is.
+    """
+    if not file_path or not os.path.isfile(file_path):
+        return MIME_UNKNOWN
+    mime_type: str | None = None
+    with open(file_path, 'rb') as f:
+        head: bytes = f.read(MAGIC_LEN)
+        for magic, magic_type in MAGIC:
+            if head.startswith(magic):
+                mime_type = magic_type
+                break
+        if mime_type == MIME_OLE:
+            mime_type = _sniff_ole(f)
+    if mime_type == MIME_ZIP:
+        mime_type = _sniff_zip(file_path)
+
+    # Container of unknown kind or no magic at all: trust the name
+    if mime_type in (None, MIME_OLE, MIME_ZIP) and file_name:
+        mime_type = mimetypes.guess_type(file_name)[0] or mime_type
+    return mime_type or MIME_UNKNOWN
+
+
+def get_parser(file_path: str, file_name: str | None = None) -> tuple[str, Parser | None]:
+    """
+    Returns (MIME type, parser) of the file. Parser is None if the type is not supported.
+    """
+    mime_type: str = sniff_mime(file_path, file_name)
+    return mime_type, PARSERS.get(mime_type)
+
+
+@register_parser(MIME_DOC, version=2)   # 2: streamed by groups of paragraphs
+def parse_doc(file: SpiderFile, stats: dict) -> Iterator[tuple[None, str]]:
+    """
+    Extracts text from .doc files with antiword - CLI tool.
+
+    antiword is started right away by the converter runner, so the next
+    .doc files convert in parallel while this one is read. Its stdout is
+    streamed: yields (None, text) by groups of paragraphs.
+    """
+    file_name: str = file.storage_object_name
+    file_path: str = file.target_path
+    logger.info(msg := f"Parsing file: {file_path} ...")
+    if file_name not in stats:
+        stats[file_name] = defaultdict(int)
+    stats = stats[file_name]
+    # Formatted text with page breaks (^L/form feed character)
+    output: Iterator[str] = run_converter(['antiword', '-f', file_path])
+
+    def read() -> Iterator[tuple[None, str]]:
+        try:
+            for text in group_paragraphs(output, DOC_PIECE_SIZE):
+                stats['text_len'] += len(text)
+                yield None, text
+        except AssertionError as e:
+            logger.error(error := f"Error parsing .doc file: {e}")
+            raise AssertionError(error)
+        except FileNotFoundError:
+            logger.error(
+                error := (
+                    "Error: antiword is required but not installed. Install with:\n"
+                    "sudo apt-get install antiword"
+                )
+            )
+            raise AssertionError(error)
+
+        if stats['text_len'] > 0:
+            stats['parsed'] = 1
+        logger.info(f"{msg} done")
+
+    return read()
+    # Split text into pages using form feed character
+    # pages = full_text.split('\x0c')     # It's not working!!!
+    # stats['pages'] = len(pages)
+    #
+    # structured_pages = []
+    # for page_num, page_content in enumerate(pages, start=1):
+    #     # Clean and split into paragraphs
+    #     paragraphs = [p.strip() for p in page_content.split('\n\n') if p.strip()]
+    #
+    #     if paragraphs:  # Skip empty pages
+    #         structured_pages.append({
+    #             'page_number': page_num,
+    #             'paragraphs': paragraphs
+    #         })
+    #         stats[f"page_{page_num}"] = len(paragraphs)
+
+
+@register_parser(MIME_PDF, version=2)   # 2: page by page
+def parse_pdf(file: SpiderFile, stats: dict) -> Iterator[tuple[int, str]]:
+    """
+    Extracts text from .pdf files page by page.
+    Uses PyPDF2 to extract text from PDF files.
+
+    Yields (page number, text), so memory is bounded by the page, not by the document.
+    """
+    file_name: str = file.storage_object_name
+    file_path: str = file.target_path
+    logger.info(msg := f"Parsing PDF file: {file_path} ...")
+    if file_name not in stats:
+        stats[file_name] = defaultdict(int)
+    stats = stats[file_name]
+
+    import PyPDF2
+
+    try:
+        # Open PDF file and read it using PyPDF2
+        with open(file_path, 'rb') as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            for page_num, page in enumerate(reader.pages, start=1):
+                # Extract text from each page
+                text = page.extract_text()
+                if text:
+                    stats['text_len'] += len(text)
+                    stats['pages'] += 1
+                    yield page_num, text
+    except Exception as e:
+        logger.error(msg := f"Error parsing PDF file: {e}")
+        raise AssertionError(msg)
+
+    if stats['text_len'] > 0:
+        stats['parsed'] = 1
+    else:
+        logger.info(f"Text length: {stats['text_len']}")
+    logger.info(f"{msg} done")
+
+
+def format_row(row: tuple) -> str:
+    """
+    Excel row as text: non-empty cells separated by ' | '
+    """
+    return ' | '.join('' if value is None else str(value).strip() for value in row).rstrip(' |')
+
+
+@register_parser(MIME_XLSX, version=2)  # 2: row groups with sheet name and header
+def parse_excel(file: SpiderFile, stats: dict) -> Iterator[tuple[None, str]]:
+    """
+    Extracts text from .xlsx (Excel) files as groups of rows.
+    Uses openpyxl in read-only mode: rows are streamed from the file,
+    memory doesn't depend on the sheet size.
+
+    Yields (None, text) per group of rows up to `text_chunk_size` chars.
+    Every group starts with the sheet name and the header (first non-empty row),
+    so a chunk is readable without the rest of the sheet.
+    """
+    file_name: str = file.storage_object_name
+    file_path: str = file.target_path
+    logger.info(msg := f"Parsing Excel file: {file_path} ...")
+    if file_name not in stats:
+        stats[file_name] = defaultdict(int)
+    stats = stats[file_name]
+
+    import openpyxl
+
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        logger.error(msg := f"Error parsing Excel file: {e}")
+        raise AssertionError(msg)
+
+    try:
+        for sheet in workbook.worksheets:
+            title: str = f"Sheet: {sheet.title}\n"
+            header: str | None = None
+            rows: list[str] = []
+            rows_len: int = 0
+            for row in sheet.iter_rows(values_only=True):
+                line: str = format_row(row)
+                if not line:
+                    continue
+                stats['rows'] += 1
+                if header is None:
+                    header = f"{title}{line}\n"
+                    continue
+                if rows and len(header) + rows_len + len(line) > settings.text_chunk_size:
+                    text = header + '\n'.join(rows)
+                    stats['text_len'] += len(text)
+                    yield None, text
+                    rows, rows_len = [], 0
+                rows.append(line)
+                rows_len += len(line) + 1
+            if rows or header is not None:
+                text = (header or title) + '\n'.join(rows)
+                stats['text_len'] += len(text)
+                yield None, text
+            stats['sheets'] += 1
+    except Exception as e:
+        logger.error(msg := f"Error parsing Excel file: {e}")
+        raise AssertionError(msg)
+    finally:
+        workbook.close()
+
+    if stats['text_len'] > 0:
+        stats['parsed'] = 1
+    else:
+        logger.info(f"Text length: {stats['text_len']}")
+    logger.info(f"{msg} done")
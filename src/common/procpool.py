@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import resource
+import signal
+import time
+from collections.abc import Callable, Iterable, Iterator
+from multiprocessing.connection import Connection, wait
+
+from src.common.log import logger
+
+
+def _run_child(func: Callable, item, conn: Connection, mem_limit_mb: int) -> None:
+    """
+    Body of the worker process: runs func(item) and sends back the result.
+    """
+    # Own process group: on timeout the whole group is killed, including
+    # external converters started by the worker.
+    os.setpgrp()
+    if mem_limit_mb:
+        limit: int = mem_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        result = ('ok', func(item))
+    except BaseException as e:
+        result = ('error', f"{type(e).__name__}: {e}")
+    conn.send(result)
+    conn.close()
+
+
+def _kill(process: multiprocessing.Process) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.join()
+
+
+def imap_isolated(
+        func: Callable,
+        items: Iterable,
+        workers: int,
+        timeout: float,
+        mem_limit_mb: int = 0,
+        context: str = 'forkserver',
+) -> Iterator[tuple[object, object, str | None]]:
+    """
+    Runs func(item) for each item in a separate process, at most `workers` at once.
+
+    Yields (item, result, error) as soon as each item is finished, not in the
+    order of items. Error is None on success. Worker exceeding `timeout`
+    seconds is killed and its item yields with error; a crash or exceeded
+    memory limit (`mem_limit_mb`, address space) doesn't affect other items.
+
+    `forkserver` context is used by default: forking a process with live
+    gRPC channels (weaviate client) is unsafe. func and items have to be
+    picklable.
+    """
+    ctx = multiprocessing.get_context(context)
+    items = iter(items)
+    running: dict[Connection, tuple[multiprocessing.Process, object, float]] = {}
+    exhausted: bool = False
+
+    while True:
+        # Start workers for free slots
+        while not exhausted and len(running) < workers:
+            try:
+                item = next(items)
+            except StopIteration:
+                exhausted = True
+                break
+            reader, writer = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_child, args=(func, item, writer, mem_limit_mb), daemon=True)
+            process.start()
+            writer.close()
+            running[reader] = (process, item, time.monotonic() + timeout)
+
+        if not running:
+            return
+
+        # Wait for the first finished worker or the nearest deadline
+        nearest: float = min(deadline for _, _, deadline in running.values())
+        for reader in wait(list(running), timeout=max(0.0, nearest - time.monotonic())):
+            process, item, _ = running.pop(reader)
+            try:
+                status, value = reader.recv()
+            except EOFError:
+                process.join()
+                status, value = 'error', f"Worker died, exit code: {process.exitcode}"
+            reader.close()
+            process.join()
+            if status == 'ok':
+                yield item, value, None
+            else:
+                yield item, None, value
+
+        # Kill workers out of time. The ones with result ready are collected above.
+        now: float = time.monotonic()
+        for reader, (process, item, deadline) in list(running.items()):
+            if deadline <= now and not reader.poll():
+                logger.error(f"Worker timed out after {timeout} s, killing: {process.pid}")
+                _kill(process)
+                reader.close()
+                del running[reader]
+                yield item, None, f"Timeout: {timeout} s"
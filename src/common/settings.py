@@ -26,6 +26,18 @@ class Settings(BaseSettings):
 
     chunk_size: int                   = 10    # Chunk size for DB operations
 
+    # full: recreate collection and import everything
+    # incremental: import only rows changed since the last checkpoint
+    sync_mode: str                    = 'full'
+
+    # Connection pool, one per connection string
+    db_pool_size: int                 = 5
+    db_max_overflow: int              = 5
+    db_pool_timeout: int              = 30    # Seconds to wait for a free connection
+    db_pool_recycle: int              = 1800  # Seconds
+    db_pool_pre_ping: bool            = True
+    db_max_row_buffer: int            = 1000  # Rows buffered by server-side (streaming) cursors
+
     # ID сайтов, указанных в ТЗ
     site_ids: tuple                   = (
         '83f29091-def2-42a4-82c4-453103d8a457',
@@ -39,6 +51,27 @@ class Settings(BaseSettings):
 
     filestorage_url: str                = 'https://hackaton.hb.ru-msk.vkcloud-storage.ru/media'
     download_dir: str                   = '/opt/catsearch/download'
+    download_workers: int               = 8     # Parallel transfers (1 - sequential)
+    download_chunk_size: int            = 1024 * 1024
+    download_timeout: int               = 60    # Connect/read timeout, seconds
+    download_partial_suffix: str        = '.part'
+    download_revalidate: bool           = True  # Conditional GET for already downloaded files
+    pipeline_queue_size: int            = 4     # Items buffered between pipeline stages
+
+    # Parsing of downloaded files. parse_workers > 1: process pool
+    parse_workers: int                  = 1
+    parse_timeout: int                  = 600   # Seconds per file, worker is killed after
+    parse_memory_limit_mb: int          = 4096  # Address space limit of a worker, 0 - unlimited
+    # External converters (antiword): concurrent children, time and stdout limits
+    converter_workers: int              = 4
+    converter_timeout: int              = 300
+    converter_max_output_mb: int        = 256
+    converter_queue_size: int           = 16    # stdout pieces (64 KB) buffered per converter
+    # Content-addressed store: one file per distinct content (sha256)
+    blob_dir: str                       = '/opt/catsearch/download/blobs'
+    partial_dir: str                    = '/opt/catsearch/download/partial'
+    # Parsed text by blob hash, parser name and version
+    text_cache_dir: str                 = '/opt/catsearch/download/text_cache'
 
     # Vector DB. Marqo
     # marqo_url: str                      = "http://cat-vm2.v6.rocks:8081"
@@ -61,11 +94,49 @@ class Settings(BaseSettings):
     weaviate_port: int                  = 8080
     weaviate_api_key: str               = "Search_the_VK"
     weaviate_collection: str            = "catsearch"
+    weaviate_delete_limit: int          = 10000  # QUERY_MAXIMUM_RESULTS of weaviate: max objects per delete
+    weaviate_prune_page: int            = 1000   # Chunks of an object read at a time to prune stale ones
+    weaviate_delete_batch: int          = 100    # Source objects per filter delete
+    # Batch import: dynamic (size follows the server load), fixed_size (weaviate_batch_size objects,
+    # weaviate_batch_concurrency requests at once) or rate_limit (weaviate_batch_rate requests per minute)
+    weaviate_batch_mode: str            = 'dynamic'
+    weaviate_batch_size: int            = 100
+    weaviate_batch_concurrency: int     = 2
+    weaviate_batch_rate: int            = 600
+    weaviate_batch_retries: int         = 3      # Retries of failed objects, then they go to meta.t_dead_letter
+    weaviate_batch_backoff: float       = 2.0    # Seconds before the first retry, doubled every next one
+    # One batch per task run, flushed every N objects / seconds: failed objects are known, finished pages
+    # and files are counted, pruned and marked done
+    weaviate_batch_inflight: int        = 2000   # Objects sent without a flush
+    weaviate_batch_flush_interval: int  = 30     # Seconds
     weaviate_api_endpoint: str          = "http://ollama:11434"
     # Model name. If it's `None`, uses the server-defined default
     weaviate_model: str                 = "no-default-model-use-env-to-setup"
     # weaviate_model: str                 = "nomic-embed-text"
     # weaviate_model: str                 = "jeffh/intfloat-multilingual-e5-large:f16"
+    # Embeddings: weaviate (text2vec_ollama of the collection vectorizes every object)
+    # or client (the spider calls Ollama embed API in batches, vectors go with the objects)
+    embed_mode: str                     = 'weaviate'
+    embed_api_endpoint: str             = "http://ollama:11434"
+    embed_batch_size: int               = 32    # Chunks per request
+    embed_workers: int                  = 2     # Parallel requests
+    embed_timeout: int                  = 300   # Request timeout, seconds (model loading included)
+    # Vectors by (model, chunk text hash) in meta.t_embedding_cache: unchanged text isn't embedded again
+    embed_cache_enabled: bool           = True
+    embed_cache_size: int               = 1_000_000     # Vectors kept, least recently used are evicted
+
+    # Removal of lines repeated on pages (running headers, footers, navigation) before chunking
+    boilerplate_enabled: bool           = True
+    boilerplate_min_pages: int          = 3     # Line repeated on N pages (of a document or a site)
+    boilerplate_share: float            = 0.5   # Share of the sampled pages of a document
+    boilerplate_sample_pages: int       = 20    # First pages of a document (of a site by id) to find repeated lines
+    boilerplate_edge_lines: int         = 3     # Lines at the top and the bottom of a document page
+    boilerplate_max_line: int           = 200   # Longer lines are always content
+
+    # HTML to markdown: lxml (src.common.html2md) or markdownify (reference, slower)
+    html_converter: str                 = 'lxml'
+    # Chunking: native (src.common.chunker) or langchain (reference, slower)
+    text_chunker: str                   = 'native'
 
     text_chunk_size: int                = 700
     text_chunk_overlap: int             = 100
@@ -74,6 +145,14 @@ class Settings(BaseSettings):
     # text_chunk_separators: tuple        = ("\n\n", )
     text_chunk_separators: tuple | list = ["\n\n", "。", "!", "?", "\n", " ", ""]
 
+    # Near-duplicate chunks (MinHash + LSH over the run) aren't inserted. Full sync mode only:
+    # copies aren't stored, an incremental update of the kept chunk would lose the passage
+    dedup_enabled: bool                 = True
+    dedup_threshold: float              = 0.85  # Estimated Jaccard similarity of word shingles
+    dedup_shingle: int                  = 5     # Words in a shingle
+    dedup_num_perm: int                 = 64    # MinHash permutations
+    dedup_bands: int                    = 8     # LSH bands of num_perm / bands rows
+
     db_startup_check_interval: int      = 10
     vdb_startup_check_interval: int     = 10
 
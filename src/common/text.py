@@ -0,0 +1,280 @@
+import re
+from collections.abc import Iterable, Iterator
+from itertools import chain, islice
+from math import ceil
+
+from langchain_core.documents import Document
+
+from src.common.chunker import Chunk, Chunker
+from src.common.html2md import html2markdown, html2markdown_sections
+from src.common.log import logger
+from src.common.settings import settings
+
+# Text processing: HTML to markdown, cleaning, chunking.
+# Kept apart from utils: langchain and lxml are loaded only by the tasks
+# which process text. Chunking is native (src.common.chunker), langchain
+# splitters are loaded only when configured.
+
+
+def decode_html2text(html_text: str) -> str:
+    """
+    HTML >> Markdown
+    """
+    if settings.html_converter == 'lxml':
+        return html2markdown(html_text)
+
+    from markdownify import markdownify as md
+    # soup = BeautifulSoup(html_text, "lxml")
+    # plain_text = soup.get_text(separator='\n', strip=True)
+    result_text = md(
+        html_text,
+        heading_style="ATX",  # # Head
+    )  # HTML to Markdown
+    return result_text
+
+
+def decode_html2sections(html_text: str) -> list[str]:
+    """
+    HTML >> Markdown split into sections at the headings: the first one is
+    the text before the first heading. One section with markdownify.
+    """
+    if settings.html_converter != 'lxml':
+        return [decode_html2text(html_text)]
+    text, sections = html2markdown_sections(html_text)
+    bounds: list[int] = [0] + [section.start for section in sections] + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def preprocess_text(text: str) -> str:
+    """
+    Очистка текста от лишних символов. Переносы строк сохраняются:
+    по ним ищутся повторяющиеся строки и режутся чанки.
+    """
+    # Удаление специальных символов
+    text = re.sub(r'[\x00-\x08\x0B-\x1F\x7F-\x9F]', ' ', text)
+    # Удаление пробелов в конце строк и лишних пустых строк
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    # Удаление лишних дефисов в переносах
+    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
+    return text.strip()
+
+
+# Markdown structure of a page: headings, table rows, list items, quotes.
+# Pages of a site share it (table layout, section titles), it's never boilerplate.
+re_markdown_structure = re.compile(r'^\s*(?:#{1,6}\s|\||[*+-]\s|\d+[.)]\s|>)')
+
+
+class RepeatedLines:
+    """
+    Lines repeated on pages: running headers, footers, page numbers, navigation.
+
+    A line is repeated when it's seen on `min_pages` pages, every line is
+    counted once per page. With `edge_lines` only the first and last
+    non-empty lines of a page are checked (headers and footers of a document)
+    and numbers in them are ignored: page numbers and dates differ.
+    Otherwise all lines are checked as is (navigation of a site), except
+    markdown structure lines.
+    """
+    def __init__(self, min_pages: int, edge_lines: int = 0):
+        self.min_pages: int = min_pages
+        self.edge_lines: int = edge_lines
+        self.pages: dict[str, int] = {}
+
+    def _keys(self, lines: list[str]) -> list[str | None]:
+        """
+        Key of every line, None for lines which are never repeated:
+        empty, long, in the middle of the page, markdown structure of a site page
+        """
+        keys: list[str | None] = [
+            line.strip() if 0 < len(line.strip()) <= settings.boilerplate_max_line else None
+            for line in lines
+        ]
+        if not self.edge_lines:
+            return [None if key is None or re_markdown_structure.match(key) else key for key in keys]
+        filled: list[int] = [i for i, key in enumerate(keys) if key is not None]
+        edges: set[int] = set(filled[:self.edge_lines] + filled[-self.edge_lines:])
+        return [
+            re.sub(r'\d+', '#', key.lower()) if i in edges else None
+            for i, key in enumerate(keys)
+        ]
+
+    def learn(self, text: str) -> None:
+        for key in set(self._keys(text.split('\n'))):
+            if key is not None:
+                self.pages[key] = self.pages.get(key, 0) + 1
+
+    def strip(self, text: str, stats: dict) -> str:
+        """
+        Removes repeated lines from the text. Counts removed lines and chars in stats.
+        """
+        lines: list[str] = text.split('\n')
+        kept: list[str] = []
+        for line, key in zip(lines, self._keys(lines)):
+            if key is not None and self.pages.get(key, 0) >= self.min_pages:
+                stats['boilerplate_lines'] += 1
+                stats['boilerplate_chars'] += len(line) + 1
+            else:
+                kept.append(line)
+        return '\n'.join(kept)
+
+
+def sample_repeated_lines(texts: list[str], edge_lines: int = 0) -> RepeatedLines | None:
+    """
+    Lines repeated on `boilerplate_share` of the sample texts, at least on
+    `boilerplate_min_pages` of them. None if the sample is smaller than that.
+
+    Learned before anything is stripped: every text of a document or a site
+    is stripped by the same lines, whatever the order of the texts.
+    """
+    if len(texts) < settings.boilerplate_min_pages:
+        return None
+    repeated = RepeatedLines(
+        max(settings.boilerplate_min_pages, ceil(len(texts) * settings.boilerplate_share)),
+        edge_lines=edge_lines,
+    )
+    for text in texts:
+        repeated.learn(text)
+    return repeated
+
+
+def count_saved_chunks(stats: dict) -> None:
+    """
+    Chunks we don't embed thanks to removed lines. Estimate: chunks are
+    text_chunk_size long and overlap by text_chunk_overlap.
+    """
+    step: int = max(1, settings.text_chunk_size - settings.text_chunk_overlap)
+    stats['boilerplate_chunks'] = -(-stats['boilerplate_chars'] // step)
+
+
+def strip_document_boilerplate(
+        pages: Iterable[tuple[int | None, str]], stats: dict
+) -> Iterator[tuple[int | None, str]]:
+    """
+    Normalization between parsing and chunking of a document.
+
+    Header and footer lines (`boilerplate_edge_lines` at the top and the bottom
+    of a page) repeated on `boilerplate_share` of the first `boilerplate_sample_pages`
+    pages (at least on `boilerplate_min_pages`) are removed from all pages.
+    Only numbered pages (PDF) are checked: pieces of .doc and .xlsx repeat
+    sheet name and header on purpose.
+    """
+    pages = iter(pages)
+    sample: list[tuple[int | None, str]] = [
+        (page_num, preprocess_text(text)) for page_num, text in islice(pages, settings.boilerplate_sample_pages)
+    ]
+    repeated: RepeatedLines | None = None
+    if settings.boilerplate_enabled:
+        repeated = sample_repeated_lines(
+            [text for page_num, text in sample if page_num is not None], settings.boilerplate_edge_lines,
+        )
+
+    for page_num, text in chain(sample, ((page_num, preprocess_text(text)) for page_num, text in pages)):
+        if repeated is not None and page_num is not None:
+            text = repeated.strip(text, stats)
+        yield page_num, text
+    count_saved_chunks(stats)
+
+
+def split_text(text: str) -> Iterator[Chunk]:
+    """
+    Chunks of the text by `text_chunk_separators`, `text_chunk_size` and
+    `text_chunk_overlap` with their offsets
+    """
+    if settings.text_chunker == 'native':
+        return Chunker().split(text)
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.text_chunk_size,
+        chunk_overlap=settings.text_chunk_overlap,
+        separators=settings.text_chunk_separators,
+        add_start_index=True,
+    )
+    return (
+        Chunk(doc.page_content, doc.metadata['start_index'], doc.metadata['start_index'] + len(doc.page_content))
+        for doc in text_splitter.create_documents([text])
+    )
+
+
+def chunkate_text_ts(text: str) -> list[Document]:
+    """
+    Chunkating with CharacterTextSplitter
+    """
+    from langchain.text_splitter import CharacterTextSplitter
+
+    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
+    text_splitter = CharacterTextSplitter(
+        chunk_size=settings.text_chunk_size,
+        chunk_overlap=settings.text_chunk_overlap,
+        # separators=settings.text_chunk_separators,
+    )
+    chunks: list[Document]  = text_splitter.create_documents([text])
+    logger.info(f"{msg} done: {len(chunks)} chunks")
+    return chunks
+
+
+def chunkate_text_rcts(text: str) -> list[Document]:
+    """
+    Chunkating by text_chunk_separators (recursive character splitting)
+    """
+    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
+
+    chunks: list[Document]  = [
+        Document(page_content=chunk.text, metadata={'start': chunk.start, 'end': chunk.end})
+        for chunk in split_text(text)
+    ]
+
+    logger.info(f"{msg} done: {len(chunks)} chunks")
+    return chunks
+
+
+def chunkate_pages(pages: Iterable[tuple[int | None, str]]) -> Iterator[Document]:
+    """
+    Chunkating page by page by text_chunk_separators.
+    Chunks are tagged with page number and offsets in the page:
+    Document.metadata['page'], ['start'], ['end'].
+    """
+    text_len, count = 0, 0
+    for page_num, text in pages:
+        text_len += len(text)
+        for chunk in split_text(text):
+            count += 1
+            yield Document(page_content=chunk.text, metadata={'page': page_num, 'start': chunk.start, 'end': chunk.end})
+    logger.info(f"Chunkating text: {text_len} chars done: {count} chunks")
+
+
+def chunkate_sections(sections: Iterable[str], stats: dict) -> list[str]:
+    """
+    Chunkating of a page by its sections (decode_html2sections): a chunk
+    doesn't cross a section boundary. A section shorter than
+    text_chunk_min_size is joined to the previous one instead: chunks that
+    short aren't inserted.
+    """
+    pieces: list[str] = []
+    for section in filter(None, sections):
+        if pieces and (len(pieces[-1]) < settings.text_chunk_min_size or len(section) < settings.text_chunk_min_size):
+            pieces[-1] += '\n\n' + section
+        else:
+            pieces.append(section)
+    return [chunk for piece in pieces for chunk in chunkate_text_rcts_plain(piece, stats)]
+
+
+def chunkate_text_rcts_plain(text: str, stats: dict) -> list[str]:
+    """
+    Chunkating by text_chunk_separators (recursive character splitting)
+    """
+    def custom_len(s: str) -> int:
+        if len(s) < settings.text_chunk_min_size:
+            stats['tiny'] += 1
+        return len(s)
+
+    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
+
+    chunks: list[str]  = [chunk.text for chunk in split_text(text)]
+
+    logger.info(f"{msg} done: {len(chunks)} chunks")
+    return chunks
+    # return [
+    #     chunk for chunk in chunks if custom_len(chunk) >= settings.text_chunk_min_size
+    # ]
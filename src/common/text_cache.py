@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+
+from src.common.log import logger
+from src.common.settings import settings
+
+# Parsed text of the blob: {text_cache_dir}/{parser}/{version}/ab/abcdef....jsonl
+# One line per page: [page number, text]. Entries of a parser version live in
+# their own directory, so bumping the version invalidates only that parser.
+
+
+def _cache_path(blob_hash: str, parser: str, version: int) -> str:
+    return f"{settings.text_cache_dir}/{parser}/{version}/{blob_hash[:2]}/{blob_hash}.jsonl"
+
+
+def _read_pages(path: str) -> Iterator[tuple[int | None, str]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            page_num, text = json.loads(line)
+            yield page_num, text
+
+
+def cache_get(blob_hash: str, parser: str, version: int) -> Iterator[tuple[int | None, str]] | None:
+    """
+    Returns pages of the parsed blob or None if it's not cached. Pages are read lazily.
+    """
+    path: str = _cache_path(blob_hash, parser, version)
+    if not os.path.exists(path):
+        return None
+    logger.info(f"Parsed text found in cache: {path}")
+    return _read_pages(path)
+
+
+def cache_put(
+        blob_hash: str, parser: str, version: int, pages: Iterable[tuple[int | None, str]]
+) -> Iterator[tuple[int | None, str]]:
+    """
+    Passes pages through, writing them to the cache on the way.
+    The entry appears only when all pages are read.
+    """
+    path: str = _cache_path(blob_hash, parser, version)
+    tmp_path: str = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for page_num, text in pages:
+                f.write(json.dumps([page_num, text], ensure_ascii=False) + '\n')
+                yield page_num, text
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cache_prune(parser: str, version: int) -> None:
+    """
+    Removes entries made by other versions of the parser.
+    """
+    parser_dir: str = f"{settings.text_cache_dir}/{parser}"
+    if not os.path.isdir(parser_dir):
+        return
+    for item in os.listdir(parser_dir):
+        if item != str(version):
+            logger.info(f"Removing outdated parsed text: {parser_dir}/{item}")
+            shutil.rmtree(f"{parser_dir}/{item}", ignore_errors=True)
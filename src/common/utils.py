@@ -1,14 +1,8 @@
 import json
-import re
 import time
-from collections.abc import Callable
-from hashlib import md5
-
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.text_splitter import NLTKTextSplitter
-from langchain_core.documents import Document
-from markdownify import markdownify as md
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from hashlib import md5, sha256
 
 from src.common.log import logger
 from src.common.settings import settings
@@ -40,7 +34,9 @@ def get_stats(
         coverage: float | None = inserted / (inserted + skipped)
     else:
         coverage = None
-    return f"Statistics:\n{stats_json}\nData coverage: {coverage}"
+    embedded: int = stats.get('vectordb', {}).get('embedded', 0)
+    hit_rate: float | None = stats['vectordb'].get('embed_cache_hits', 0) / embedded if embedded else None
+    return f"Statistics:\n{stats_json}\nData coverage: {coverage}\nEmbedding cache hit rate: {hit_rate}"
 
 
 def timeit(func) -> Callable:
@@ -63,21 +59,23 @@ def prepare_doc(doc: dict) -> dict:
     return doc
 
 
-def decode_html2text(html_text: str) -> str:
+def make_storage_url(file_link: str) -> str:
+    return f"{settings.filestorage_url}/{file_link}"
+
+
+def make_blob_path(blob_hash: str) -> str:
     """
-    HTML >> Markdown
+    Path of the file in content-addressed store: {blob_dir}/ab/abcdef...
     """
-    # soup = BeautifulSoup(html_text, "lxml")
-    # plain_text = soup.get_text(separator='\n', strip=True)
-    result_text = md(
-        html_text,
-        heading_style="ATX",  # # Head
-    )  # HTML to Markdown
-    return result_text
+    return f"{settings.blob_dir}/{blob_hash[:2]}/{blob_hash}"
 
 
-def make_storage_url(file_link: str) -> str:
-    return f"{settings.filestorage_url}/{file_link}"
+def make_partial_path(link: str) -> str:
+    """
+    Path of the partially downloaded file of the link (a version of a storage
+    object): a partial file of an old version is never resumed from a new link.
+    """
+    return f"{settings.partial_dir}/{sha256(link.encode()).hexdigest()}{settings.download_partial_suffix}"
 
 
 def make_hash(object_id, page, paragraph) -> str:
@@ -86,6 +84,13 @@ def make_hash(object_id, page, paragraph) -> str:
     ).hexdigest()
 
 
+def make_text_hash(text: str) -> str:
+    """
+    sha256 of the chunk text: key of its vector in the embedding cache
+    """
+    return sha256(text.encode()).hexdigest()
+
+
 def write_text_file(file_path: str, data: str, stats: dict) -> str:
     file_name: str = file_path.rsplit('/', maxsplit=1)[-1]
     new_filename: str = f"{file_path}.txt"
@@ -97,72 +102,33 @@ def write_text_file(file_path: str, data: str, stats: dict) -> str:
     return new_filename
 
 
-def preprocess_text(text: str) -> str:
-    """
-    Очистка текста от лишних символов
-    """
-    # Удаление специальных символов
-    text = re.sub(r'[\x00-\x1F\x7F-\x9F]', ' ', text)
-    # Замена множественных пробелов и переносов
-    text = re.sub(r'\s+', ' ', text)
-    # Удаление лишних дефисов в переносах
-    text = re.sub(r'(\w)-\s(\w)', r'\1\2', text)
-    return text.strip()
-
-
-def chunkate_text_ts(text: str) -> list[Document]:
+def write_text_pages(
+        file_path: str, pages: Iterable[tuple[int | None, str]], stats: dict
+) -> Iterator[tuple[int | None, str]]:
     """
-    Chunkating with CharacterTextSplitter
+    Passes pages through, writing them to {file_path}.txt on the way.
+    Pieces without page number (row groups, paragraph groups) are separated by a blank line.
     """
-    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
-    text_splitter = CharacterTextSplitter(
-        chunk_size=settings.text_chunk_size,
-        chunk_overlap=settings.text_chunk_overlap,
-        # separators=settings.text_chunk_separators,
-    )
-    chunks: list[Document]  = text_splitter.create_documents([text])
-    logger.info(f"{msg} done: {len(chunks)} chunks")
-    return chunks
-
-
-def chunkate_text_rcts(text: str) -> list[Document]:
-    """
-    Chunkating with RecursiveCharacterTextSplitter
-    """
-    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=settings.text_chunk_size,
-        chunk_overlap=settings.text_chunk_overlap,
-        separators=settings.text_chunk_separators,
-    )
-    chunks: list[Document]  = text_splitter.create_documents([text])
-
-    logger.info(f"{msg} done: {len(chunks)} chunks")
-    return chunks
+    new_filename: str = f"{file_path}.txt"
+    logger.info(f"Writing text to file: {new_filename} ...")
+    with open(new_filename, 'w') as f:
+        for page_num, text in pages:
+            if page_num is not None:
+                f.write(f"Page {page_num}:\n{text}\n\n")
+            else:
+                f.write(f"{text}\n\n")
+            yield page_num, text
+        stats['fs']['written'] += 1
 
 
-def chunkate_text_rcts_plain(text: str, stats: dict) -> list[str]:
+def prefetch(items: Iterable, size: int) -> Iterator:
     """
-    Chunkating with RecursiveCharacterTextSplitter
+    Takes `size` items of the iterable ahead of the consumer.
     """
-    def custom_len(s: str) -> int:
-        if len(s) < settings.text_chunk_min_size:
-            stats['tiny'] += 1
-        return len(s)
-
-    logger.info(msg := f"Chunkating text: {len(text)} chars ...")
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=settings.text_chunk_size,
-        chunk_overlap=settings.text_chunk_overlap,
-        separators=settings.text_chunk_separators,
-    )
-    chunks: list[str]  = text_splitter.split_text(text)
-
-    logger.info(f"{msg} done: {len(chunks)} chunks")
-    return chunks
-    # return [
-    #     chunk for chunk in chunks if custom_len(chunk) >= settings.text_chunk_min_size
-    # ]
-
+    buffer: deque = deque()
+    for item in items:
+        buffer.append(item)
+        if len(buffer) > size:
+            yield buffer.popleft()
+    while buffer:
+        yield buffer.popleft()
@@ -3,9 +3,11 @@ from enum import Enum
 
 from sqlalchemy import (
     Column,
+    desc,
+    select,
 )
 from sqlalchemy.dialects.postgresql import (
-    UUID, VARCHAR, SMALLINT, TIMESTAMP, TEXT,
+    UUID, VARCHAR, SMALLINT, TIMESTAMP, TEXT, BIGINT, BYTEA, JSONB,
 )
 from sqlalchemy.orm import declarative_base
 
@@ -29,9 +31,27 @@ class SpiderFile(Base):
 
     create_ts                = Column(TIMESTAMP, default=datetime.now(UTC))
     target_path              = Column(VARCHAR(1024), comment='file path')
+    blob_hash                = Column(VARCHAR(64), index=True, comment='sha256 содержимого, ключ в хранилище blob')
+    etag                     = Column(TEXT, comment='ETag из ответа хранилища')
+    last_modified            = Column(TEXT, comment='Last-Modified из ответа хранилища')
     status_id                = Column(SMALLINT, default=0, comment='0 - new, 1 - downloaded, 2 - parsed, 3 - vectorized')
 
 
+class SpiderPage(Base):
+    """ Учет страниц, загруженных в векторную БД """
+    __tablename__ = 'spider_page'
+    __table_args__ = (
+        {
+            'schema': 'meta',
+            'comment': 'Страницы cms, чанки которых загружены в векторную БД: по ним reconcile находит удаленные',
+        },
+    )
+    page_id     = Column(UUID, primary_key=True, comment='id из cms pages_page.id')
+    page_name   = Column(TEXT, comment='Имя страницы')
+    site_id     = Column(TEXT, comment='id сайта')
+    create_ts   = Column(TIMESTAMP, default=datetime.now(UTC))
+
+
 class Status(int, Enum):
     """ Статусы файлов """
     new         = 0
@@ -39,26 +59,68 @@ class Status(int, Enum):
     parsed      = 2
     done        = 3
     error       = 4
+    deleted     = 5     # Удален из filestorage, чанки удалены из векторной БД
+    unsupported = 6     # Тип файла не поддерживается парсерами
+
+
+class Checkpoint(Base):
+    """ Водяные знаки инкрементальной загрузки """
+    __tablename__ = 't_checkpoint'
+    __table_args__ = (
+        {
+            'schema': 'meta',
+            'comment': 'Водяные знаки (updated_at/created_at) инкрементальной загрузки',
+        },
+    )
+
+    id          = Column(BIGINT, primary_key=True, autoincrement=True)
+    source      = Column(TEXT, nullable=False, index=True, comment='Источник: page, text_file, ...')
+    ts          = Column(TIMESTAMP(timezone=True), nullable=False, comment='Максимальный updated_at/created_at загруженных строк')
+    create_ts   = Column(TIMESTAMP, default=datetime.now(UTC))
+
+    @classmethod
+    def log(cls, conn, source: str, ts: datetime) -> None:
+        conn.session.add(cls(source=source, ts=ts))
+        conn.commit()
 
+    @classmethod
+    def get_last(cls, conn, source: str) -> datetime:
+        query = select(cls.ts).where(cls.source == source).order_by(desc(cls.id)).limit(1)
+        ts = conn.session.scalar(query)
+
+        return ts if ts else datetime.fromtimestamp(0, UTC)
+
+
+class EmbeddingCache(Base):
+    """ Кэш эмбеддингов чанков """
+    __tablename__ = 't_embedding_cache'
+    __table_args__ = (
+        {
+            'schema': 'meta',
+            'comment': 'Векторы чанков по модели и хэшу текста, переживают пересоздание коллекции',
+        },
+    )
+
+    model       = Column(TEXT, primary_key=True, comment='Модель эмбеддингов')
+    text_hash   = Column(VARCHAR(64), primary_key=True, comment='sha256 текста чанка')
+    vector      = Column(BYTEA, nullable=False, comment='Вектор, float32')
+    used_ts     = Column(TIMESTAMP, nullable=False, index=True, comment='Последнее использование, по нему вытесняются старые')
+
+
+class DeadLetter(Base):
+    """ Чанки, не записанные в векторную БД после всех повторов """
+    __tablename__ = 't_dead_letter'
+    __table_args__ = (
+        {
+            'schema': 'meta',
+            'comment': 'Объекты weaviate, не записанные после повторов: для разбора и повторной загрузки',
+        },
+    )
 
-# class Checkpoint(Base):
-#     __tablename__ = 't_checkpoint'
-#     __table_args__ = (
-#         {
-#             'schema': 'meta',
-#         },
-#     )
-#
-#     id = Column(BIGINT, primary_key=True)
-#     ts = Column(TIMESTAMP, default=datetime.now(UTC))
-#
-#     @classmethod
-#     def log(cls, conn):
-#         return conn.persist_add(cls())
-#
-#     @classmethod
-#     def get_last(cls, conn: DbConnManager) -> datetime:
-#         query = select(cls.ts).order_by(desc(cls.id)).limit(1)
-#         ts = conn.session.scalar(query)
-#
-#         return ts if ts else datetime.fromtimestamp(0)
+    id          = Column(BIGINT, primary_key=True, autoincrement=True)
+    collection  = Column(TEXT, nullable=False, comment='Коллекция weaviate')
+    object_id   = Column(TEXT, index=True, comment='Исходный объект (страница, файл)')
+    chunk_uuid  = Column(UUID, comment='uuid чанка в коллекции')
+    error       = Column(TEXT, comment='Ошибка последней попытки')
+    properties  = Column(JSONB, comment='Свойства объекта weaviate')
+    create_ts   = Column(TIMESTAMP, default=datetime.now(UTC))
@@ -1,24 +1,176 @@
+import hashlib
 import os
 from collections import defaultdict
+from collections.abc import Callable
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import NamedTuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from sqlalchemy import select, and_
 
-from src.common.db import DbConnManager, file_register, file_set_status, file_get_status
+from src.common.db import (
+    DbConnManager,
+    file_register_many,
+    file_set_status_many,
+    file_update_many,
+    file_get_many,
+    file_find_blobs,
+    get_pool_stats,
+)
 from src.common.log import logger
 from src.common.settings import settings
-from src.common.utils import get_stats
+from src.common.utils import get_stats, make_blob_path, make_partial_path
 from src.models.cat_meta import Status
 from src.models.vk_filestorage import StorageObject, StorageVersion
 
 
-def download(stats: dict) -> None:
+def make_session() -> requests.Session:
     """
-    ...
+    Keep-alive session shared by all download workers.
+
+    Connection pool is sized to the number of workers, so every transfer
+    reuses an already opened connection to the filestorage.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.download_workers,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def hash_file(file_path: str, hasher) -> None:
+    """
+    Feed file content into hasher.
+    """
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(settings.download_chunk_size):
+            hasher.update(chunk)
+
+
+class Download(NamedTuple):
+    """ Result of download_file """
+    transferred: int            # Count of transferred bytes
+    blob_hash: str | None       # sha256 of the content. None - not modified
+    etag: str | None            # Validators returned by filestorage
+    last_modified: str | None
+
+
+def download_file(
+        session: requests.Session,
+        url: str,
+        size: int | None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+) -> Download:
+    """
+    Download one file into content-addressed store.
+
+    If validators of the previous download are given, request is conditional:
+    filestorage replies 304 for unchanged file and nothing is transferred.
+
+    Data goes to `{partial_dir}/{sha256 of url}.part` first. If the partial file
+    is left by an interrupted run, transfer resumes from its end with a `Range`
+    request: the url (link) is new for every version, so the partial file is
+    of the same content. A conditional request has its own partial file, it may
+    run next to the first download of the link. The file is moved into the store only when its length matches
+    `size` (StorageVersion.size), so a truncated file is never taken as
+    downloaded. If the store already has the same content, the new copy is
+    dropped.
+    """
+    conditional: bool = bool(etag or last_modified)
+    part: str = make_partial_path(f"{url}#revalidate" if conditional else url)
+    offset: int = os.path.getsize(part) if os.path.exists(part) else 0
+    if conditional or (size is not None and offset > size):
+        # Conditional request starts over, a longer partial file can't be trusted
+        logger.info(f"Ignoring partial file: {part}") if offset else None
+        offset = 0
+
+    hasher = hashlib.sha256()
+    transferred: int = 0
+    mode: str | None = None     # None - nothing to fetch, partial file is complete
+    if conditional or size is None or offset < size:
+        headers: dict = {'Range': f"bytes={offset}-"} if offset else {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        logger.info(msg := f"Downloading file: {url} from {offset} ...")
+        with session.get(url, headers=headers, stream=True, timeout=settings.download_timeout) as response:
+            if response.status_code == 304:
+                logger.info(f"{msg} not modified")
+                return Download(0, None, etag, last_modified)
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if response.status_code == 206:
+                content_range: str = response.headers.get('Content-Range', '')
+                if not content_range.startswith(f"bytes {offset}-"):
+                    raise AssertionError(f"Unexpected Content-Range: {url}: {content_range}")
+                hash_file(part, hasher)
+                mode = 'ab'
+            elif response.status_code == 200:
+                # Range ignored by server (or fresh download): start over
+                mode = 'wb'
+            elif response.status_code == 416 and offset:
+                # Nothing left to fetch, let size check decide
+                pass
+            else:
+                raise AssertionError(f"Failed to download file: {url}, status: {response.status_code}")
+
+            if mode is not None:
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(chunk_size=settings.download_chunk_size):
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        transferred += len(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+        logger.info(f"{msg} done: {transferred} bytes")
+    if mode is None:
+        if not os.path.exists(part):
+            open(part, 'wb').close()    # Empty file (size 0): nothing to fetch
+        hash_file(part, hasher)
+
+    # Verify and finalize
+    written: int = os.path.getsize(part)
+    if size is not None and written != size:
+        if written > size:
+            os.remove(part)  # Can't be resumed
+        raise AssertionError(f"Size mismatch: {url}: expected {size}, got {written}")
+    blob_hash: str = hasher.hexdigest()
+    blob_path: str = make_blob_path(blob_hash)
+    if os.path.exists(blob_path):
+        logger.info(f"Same content already stored: {blob_path}")
+        os.remove(part)
+    else:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(part, blob_path)  # Atomic within one file system
+    return Download(transferred, blob_hash, etag, last_modified)
+
+
+def download(stats: dict, on_stored: Callable[[list], None] | None = None) -> None:
+    """
+    Download files from filestorage into content-addressed store.
+
+    Up to `settings.download_workers` transfers are kept in flight over one
+    shared connection pool. Registration and status updates in meta.spider_file
+    are made from the main thread only. Each link is fetched once, all storage
+    objects pointing to it (or to the same content) share one blob.
+
+    Already downloaded files are revalidated with conditional GET. Changed
+    files are downloaded again and go back to the parse stage.
+
+    `on_stored` is called with ids of files as soon as their content is in
+    the store (downloaded now or before). Used by the streaming pipeline.
     """
     with (
         DbConnManager(settings.vk_db_conn_str_filestorage) as vk_conn,
-        DbConnManager(settings.db_conn_str) as cat_conn
+        DbConnManager(settings.db_conn_str) as cat_conn,
+        make_session() as session,
+        ThreadPoolExecutor(max_workers=settings.download_workers) as executor,
     ):
         query = select(
             StorageObject.id,
@@ -38,38 +190,132 @@ def download(stats: dict) -> None:
             and_(
                 StorageObject.type == 1,                        # Type file
                 StorageObject.site_id.in_(settings.site_ids),   # Our sites
+                StorageObject.deleted_at.is_(None),             # Not soft-deleted: reconcile removes them
             )
         ).execution_options(stream_results=True)  # Streaming for chunking
 
         # Initialize MongoDB client, db, collection
         # coll = init_mongo(settings.mongo_collection_file)
 
-        # Create download directory if not exists
-        os.mkdir(settings.download_dir) if not os.path.exists(settings.download_dir) else None
-
-        # Iterate over rows and download file one by one
-        for i, row in enumerate(vk_conn.execute(query).yield_per(settings.chunk_size)):
-            logger.info(f"{i}, {row.id}, {row.name}, {row.link}")
-            url: str = f"{settings.filestorage_url}/{row.link}"
-            filename: str = f"{settings.download_dir}/{row.name}"
-            if not file_register(cat_conn, row, filename, Status.new.value):
-                if file_get_status(cat_conn, row.id) == Status.downloaded:
-                    logger.info(f"{i}: File already downloaded: {filename} ")
+        # Create download directories if not exist
+        os.makedirs(settings.blob_dir, exist_ok=True)
+        os.makedirs(settings.partial_dir, exist_ok=True)
+
+        # Transfers in flight: future -> (link, size, revalidation)
+        in_flight: dict[Future, tuple] = {}
+        # Rows waiting for the transfer: (link, size, revalidation) -> rows.
+        # Revalidations are kept apart: 304 gives no blob to rows not downloaded yet
+        waiting: dict[tuple, list] = {}
+        max_in_flight: int = settings.download_workers * 2
+
+        def notify(ids: list) -> None:
+            if on_stored is not None and ids:
+                on_stored(ids)
+
+        def collect(return_when: str) -> None:
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                link, size, revalidation = in_flight.pop(future)
+                rows: list = waiting.pop((link, size, revalidation))
+                ids: list = [row.id for row in rows]
+                try:
+                    result: Download = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to download file: {link}: {e}")
+                    file_set_status_many(cat_conn, ids, Status.error.value)
+                    stats['file']['failed'] += len(rows)
+                    continue
+                if result.blob_hash is None:
+                    stats['file']['not_modified'] += len(rows)
+                    notify(ids)
+                    continue
+                file_update_many(
+                    cat_conn,
+                    ids,
+                    storage_version_link=link,
+                    storage_version_size=size,
+                    blob_hash=result.blob_hash,
+                    target_path=make_blob_path(result.blob_hash),
+                    etag=result.etag,
+                    last_modified=result.last_modified,
+                    status_id=Status.downloaded.value,
+                )
+                stats['file']['refreshed' if revalidation else 'downloaded'] += 1
+                stats['file']['downloaded_bytes'] += result.transferred
+                stats['file']['deduplicated'] += len(rows) - 1
+                notify(ids)
+
+        # Iterate over chunks of rows and schedule downloads.
+        # Bookkeeping in meta.spider_file is made for the whole chunk at once.
+        for chunk in vk_conn.execute(query).yield_per(settings.chunk_size).partitions():
+            registered: set = file_register_many(cat_conn, chunk, Status.new.value)
+            files: dict = file_get_many(cat_conn, [row.id for row in chunk if row.id not in registered])
+            blobs: dict = file_find_blobs(cat_conn, {row.link for row in chunk})
+            deduplicated: dict[tuple, list] = defaultdict(list)     # (link, size, blob_hash) -> ids
+
+            for row in chunk:
+                logger.info(f"{row.id}, {row.name}, {row.link}")
+                size: str | None = None if row.size is None else str(row.size)
+                etag, last_modified = None, None
+                file = files.get(row.id)
+                if file is not None:
+                    stored: bool = (
+                        file.status_id in (Status.downloaded, Status.parsed, Status.done)
+                        and file.storage_version_link == row.link   # New version has new link
+                        and file.blob_hash is not None
+                        and os.path.exists(make_blob_path(file.blob_hash))
+                    )
+                    if stored:
+                        if not settings.download_revalidate or not (file.etag or file.last_modified):
+                            logger.info(f"File already downloaded: {row.name} ")
+                            notify([row.id])
+                            continue
+                        etag, last_modified = file.etag, file.last_modified
+
+                # The same link is being fetched (or revalidated) right now
+                revalidation: bool = bool(etag or last_modified)
+                key: tuple = (row.link, size, revalidation)
+                if key in waiting:
+                    waiting[key].append(row)
                     continue
 
-            # download file
-            with requests.session() as session:
-                logger.info(msg := f"Downloading file: {url} ...")
-                response = session.get(url, stream=True)
-                if response.status_code == 200:
-                    with open(filename, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    logger.info(f"{msg} done")
-                    file_set_status(cat_conn, row.id, Status.downloaded.value)
-                    stats['file']['downloaded'] += 1
-                else:
-                    raise AssertionError(f"Failed to download file: {url}")
+                # The same link was fetched before
+                blob_hash: str | None = None if revalidation else blobs.get((row.link, size))
+                if blob_hash and os.path.exists(make_blob_path(blob_hash)):
+                    logger.info(f"Blob already stored: {blob_hash}")
+                    deduplicated[(row.link, size, blob_hash)].append(row.id)
+                    continue
+
+                url: str = f"{settings.filestorage_url}/{row.link}"
+                waiting[key] = [row]
+                future: Future = executor.submit(
+                    download_file, session, url, row.size, etag, last_modified,
+                )
+                in_flight[future] = key
+
+            for (link, size, blob_hash), ids in deduplicated.items():
+                # The version (link) is recorded as in collect(): otherwise the row looks changed every run.
+                # Validators of the old version don't apply to it
+                file_update_many(
+                    cat_conn,
+                    ids,
+                    storage_version_link=link,
+                    storage_version_size=size,
+                    blob_hash=blob_hash,
+                    target_path=make_blob_path(blob_hash),
+                    etag=None,
+                    last_modified=None,
+                    status_id=Status.downloaded.value,
+                )
+                stats['file']['deduplicated'] += len(ids)
+                notify(ids)
+
+            # Back-pressure: don't read further rows while the pool is saturated
+            while len(in_flight) >= max_in_flight:
+                collect(FIRST_COMPLETED)
+
+        if in_flight:
+            collect(ALL_COMPLETED)
 
 
 @logger.catch(reraise=True)
@@ -82,6 +328,7 @@ def main():
     }
 
     download(stats)
+    stats['db_pool'] = get_pool_stats()
 
     logger.info(get_stats(stats))
     logger.info("Fetcher finished")
@@ -1,155 +1,270 @@
-import subprocess
-from collections import defaultdict
+import os
+from collections import defaultdict, deque
+from collections.abc import Iterable, Iterator
 
-import PyPDF2
-import pandas as pd
 from langchain_core.documents import Document
 from sqlalchemy import select
 from weaviate.client import WeaviateClient
 
-from src.common.db import DbConnManager, get_sites, get_storage_object
+from src.common.db import (
+    DbConnManager,
+    get_deleted_files,
+    get_sites,
+    get_storage_object,
+    get_pool_stats,
+    file_set_status,
+    file_set_status_by_blob,
+)
+from src.common.dedup import NearDuplicates, run_blobs, run_duplicates
 from src.common.log import logger
+from src.common.parsers import PARSERS, Parser, get_parser
+from src.common.procpool import imap_isolated
 from src.common.settings import settings
+from src.common.text import chunkate_pages, strip_document_boilerplate
+from src.common.text_cache import cache_get, cache_put, cache_prune
 from src.common.utils import (
     get_stats,
     make_storage_url,
-    write_text_file,
-    chunkate_text_rcts,
+    write_text_pages,
+    prefetch,
 )
 from src.models.cat_meta import SpiderFile, Status
 from src.models.vk_filestorage import StorageObject
-from src.vectordb.weaviate_vdb import init_weaviate, weaviate_insert, check_collection_readiness
+from src.vectordb.weaviate_vdb import (
+    BatchWriter,
+    init_weaviate,
+    weaviate_insert,
+    check_collection_readiness,
+)
 
 
-def parse_doc(file: SpiderFile, stats: dict) -> str:
+def check_supported(cat_conn: DbConnManager, file: SpiderFile, stats: dict) -> bool:
+    """
+    Checks that there is a parser for the type of the file.
+    Files of unsupported types are counted by MIME type and marked, not parsed.
+    They are checked again on the next run, so a new parser picks them up.
+    Files without content on disk are marked with the error status: fetch_files downloads them again.
+    """
+    if not file.target_path or not os.path.isfile(file.target_path):
+        logger.error(f"Downloaded file is missing: {file.target_path}: {file.storage_object_name}")
+        stats['vectordb']['missing'] += 1
+        file_set_status(cat_conn, file.storage_object_id, Status.error.value)
+        return False
+    mime_type, parser = get_parser(file.target_path, file.storage_object_name)
+    if parser is not None:
+        return True
+    logger.info(f"Unsupported file type: {mime_type}: {file.storage_object_name}")
+    stats['unsupported'][mime_type] += 1
+    stats['vectordb']['unsupported'] += 1
+    file_set_status(cat_conn, file.storage_object_id, Status.unsupported.value)
+    return False
+
+
+def get_cached(file: SpiderFile, parser: Parser, stats: dict) -> Iterable[tuple[int | None, str]] | None:
     """
-    Extracts structured text from .doc files with page numbers and paragraphs.
-    It uses antiword - CLI tool.
+    Pages of the file from the parsed text cache, None if the blob wasn't
+    parsed by this version of the parser
+    """
+    if file.blob_hash and (pages := cache_get(file.blob_hash, parser.name, parser.version)) is not None:
+        stats['fs']['text_cache_hit'] += 1
+        return pages
+    return None
+
 
-    Returns list of pages with their paragraphs and page numbers.
+def parse_file(file: SpiderFile, stats: dict, cache: bool = True) -> Iterable[tuple[int | None, str]]:
     """
-    file_name: str = file.storage_object_name
-    file_path: str = file.target_path
-    logger.info(msg := f"Parsing file: {file_path} ...")
-    if file_name not in stats:
-        stats[file_name] = defaultdict(int)
-    stats = stats[file_name]
-    try:
-        # Use antiword to extract formatted text with page breaks (^L/form feed character)
-        result = subprocess.run(
-            ['antiword', '-f', file_path],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        full_text = result.stdout
-    except subprocess.CalledProcessError as e:
-        logger.error(msg := f"Error parsing .doc file: {e}")
-        raise AssertionError(msg)
-    except FileNotFoundError:
-        logger.error(
-            msg := (
-                "Error: antiword is required but not installed. Install with:\n"
-                "sudo apt-get install antiword"
-            )
-        )
-        raise AssertionError(msg)
-
-    text_len = len(full_text)
-    stats['text_len'] = text_len
-    if text_len > 0:
-        stats['parsed'] = 1
-    logger.info(f"{msg} done")
-    return full_text
-    # Split text into pages using form feed character
-    # pages = full_text.split('\x0c')     # It's not working!!!
-    # stats['pages'] = len(pages)
-    #
-    # structured_pages = []
-    # for page_num, page_content in enumerate(pages, start=1):
-    #     # Clean and split into paragraphs
-    #     paragraphs = [p.strip() for p in page_content.split('\n\n') if p.strip()]
-    #
-    #     if paragraphs:  # Skip empty pages
-    #         structured_pages.append({
-    #             'page_number': page_num,
-    #             'paragraphs': paragraphs
-    #         })
-    #         stats[f"page_{page_num}"] = len(paragraphs)
-
-
-def parse_pdf(file: SpiderFile, stats: dict) -> str:
-    """
-    Extracts structured text from .pdf files with page numbers and paragraphs.
-    Uses PyPDF2 to extract text from PDF files.
+    Extracts text of the downloaded file
+
+    Yields (page number, text). Page number is None for files without pages.
+    Text is taken from the parsed text cache if the blob was parsed before
+    by the same version of the parser. `cache=False`: the cache is neither
+    read nor written (worker process).
     """
-    file_name: str = file.storage_object_name
-    file_path: str = file.target_path
-    logger.info(msg := f"Parsing PDF file: {file_path} ...")
-    if file_name not in stats:
-        stats[file_name] = defaultdict(int)
-    stats = stats[file_name]
-    
-    try:
-        # Open PDF file and read it using PyPDF2
-        with open(file_path, 'rb') as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            full_text = ""
-            for page_num, page in enumerate(reader.pages):
-                # Extract text from each page
-                text = page.extract_text()
-                if text:
-                    full_text += f"Page {page_num + 1}:\n{text}\n\n"
-            if not full_text:
-                # raise AssertionError("No text extracted from PDF.")
-                logger.info(f"Text length: {len(full_text)}")
-    except Exception as e:
-        logger.error(msg := f"Error parsing PDF file: {e}")
-        raise AssertionError(msg)
+    mime_type, parser = get_parser(file.target_path, file.storage_object_name)
+    if parser is None:
+        raise AssertionError(f"Unsupported file type: {mime_type}, {file.storage_object_name}")
+
+    # Cache hit: no extraction at all
+    if cache and (pages := get_cached(file, parser, stats)) is not None:
+        return pages
 
-    text_len = len(full_text)
-    stats['text_len'] = text_len
-    if text_len > 0:
-        stats['parsed'] = 1
-    logger.info(f"{msg} done")
-    return full_text
+    stats['fs']['text_cache_miss'] += 1
+    pages = parser.parse(file, stats['file'])
+    if cache and file.blob_hash:
+        pages = cache_put(file.blob_hash, parser.name, parser.version, pages)
+    return pages
 
 
-def parse_excel(file: SpiderFile, stats: dict) -> str:
+def normalize_file(
+        file: SpiderFile, pages: Iterable[tuple[int | None, str]], stats: dict
+) -> Iterator[tuple[int | None, str]]:
     """
-    Extracts structured text from .xlsx (Excel) files with sheet names and data.
-    Uses pandas to read Excel sheets and convert them into string format.
+    Normalization between parsing and chunking (strip_document_boilerplate).
+    Normalized text is written next to the file as .txt while it's read:
+    import_text_files chunks the same text as import_files.
+    """
+    return write_text_pages(file.target_path, strip_document_boilerplate(pages, stats['vectordb']), stats)
+
+
+def fail_file(cat_conn: DbConnManager, file: SpiderFile, error: BaseException | str, stats: dict) -> None:
+    """
+    The file can't be parsed: it's marked with the error status and parsed again next run
     """
     file_name: str = file.storage_object_name
-    file_path: str = file.target_path
-    logger.info(msg := f"Parsing Excel file: {file_path} ...")
-    if file_name not in stats:
-        stats[file_name] = defaultdict(int)
-    stats = stats[file_name]
-    
+    logger.error(f"Failed to parse file: {file_name}: {error}")
+    file_set_status(cat_conn, file.storage_object_id, Status.error.value)
+    stats['file'][file_name]['failed'] = 1
+    stats['vectordb']['parse_failed'] += 1
+
+
+def guard_pages(pages: Iterable[tuple[int | None, str]], errors: list) -> Iterator[tuple[int | None, str]]:
+    """
+    Pages of the file. An error of the parser (converter timeout, exit code,
+    output limit) is recorded in `errors` before it's raised: the caller tells
+    it from errors of the vector DB.
+    """
     try:
-        # Use pandas to read the Excel file
-        df = pd.read_excel(file_path, sheet_name=None)  # Read all sheets into a dictionary
-        full_text = ""
-        for sheet_name, sheet_data in df.items():
-            full_text += f"Sheet: {sheet_name}\n"
-            full_text += sheet_data.to_string(index=False) + "\n\n"
-        if not full_text:
-            raise AssertionError("No text extracted from Excel.")
+        yield from pages
     except Exception as e:
-        logger.error(msg := f"Error parsing Excel file: {e}")
-        raise AssertionError(msg)
+        errors.append(e)
+        raise
+
+
+def parse_file_isolated(file: SpiderFile) -> tuple[list[tuple[int | None, str]], dict]:
+    """
+    parse_file() for a worker process. Returns pages and statistics of the file.
+
+    The worker writes no files: the text cache is written by the parent, a
+    worker killed on timeout leaves no temporary files behind.
+    """
+    stats: dict = {
+        'fs': defaultdict(int),
+        'file': {},
+    }
+    pages: list[tuple[int | None, str]] = list(parse_file(file, stats, cache=False))
+    return pages, stats
+
+
+def parse_files_parallel(
+        cat_conn: DbConnManager, files: Iterable[SpiderFile], stats: dict
+) -> Iterator[tuple[SpiderFile, list[tuple[int | None, str]]]]:
+    """
+    Parses files in a process pool, yields (file, pages) as soon as each file is parsed.
+
+    A file that fails, exceeds `parse_timeout` or `parse_memory_limit_mb`
+    is marked with the error status and skipped.
+
+    Files found in the parsed text cache aren't sent to workers. Text parsed
+    by a worker is put into the cache here.
+    """
+    cached: deque[tuple[SpiderFile, Iterable[tuple[int | None, str]]]] = deque()
 
-    text_len = len(full_text)
-    stats['text_len'] = text_len
-    if text_len > 0:
-        stats['parsed'] = 1
-    logger.info(f"{msg} done")
-    return full_text
+    def get_uncached() -> Iterator[SpiderFile]:
+        for file in files:
+            mime_type, parser = get_parser(file.target_path, file.storage_object_name)
+            if parser is not None and (pages := get_cached(file, parser, stats)) is not None:
+                cached.append((file, pages))
+            else:
+                yield file
+
+    for file, result, error in imap_isolated(
+            parse_file_isolated,
+            get_uncached(),
+            workers=settings.parse_workers,
+            timeout=settings.parse_timeout,
+            mem_limit_mb=settings.parse_memory_limit_mb,
+    ):
+        while cached:
+            yield cached.popleft()
+
+        file_name: str = file.storage_object_name
+        if error is not None:
+            fail_file(cat_conn, file, error, stats)
+            continue
+
+        # Merge statistics of the worker
+        pages, file_stats = result
+        stats['file'][file_name].update(file_stats['file'].get(file_name, {}))
+        for key, value in file_stats['fs'].items():
+            stats['fs'][key] += value
+        mime_type, parser = get_parser(file.target_path, file_name)
+        if file.blob_hash:
+            pages = list(cache_put(file.blob_hash, parser.name, parser.version, pages))
+        yield file, pages
+
+    while cached:
+        yield cached.popleft()
+
+
+def make_doc_attrs(file: SpiderFile, sites: dict) -> dict:
+    """
+    Attributes of the file for vector DB
+    """
+    # Get StorageObject attributes from filestorage.storage_storageobject table
+    so_attrs: StorageObject = get_storage_object(file.storage_object_id)
+    return {
+        'object_id'         : file.storage_object_id,
+        'type'              : 'file',
+        'name'              : file.storage_object_name,
+        'site_id'           : file.storage_object_site_id,
+        'site_name'         : sites[file.storage_object_site_id],
+        'size'              : so_attrs.size,
+        'created_at'        : so_attrs.created_at,
+        'created_by_id'     : str(so_attrs.created_by_id),
+        'updated_at'        : so_attrs.updated_at,
+        'updated_by_id'     : str(so_attrs.updated_by_id),
+        'link'              : make_storage_url(file.storage_version_link),
+    }
+
+
+def is_seen(seen_blobs: set[str] | None, file: SpiderFile, stats: dict) -> bool:
+    """
+    Same content as a file imported earlier in the run (full sync mode only,
+    run_blobs()): its chunks are there, the file is skipped. Otherwise the blob is remembered.
+    """
+    if seen_blobs is None or not file.blob_hash:
+        return False
+    if file.blob_hash in seen_blobs:
+        logger.info(f"Same content already imported: {file.storage_object_name}")
+        stats['vectordb']['deduplicated'] += 1
+        return True
+    seen_blobs.add(file.blob_hash)
+    return False
+
+
+def insert_file(
+        writer: BatchWriter,
+        cat_conn: DbConnManager,
+        file: SpiderFile,
+        text_chunks: Iterable[Document],
+        doc_attrs: dict,
+        stats: dict,
+        duplicates: NearDuplicates | None = None,
+        same_content: bool = False,
+) -> int:
+    """
+    Sends chunks of the file to vector DB. When they are written the file
+    (with `same_content` all files with its content, skipped in the run) is
+    marked as done, as error if some chunks were dead-lettered: the file is
+    imported again next run.
+    Chunks are upserted by their uuid, old chunks of the file (changed in filestorage) are pruned.
+    Near-duplicates of the chunks inserted earlier in the run are skipped.
+    """
+    def on_done(inserted: int, failed: int) -> None:
+        status_id: int = (Status.error if failed else Status.done).value
+        if same_content and file.blob_hash:
+            file_set_status_by_blob(cat_conn, file.blob_hash, status_id)
+        else:
+            file_set_status(cat_conn, file.storage_object_id, status_id)
+
+    return weaviate_insert(
+        writer, text_chunks, doc_attrs, stats, file_name=file.storage_object_name, duplicates=duplicates,
+        on_done=on_done,
+    )
 
 
 def parse(stats: dict) -> int:
-    status_id: tuple = (Status.downloaded.value, Status.error.value)
+    status_id: tuple = (Status.downloaded.value, Status.error.value, Status.unsupported.value)
 
     # Initialize MongoDB client, db, collection
     # coll = init_mongo(settings.mongo_collection_file)
@@ -158,10 +273,15 @@ def parse(stats: dict) -> int:
     # wc: WeaviateClient = init_weaviate()
     # check_collection_readiness(wc)
 
+    # Drop parsed text made by outdated parser versions
+    for parser in PARSERS.values():
+        cache_prune(parser.name, parser.version)
+
     wc: WeaviateClient
     with (
         DbConnManager(settings.db_conn_str) as cat_conn,
-        init_weaviate() as wc
+        init_weaviate() as wc,
+        BatchWriter(wc, stats['vectordb']) as writer,
     ):
         check_collection_readiness(wc)
 
@@ -173,60 +293,61 @@ def parse(stats: dict) -> int:
             SpiderFile
         ).where(
             SpiderFile.status_id.in_(status_id),
+            SpiderFile.target_path.is_not(None),     # Failed downloads have error status too
+            SpiderFile.storage_object_id.not_in(get_deleted_files()),  # Soft-deleted: reconcile removes them
         ).execution_options(stream_results=True)
 
-        # Iterate over each file
-        for file_num, file in enumerate(
-                cat_conn.execute(query).yield_per(settings.chunk_size)
-        ):
-            # 1. Get filename
-            file = file[0]          # Get object from Row result
-            file_type: str = file.storage_object_name.split('.', maxsplit=1)[-1]
-            file_name: str = file.storage_object_name
-            stats['file'][file_name] = defaultdict(int)
-
-            # Get StorageObject attributes from filestorage.storage_storageobject table
-            so_id: str = file.storage_object_id
-            so_attrs: StorageObject = get_storage_object(so_id)
-
-            # 2. Parse file
-            if file_type == 'doc':
-                # continue
-                content = parse_doc(file, stats['file'])   # Parse .doc file
-            elif file_type == 'pdf':
-                # continue
-                content = parse_pdf(file, stats['file'])  # Parse PDF file
-            elif file_type == 'xlsx':
-                # continue
-                content = parse_excel(file, stats['file'])  # Parse Excel file
-            else:
-                raise AssertionError(
-                    f"Unknown file type: {file_type}, {file.storage_object_name}"
+        # Blobs processed in this run. Storage objects with the same content
+        # are parsed and embedded once (full sync mode).
+        seen_blobs: set[str] | None = run_blobs()
+        # Chunks inserted in this run: copied passages are embedded once
+        duplicates: NearDuplicates | None = run_duplicates()
+
+        def get_files() -> Iterator[SpiderFile]:
+            for file in cat_conn.execute(query).yield_per(settings.chunk_size):
+                # 1. Get filename
+                file = file[0]          # Get object from Row result
+                if not check_supported(cat_conn, file, stats):
+                    continue
+                if is_seen(seen_blobs, file, stats):
+                    continue
+                yield file
+
+        def open_files() -> Iterator[tuple[SpiderFile, Iterable[tuple[int | None, str]]]]:
+            for file in get_files():
+                try:
+                    yield file, parse_file(file, stats)
+                except Exception as e:
+                    fail_file(cat_conn, file, e, stats)
+
+        # 2. Parse files: in a process pool or one by one
+        parsed: Iterable[tuple[SpiderFile, Iterable[tuple[int | None, str]]]]
+        if settings.parse_workers > 1:
+            parsed = parse_files_parallel(cat_conn, get_files(), stats)
+        else:
+            # Files ahead are opened in advance: their converters (antiword) run meanwhile
+            parsed = prefetch(open_files(), settings.converter_workers)
+
+        # Iterate over each parsed file
+        for file, pages in parsed:
+            # 3. Normalize: remove running headers, footers, page numbers. Write .txt
+            errors: list = []
+            pages = normalize_file(file, guard_pages(pages, errors), stats)
+
+            # 4. Chunkate page by page, chunks are inserted as they come
+            text_chunks: Iterable[Document] = chunkate_pages(pages)
+            doc_attrs: dict = make_doc_attrs(file, sites)
+
+            # 5. Insert into vector DB. A parse error fails the file only: chunks sent
+            # are kept, old ones aren't pruned, the file isn't marked done
+            try:
+                insert_file(
+                    writer, cat_conn, file, text_chunks, doc_attrs, stats, duplicates, seen_blobs is not None,
                 )
-
-            # 3. Let's write whole text to file
-            file_path: str = file.target_path
-            write_text_file(file_path, content, stats)
-
-            # 4. Chunkate
-            text_chunks: list[Document] = chunkate_text_rcts(content)
-            doc_attrs = {
-                'object_id'         : file.storage_object_id,
-                'type'              : 'file',
-                'name'              : file.storage_object_name,
-                'site_id'           : file.storage_object_site_id,
-                'site_name'         : sites[file.storage_object_site_id],
-                'size'              : so_attrs.size,
-                'created_at'        : so_attrs.created_at,
-                'created_by_id'     : str(so_attrs.created_by_id),
-                'updated_at'        : so_attrs.updated_at,
-                'updated_by_id'     : str(so_attrs.updated_by_id),
-                'link'              : make_storage_url(file.storage_version_link),
-            }
-
-            # 5. Insert into vector DB
-            count: int = weaviate_insert(wc, text_chunks, doc_attrs, stats)
-            stats['file'][file_name]['vectordb_inserted'] += count
+            except Exception as e:
+                if not errors:
+                    raise
+                fail_file(cat_conn, file, e, stats)
 
             # 6. Insert doc into MongoDB
             # mongo_insert(coll, text_chunks, stats)
@@ -241,10 +362,13 @@ def main():
         'vectordb': defaultdict(int),   # Inserts into vector db
         'mongo': defaultdict(int),      # Inserts into mongodb
         'fs': defaultdict(int),         # File system. If .txt file written
-        'file': defaultdict(int),       # Individual file statistics
+        'file': defaultdict(lambda: defaultdict(int)),  # Individual file statistics, files with the same name are summed up
+        'unsupported': defaultdict(int),    # Skipped files by MIME type
     }
+    stats['vectordb']['chunk'] = defaultdict(int)
 
     parse(stats)
+    stats['db_pool'] = get_pool_stats()
 
     logger.info(get_stats(stats))
     logger.info("Fetcher finished")
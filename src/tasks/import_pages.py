@@ -1,23 +1,83 @@
 from collections import defaultdict
-
-from sqlalchemy import select, cast, Text
-
-from src.common.db import DbConnManager
+from datetime import datetime
+
+from sqlalchemy import select, cast, func, or_, Text
+
+from src.common.db import (
+    DbConnManager,
+    dead_letter_get_ids,
+    get_pool_stats,
+    get_watermark,
+    page_register_many,
+    set_watermark,
+)
+from src.common.dedup import NearDuplicates, run_duplicates
 from src.common.db import compile_sql  # noqa: F401
 from src.common.log import logger
 from src.common.settings import settings
-from src.common.utils import get_stats, decode_html2text, chunkate_text_rcts_plain
+from src.common.text import (
+    RepeatedLines,
+    chunkate_sections,
+    count_saved_chunks,
+    decode_html2sections,
+    decode_html2text,
+    preprocess_text,
+    sample_repeated_lines,
+)
+from src.common.utils import get_stats
 from src.models.vk_cms import SiteServiceObject, Page, Site
-from src.vectordb.weaviate_vdb import check_collection_readiness, init_weaviate, weaviate_insert_plain
+from src.vectordb.weaviate_vdb import (
+    BatchWriter,
+    check_collection_readiness,
+    init_weaviate,
+    weaviate_insert_plain,
+)
+
+
+def sample_site_lines(conn: DbConnManager) -> dict[str, RepeatedLines | None]:
+    """
+    Lines repeated on pages of every site: navigation, footers.
+    Learned from the first `boilerplate_sample_pages` pages of a site by id
+    before any page is imported, whatever the watermark: all pages of the site
+    are stripped by the same lines.
+    """
+    sample = select(
+        SiteServiceObject.site_id,
+        Page.body,
+        func.row_number().over(partition_by=SiteServiceObject.site_id, order_by=Page.id).label('n'),
+    ).join(
+        SiteServiceObject,
+        SiteServiceObject.external_id == cast(Page.id, Text),
+    ).where(
+        SiteServiceObject.site_id.in_(settings.site_ids),
+    ).subquery()
+    query = select(sample.c.site_id, sample.c.body).where(sample.c.n <= settings.boilerplate_sample_pages)
+
+    texts: dict[str, list[str]] = defaultdict(list)
+    for row in conn.execute(query):
+        texts[row.site_id].append(preprocess_text(decode_html2text(row.body['data'])))
+    return {site_id: sample_repeated_lines(site_texts) for site_id, site_texts in texts.items()}
 
 
 def import_page(stats: dict) -> None:
     """
     Import pages_page table from DB.
+
+    In incremental sync mode only pages changed after the watermark are
+    imported (including pages of renamed sites). Chunks are upserted by
+    their uuid, old chunks of the page are pruned on insert.
+    Chunks of all pages go into one batch (BatchWriter).
+    Pages with dead-lettered chunks are imported again in any mode.
+    Imported pages are registered in meta.spider_page: reconcile finds deleted ones there.
     """
+    watermark: datetime = get_watermark('page')
+    with DbConnManager(settings.db_conn_str) as cat_conn:
+        dead_letters: list[str] = dead_letter_get_ids(cat_conn, settings.weaviate_collection, 'page')
     with (
         DbConnManager(settings.vk_db_conn_str_cms) as conn,
+        DbConnManager(settings.db_conn_str) as cat_conn,
         init_weaviate() as wc,
+        BatchWriter(wc, stats['vectordb'], dead_letters=dead_letters) as writer,
     ):
         # Query pages_page + site_service_object
         query = select(
@@ -31,6 +91,7 @@ def import_page(stats: dict) -> None:
             Page.updated_by_id,
             SiteServiceObject.site_id,
             Site.name.label('site_name'),                 # site name
+            Site.updated_at.label('site_updated_at'),
             SiteServiceObject.type                        # page all
             # TODO: We need to add link to the site here
         ).join(
@@ -41,45 +102,68 @@ def import_page(stats: dict) -> None:
             Site.id == SiteServiceObject.site_id,
         ).where(
             SiteServiceObject.site_id.in_(settings.site_ids),  # Our sites
+            or_(
+                Page.created_at > watermark,
+                Page.updated_at > watermark,
+                Site.updated_at > watermark,
+                cast(Page.id, Text).in_(dead_letters),
+            ),
         ).execution_options(stream_results=True)          # Streaming for chunking
 
         # Check if we are able to insert into vdb
         check_collection_readiness(wc)
 
-        # Iterate over each page
-        for i, row in enumerate(conn.execute(query).yield_per(settings.chunk_size)):
-            # 1. Get object name
-            logger.info(f"{i}, {row.page_id}, {row.name}")
-            object_name: str = row.name
-            stats['source_object'][object_name] = defaultdict(int)
-
-            # 2. Read pages content
-            raw_data: str = row.body['data']
-            content: str = decode_html2text(raw_data)
-
-            # 4. Chunkate
-            text_chunks: list[str] = chunkate_text_rcts_plain(content, stats['vectordb']['chunk'])
-            doc_attrs: dict = {
-                'object_id': row.page_id,               # page_id as object_id
-                'type': 'page',
-                'name': row.name,
-                'site_id': row.site_id,
-                'site_name': row.site_name,             # site name
-                'size': len(content),
-                'created_at': row.created_at,
-                'created_by_id': row.created_by_id,
-                'updated_at': row.updated_at,
-                'updated_by_id': row.updated_by_id,
-                # 'link': None,                         # No links found
-                # 'views_count': row.views_count,       # Кол-во просмотров
-            }
-
-            # 5. Insert into vector DB
-            count: int = weaviate_insert_plain(
-                wc, text_chunks, doc_attrs, stats, object_name=object_name,
-            )
-            stats['source_object'][object_name]['vectordb_inserted'] += count
-            stats['source_object'][object_name]['site_name'] = row.site_name
+        # Lines repeated on pages of the site: navigation, footers
+        site_lines: dict[str, RepeatedLines | None] = sample_site_lines(conn) if settings.boilerplate_enabled else {}
+        # Chunks inserted in this run: copied passages are embedded once
+        duplicates: NearDuplicates | None = run_duplicates()
+
+        # Iterate over chunks of pages
+        new_watermark: datetime = watermark
+        for chunk in conn.execute(query).yield_per(settings.chunk_size).partitions():
+            page_register_many(cat_conn, chunk)
+            for row in chunk:
+                # 1. Get object name
+                logger.info(f"{row.page_id}, {row.name}")
+                new_watermark = max(
+                    new_watermark, row.created_at, row.updated_at or watermark, row.site_updated_at or watermark,
+                )
+                object_name: str = row.name
+
+                # 2. Read pages content: sections at the headings
+                raw_data: str = row.body['data']
+                sections: list[str] = [preprocess_text(text) for text in decode_html2sections(raw_data)]
+
+                # 3. Remove lines seen on other pages of the site
+                if (repeated := site_lines.get(row.site_id)) is not None:
+                    sections = [repeated.strip(text, stats['vectordb']) for text in sections]
+                content: str = '\n\n'.join(filter(None, sections))
+
+                # 4. Chunkate section by section
+                text_chunks: list[str] = chunkate_sections(sections, stats['vectordb']['chunk'])
+                doc_attrs: dict = {
+                    'object_id': row.page_id,               # page_id as object_id
+                    'type': 'page',
+                    'name': row.name,
+                    'site_id': row.site_id,
+                    'site_name': row.site_name,             # site name
+                    'size': len(content),
+                    'created_at': row.created_at,
+                    'created_by_id': row.created_by_id,
+                    'updated_at': row.updated_at,
+                    'updated_by_id': row.updated_by_id,
+                    # 'link': None,                         # No links found
+                    # 'views_count': row.views_count,       # Кол-во просмотров
+                }
+
+                # 5. Insert into vector DB
+                weaviate_insert_plain(
+                    writer, text_chunks, doc_attrs, stats, object_name=object_name, duplicates=duplicates,
+                )
+                stats['source_object'][object_name]['site_name'] = row.site_name
+
+    count_saved_chunks(stats['vectordb'])
+    set_watermark('page', new_watermark)
 
 
 @logger.catch(reraise=True)
@@ -89,11 +173,12 @@ def main():
     # Statistics
     stats: dict = {
         'vectordb': defaultdict(int),
-        'source_object': defaultdict(int),
+        'source_object': defaultdict(lambda: defaultdict(int)),     # Pages with the same name are summed up
     }
     stats['vectordb']['chunk'] = defaultdict(int)
 
     import_page(stats)
+    stats['db_pool'] = get_pool_stats()
 
     logger.info(get_stats(stats))
     logger.info("Fetcher finished")
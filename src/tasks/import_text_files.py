@@ -1,19 +1,34 @@
 import os
 from collections import defaultdict
+from datetime import datetime
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, cast, or_, Text
 from weaviate.client import WeaviateClient
 
-from src.common.db import DbConnManager, get_sites
+from src.common.db import (
+    DbConnManager,
+    dead_letter_get_ids,
+    get_sites,
+    get_pool_stats,
+    get_watermark,
+    set_watermark,
+)
+from src.common.dedup import NearDuplicates, run_blobs, run_duplicates
 from src.common.log import logger
 from src.common.settings import settings
+from src.common.text import chunkate_text_rcts_plain
 from src.common.utils import (
     get_stats,
     make_storage_url,
-    chunkate_text_rcts_plain,
 )
+from src.models.cat_meta import SpiderFile
 from src.models.vk_filestorage import StorageObject, StorageVersion
-from src.vectordb.weaviate_vdb import init_weaviate, check_collection_readiness, weaviate_insert_plain
+from src.vectordb.weaviate_vdb import (
+    BatchWriter,
+    init_weaviate,
+    check_collection_readiness,
+    weaviate_insert_plain,
+)
 
 
 def read_text_file(file_path: str, stats: dict) -> str:
@@ -31,12 +46,33 @@ def read_text_file(file_path: str, stats: dict) -> str:
 
 
 def load_text_files(stats: dict) -> int:
+    """
+    Import text of downloaded files: .txt written by import_files, already
+    normalized (headers, footers and page numbers removed).
+
+    In incremental sync mode only files changed after the watermark are
+    imported (including files of renamed sites). Chunks are upserted by
+    their uuid, old chunks of the file are pruned on insert.
+    Chunks of all files go into one batch (BatchWriter).
+    Files with dead-lettered chunks are imported again in any mode.
+    """
     wc: WeaviateClient
+    watermark: datetime = get_watermark('text_file')
+    with DbConnManager(settings.db_conn_str) as cat_conn:
+        dead_letters: list[str] = dead_letter_get_ids(cat_conn, settings.weaviate_collection, 'file')
+    all_sites: list = get_sites(full=False)
+    sites: dict = {
+        str(item.id): item.name for item in all_sites
+    }
+    changed_sites: list = [
+        item.id for item in all_sites if item.updated_at and item.updated_at > watermark
+    ]
 
     with (
         DbConnManager(settings.vk_db_conn_str_filestorage) as vk_conn,
         DbConnManager(settings.db_conn_str) as cat_conn,
         init_weaviate() as wc,
+        BatchWriter(wc, stats['vectordb'], dead_letters=dead_letters) as writer,
     ):
         query = select(
             StorageObject.id,
@@ -56,56 +92,86 @@ def load_text_files(stats: dict) -> int:
             and_(
                 StorageObject.type == 1,                        # Type file
                 StorageObject.site_id.in_(settings.site_ids),   # Our sites
+                StorageObject.deleted_at.is_(None),             # Not soft-deleted: reconcile removes them
+                or_(
+                    StorageObject.created_at > watermark,
+                    StorageObject.updated_at > watermark,
+                    StorageObject.site_id.in_(changed_sites),
+                    cast(StorageObject.id, Text).in_(dead_letters),
+                ),
             )
         ).execution_options(stream_results=True)  # Streaming for chunking
 
-        sites: dict = {
-            str(item.id): item.name for item in get_sites(full=False)
+        # Downloaded blobs: storage_object_id -> (blob_hash, target_path)
+        blobs: dict = {
+            str(item.storage_object_id): (item.blob_hash, item.target_path)
+            for item in cat_conn.execute(
+                select(SpiderFile.storage_object_id, SpiderFile.blob_hash, SpiderFile.target_path).where(
+                    SpiderFile.blob_hash.is_not(None),
+                )
+            )
         }
+        # Storage objects with the same content are imported once (full sync mode)
+        seen_blobs: set[str] | None = run_blobs()
+        # Chunks inserted in this run: copied passages are embedded once
+        duplicates: NearDuplicates | None = run_duplicates()
 
         # Check if we are able to insert into vdb
         check_collection_readiness(wc)
 
-        # Iterate over each file
+        # Iterate over chunks of files
+        new_watermark: datetime = max(
+            [watermark] + [item.updated_at for item in all_sites if item.updated_at]
+        )
         file: StorageObject | StorageVersion
-        for file_num, file in enumerate(
-                vk_conn.execute(query).yield_per(settings.chunk_size)
-        ):
-            # 1. Get filename
-            file_name: str = file.name + '.txt'
-            file_path: str = f"{settings.download_dir}/{file_name}"
-            stats['source_object'][file_name] = defaultdict(int)
-
-            # 2. Read file .txt
-            content = read_text_file(file_path, stats['source_object'][file_name])
-            if not content:
-                continue
-
-            # 4. Chunkate
-            text_chunks: list[str] = chunkate_text_rcts_plain(content, stats['vectordb']['chunk'])
-            doc_attrs = {
-                'object_id': file.id,
-                'type': 'file',
-                'name': file.name,
-                'site_id': file.site_id,
-                'site_name': sites[str(file.site_id)],
-                'size': file.size,
-                'created_at': file.created_at,
-                'created_by_id': str(file.created_by_id),
-                'updated_at': file.updated_at,
-                'updated_by_id': str(file.updated_by_id),
-                'link': make_storage_url(file.link),
-            }
-
-            # 5. Insert into vector DB
-            count: int = weaviate_insert_plain(
-                wc, text_chunks, doc_attrs, stats, object_name=file_name
-            )
-            stats['source_object'][file_name]['vectordb_inserted'] += count
-            stats['source_object'][file_name]['site_name'] = sites[str(file.site_id)]
-
-            # 6. Insert doc into MongoDB
-            # mongo_insert(coll, text_chunks, stats)
+        for chunk in vk_conn.execute(query).yield_per(settings.chunk_size).partitions():
+            for file in chunk:
+                new_watermark = max(new_watermark, file.created_at, file.updated_at)
+                # 1. Get filename
+                file_name: str = file.name + '.txt'
+                blob_hash, target_path = blobs.get(str(file.id), (None, None))
+                if seen_blobs is not None and blob_hash in seen_blobs:
+                    logger.info(f"Same content already imported: {file.name}")
+                    stats['vectordb']['deduplicated'] += 1
+                    continue
+                if target_path:
+                    file_path: str = f"{target_path}.txt"
+                else:
+                    file_path: str = f"{settings.download_dir}/{file_name}"
+
+                # 2. Read file .txt
+                content = read_text_file(file_path, stats['source_object'][file_name])
+                if not content:
+                    continue
+
+                # 4. Chunkate
+                text_chunks: list[str] = chunkate_text_rcts_plain(content, stats['vectordb']['chunk'])
+                doc_attrs = {
+                    'object_id': file.id,
+                    'type': 'file',
+                    'name': file.name,
+                    'site_id': file.site_id,
+                    'site_name': sites[str(file.site_id)],
+                    'size': file.size,
+                    'created_at': file.created_at,
+                    'created_by_id': str(file.created_by_id),
+                    'updated_at': file.updated_at,
+                    'updated_by_id': str(file.updated_by_id),
+                    'link': make_storage_url(file.link),
+                }
+
+                # 5. Insert into vector DB
+                weaviate_insert_plain(
+                    writer, text_chunks, doc_attrs, stats, object_name=file_name, duplicates=duplicates,
+                )
+                stats['source_object'][file_name]['site_name'] = sites[str(file.site_id)]
+                if seen_blobs is not None and blob_hash:
+                    seen_blobs.add(blob_hash)
+
+                # 6. Insert doc into MongoDB
+                # mongo_insert(coll, text_chunks, stats)
+
+    set_watermark('text_file', new_watermark)
 
 
 @logger.catch(reraise=True)
@@ -115,11 +181,12 @@ def main():
     # Statistics
     stats: dict = {
         'vectordb': defaultdict(int),  # Inserts into vector db
-        'source_object': defaultdict(int),
+        'source_object': defaultdict(lambda: defaultdict(int)),    # Files with the same name are summed up
     }
     stats['vectordb']['chunk'] = defaultdict(int)
 
     load_text_files(stats)
+    stats['db_pool'] = get_pool_stats()
 
     logger.info(get_stats(stats))
     logger.info("Fetcher finished")
@@ -0,0 +1,163 @@
+import queue
+import threading
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+
+from langchain_core.documents import Document
+from weaviate.client import WeaviateClient
+
+from src.common.db import DbConnManager, get_sites, get_pool_stats, file_select_many
+from src.common.dedup import NearDuplicates, run_blobs, run_duplicates
+from src.common.log import logger
+from src.common.settings import settings
+from src.common.text import chunkate_pages
+from src.common.utils import get_stats
+from src.models.cat_meta import SpiderFile, Status
+from src.tasks.fetch_files import download
+from src.tasks.import_files import (
+    check_supported,
+    fail_file,
+    parse_file,
+    normalize_file,
+    make_doc_attrs,
+    insert_file,
+    is_seen,
+)
+from src.vectordb.weaviate_vdb import BatchWriter, init_weaviate, check_collection_readiness
+
+# End of stream marker
+STOP = object()
+
+
+def run_stage(
+        func: Callable[[object], Iterable | None],
+        inbox: queue.Queue,
+        outbox: queue.Queue | None,
+        errors: list,
+) -> None:
+    """
+    Pipeline stage: takes items from inbox, puts results of func into outbox.
+
+    After a failure the stage keeps draining inbox, so upstream stages are
+    never blocked on a full queue. STOP is passed downstream in any case.
+    """
+    try:
+        while (item := inbox.get()) is not STOP:
+            if errors:
+                continue
+            try:
+                for result in func(item) or ():
+                    outbox.put(result)
+            except Exception as e:
+                logger.error(f"Pipeline stage {threading.current_thread().name} failed: {e}")
+                errors.append(e)
+    finally:
+        if outbox is not None:
+            outbox.put(STOP)
+
+
+def pipeline(stats: dict) -> None:
+    """
+    Streaming import of files: fetch -> parse -> chunk -> embed.
+
+    Stages run concurrently and are connected with bounded queues, so a file
+    is parsed as soon as it is downloaded and its chunks go to vector DB while
+    later files are still downloading. A slow stage blocks the previous one
+    (back-pressure) instead of piling up data in memory.
+    """
+    status_id: tuple = (Status.downloaded.value, Status.error.value, Status.unsupported.value)
+    fetched: queue.Queue = queue.Queue(settings.pipeline_queue_size)   # file ids
+    parsed: queue.Queue = queue.Queue(settings.pipeline_queue_size)    # (file, pages)
+    chunked: queue.Queue = queue.Queue(settings.pipeline_queue_size)   # (file, chunks, doc_attrs)
+    errors: list = []
+
+    wc: WeaviateClient
+    with (
+        DbConnManager(settings.db_conn_str) as cat_conn,
+        init_weaviate() as wc,
+        BatchWriter(wc, stats['vectordb']) as writer,  # Fed by the embed stage
+    ):
+        check_collection_readiness(wc)
+
+        sites: dict = {
+            str(item.id): item.name for item in get_sites(full=False)
+        }
+
+        # Blobs processed in this run. Storage objects with the same content
+        # are parsed and embedded once (full sync mode).
+        seen_blobs: set[str] | None = run_blobs()
+        # Chunks inserted in this run (by the embed stage only)
+        duplicates: NearDuplicates | None = run_duplicates()
+
+        def parse_stage(ids: list) -> Iterable[tuple]:
+            with DbConnManager(settings.db_conn_str) as conn:
+                files: list[SpiderFile] = file_select_many(conn, ids, status_id)
+            for file in files:
+                if not check_supported(conn, file, stats):
+                    continue
+                if is_seen(seen_blobs, file, stats):
+                    continue
+                try:
+                    pages: list = list(parse_file(file, stats))
+                except Exception as e:
+                    fail_file(conn, file, e, stats)     # The file only, the pipeline goes on
+                    continue
+                yield file, pages
+
+        def chunk_stage(item: tuple) -> Iterable[tuple]:
+            file, pages = item
+            pages = normalize_file(file, pages, stats)
+            text_chunks: list[Document] = list(chunkate_pages(pages))
+            yield file, text_chunks, make_doc_attrs(file, sites)
+
+        def embed_stage(item: tuple) -> None:
+            file, text_chunks, doc_attrs = item
+            insert_file(writer, cat_conn, file, text_chunks, doc_attrs, stats, duplicates, seen_blobs is not None)
+
+        stages: list[threading.Thread] = [
+            threading.Thread(target=run_stage, args=(parse_stage, fetched, parsed, errors), name='parse'),
+            threading.Thread(target=run_stage, args=(chunk_stage, parsed, chunked, errors), name='chunk'),
+            threading.Thread(target=run_stage, args=(embed_stage, chunked, None, errors), name='embed'),
+        ]
+        for stage in stages:
+            stage.start()
+
+        def on_stored(ids: list) -> None:
+            if errors:
+                raise AssertionError(f"Pipeline stopped: {errors[0]}")
+            fetched.put(ids)
+
+        try:
+            download(stats['fetch'], on_stored=on_stored)
+        finally:
+            fetched.put(STOP)
+            for stage in stages:
+                stage.join()
+
+        if errors:
+            raise errors[0]
+
+
+@logger.catch(reraise=True)
+def main():
+    logger.info("Pipeline started")
+
+    # Statistics
+    stats: dict = {
+        'fetch': {'file': defaultdict(int)},    # Downloads
+        'vectordb': defaultdict(int),           # Inserts into vector db
+        'fs': defaultdict(int),                 # File system. If .txt file written
+        'file': defaultdict(lambda: defaultdict(int)),  # Individual file statistics
+        'unsupported': defaultdict(int),        # Skipped files by MIME type
+    }
+    stats['vectordb']['chunk'] = defaultdict(int)
+
+    pipeline(stats)
+    stats['db_pool'] = get_pool_stats()
+
+    logger.info(get_stats(stats))
+    logger.info("Pipeline finished")
+
+
+if __name__ == '__main__':
+    main()
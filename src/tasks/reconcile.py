@@ -0,0 +1,139 @@
+import uuid
+from collections import defaultdict
+
+from sqlalchemy import select, and_, cast, Text
+from weaviate.client import WeaviateClient
+
+from src.common.db import (
+    DbConnManager,
+    file_get_present,
+    file_set_status_many,
+    get_pool_stats,
+    page_delete_many,
+    page_get_all,
+)
+from src.common.log import logger
+from src.common.settings import settings
+from src.common.utils import get_stats
+from src.models.cat_meta import SpiderFile, Status
+from src.models.vk_cms import Page, SiteServiceObject
+from src.models.vk_filestorage import StorageObject
+from src.vectordb.weaviate_vdb import init_weaviate, weaviate_delete_objects
+
+
+def get_live_pages() -> set[str]:
+    """
+    Ids of pages of our sites existing in cms.
+    """
+    with DbConnManager(settings.vk_db_conn_str_cms) as conn:
+        query = select(
+            Page.id,
+        ).join(
+            SiteServiceObject,
+            SiteServiceObject.external_id == cast(Page.id, Text),
+        ).where(
+            SiteServiceObject.site_id.in_(settings.site_ids),  # Our sites
+        )
+        return {str(page_id) for page_id in conn.execute(query).scalars()}
+
+
+def get_live_files() -> set[str]:
+    """
+    Ids of files of our sites existing in filestorage and not soft-deleted.
+    """
+    with DbConnManager(settings.vk_db_conn_str_filestorage) as conn:
+        query = select(
+            StorageObject.id,
+        ).where(
+            and_(
+                StorageObject.type == 1,                        # Type file
+                StorageObject.site_id.in_(settings.site_ids),   # Our sites
+                StorageObject.deleted_at.is_(None),             # Not soft-deleted
+            )
+        )
+        return {str(file_id) for file_id in conn.execute(query).scalars()}
+
+
+def forget_files(file_ids: list[str], stats: dict) -> None:
+    """
+    Mark removed files as deleted in meta.spider_file.
+
+    Chunks of the content shared by several files are stored once, under one
+    of them. If that one is removed, the rest of the files are set back to
+    downloaded to be imported again.
+    """
+    file_ids: list[uuid.UUID] = [uuid.UUID(file_id) for file_id in file_ids]
+    with DbConnManager(settings.db_conn_str) as conn:
+        stats['file']['marked_deleted'] += file_set_status_many(conn, file_ids, Status.deleted.value)
+        blobs = select(SpiderFile.blob_hash).where(
+            SpiderFile.storage_object_id.in_(file_ids),
+            SpiderFile.blob_hash.is_not(None),
+        )
+        count: int = conn.session.query(SpiderFile).filter(
+            SpiderFile.blob_hash.in_(blobs),
+            SpiderFile.status_id.in_((Status.parsed.value, Status.done.value)),
+        ).update({SpiderFile.status_id: Status.downloaded.value}, synchronize_session=False)
+        conn.commit()
+        stats['file']['reimport'] += count
+
+
+def reconcile(stats: dict) -> None:
+    """
+    Remove chunks of pages and files which are deleted (or soft-deleted) in VK databases.
+
+    Imported objects (meta.spider_page, meta.spider_file not marked deleted)
+    are compared with live objects, the collection isn't read.
+    Chunks of the rest are removed with bulk object_id filter deletes.
+    """
+    wc: WeaviateClient
+    with init_weaviate() as wc:
+        with DbConnManager(settings.db_conn_str) as conn:
+            objects: dict[str, dict[str, str]] = {
+                'page': page_get_all(conn),
+                'file': file_get_present(conn),
+            }
+        live: dict[str, set[str]] = {
+            'page': get_live_pages(),
+            'file': get_live_files(),
+        }
+
+        for object_type, live_ids in live.items():
+            present: dict[str, str] = objects.get(object_type, {})
+            stale: list[str] = sorted(set(present) - live_ids)
+            stats[object_type]['present'] = len(present)
+            stats[object_type]['stale'] = len(stale)
+            for object_id in stale:
+                logger.info(f"Removing {object_type}: {object_id}, {present[object_id]}")
+            stats['removed'][object_type] = {object_id: present[object_id] for object_id in stale}
+
+            batch_size: int = settings.weaviate_delete_batch
+            for i in range(0, len(stale), batch_size):
+                stats[object_type]['chunks_deleted'] += weaviate_delete_objects(wc, stale[i:i + batch_size])
+
+            if object_type == 'file' and stale:
+                forget_files(stale, stats)
+            elif object_type == 'page' and stale:
+                with DbConnManager(settings.db_conn_str) as conn:
+                    page_delete_many(conn, [uuid.UUID(page_id) for page_id in stale])
+
+
+@logger.catch(reraise=True)
+def main():
+    logger.info("Reconcile started")
+
+    # Statistics
+    stats: dict = {
+        'page': defaultdict(int),
+        'file': defaultdict(int),
+        'removed': {},              # Removed objects: {type: {object_id: name}}
+    }
+
+    reconcile(stats)
+    stats['db_pool'] = get_pool_stats()
+
+    logger.info(get_stats(stats))
+    logger.info("Reconcile finished")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
+from src.common.db import DbConnManager
 from src.common.log import logger
+from src.common.settings import settings
+from src.models.cat_meta import SpiderFile, Status
 from src.vectordb.weaviate_vdb import init_weaviate, delete_collection, create_collection
 
 
@@ -6,10 +9,23 @@ from src.vectordb.weaviate_vdb import init_weaviate, delete_collection, create_c
 def main():
     logger.info("Recreate_collection started")
 
+    if settings.sync_mode == 'incremental':
+        # Collection is kept, changed objects replace their chunks
+        logger.info("Incremental sync mode: collection is kept")
+        return
+
     with init_weaviate() as wc:
         delete_collection(wc)
         create_collection(wc)
 
+    # Collection is empty now: imported files have to be imported again
+    with DbConnManager(settings.db_conn_str) as conn:
+        count: int = conn.session.query(SpiderFile).filter(
+            SpiderFile.status_id.in_((Status.parsed.value, Status.done.value))
+        ).update({SpiderFile.status_id: Status.downloaded.value})
+        conn.commit()
+        logger.info(f"Files to import again: {count}")
+
     logger.info("Recreate_collection finished")
 
 
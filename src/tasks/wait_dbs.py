@@ -4,10 +4,6 @@ import time
 from src.common.db import DbConnManager
 from src.common.log import logger
 from src.common.settings import settings
-from src.tasks.fetch_files import main as fetch_files
-from src.tasks.import_files import main as import_files
-from src.tasks.import_sites import main as import_site
-from src.tasks.import_pages import main as import_page
 from src.vectordb.weaviate_vdb import init_weaviate
 
 
@@ -1,16 +1,31 @@
 import time
 import uuid
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
 
-from langchain_core.documents import Document
 from weaviate import WeaviateClient
 from weaviate import connect_to_local as weaviate_connect_to_local
 from weaviate.classes.config import Configure, Property, DataType
 from weaviate.classes.init import Auth
 from weaviate.collections import Collection
+from weaviate.collections.classes.batch import ErrorObject
 from weaviate.collections.classes.config import Tokenization
+from weaviate.collections.classes.filters import Filter
 
+from src.common.db import DbConnManager, dead_letter_delete_many, dead_letter_put_many
+from src.common.dedup import NearDuplicates
 from src.common.log import logger
 from src.common.settings import settings
+from src.common.utils import make_text_hash
+
+# Named vector of the chunk content
+VECTOR_NAME: str = "text_vectorizer"
+# Namespace of the chunk uuids
+CHUNK_NAMESPACE: uuid.UUID = uuid.UUID('6c0b7a3e-51d2-4f8e-9a47-2d3f0e8c1b95')
+
+if TYPE_CHECKING:   # Annotations only: langchain isn't loaded by the tasks without chunking
+    from langchain_core.documents import Document
 
 
 def init_weaviate() -> WeaviateClient:
@@ -107,7 +122,7 @@ def create_collection(
                 # Configure.NamedVectors.text2vec_huggingface()  # TODO: Test models from wiki
                 Configure.NamedVectors.text2vec_ollama(
                     # It's just name
-                    name="text_vectorizer",
+                    name=VECTOR_NAME,
                     # source_properties: Properties to vectorize
                     source_properties=["content"],  # It has to match the field name
                     # Ollama API connection string
@@ -123,33 +138,324 @@ def create_collection(
         logger.error(f"Failed to create weaviate collection: {e}")
 
 
+def is_duplicate(
+        duplicates: NearDuplicates | None,
+        text: str,
+        key: tuple,
+        stats: dict,
+        object_stats: dict,
+) -> bool:
+    """
+    Near-duplicate of a chunk inserted earlier in the run: counted and not inserted
+    """
+    if duplicates is None or duplicates.check(text, key) is None:
+        return False
+    stats['weaviate_duplicates'] += 1
+    stats['weaviate_duplicates_size'] += len(text)
+    object_stats['duplicate_chunks'] += 1
+    return True
+
+
+def chunk_uuid(properties: dict) -> str:
+    """
+    Uuid of the chunk: the same object, page, position and text give the same
+    uuid, so a re-import overwrites the chunk in place.
+    """
+    return str(uuid.uuid5(
+        CHUNK_NAMESPACE,
+        f"{properties['object_id']}/{properties.get('page')}/{properties['chunk_id']}/{make_text_hash(properties['content'])}",
+    ))
+
+
+def prepare_objects(objects: Iterable[dict], stats: dict) -> Iterator[tuple[dict, str, dict | None]]:
+    """
+    Objects with their chunk_uuid() (they are upserted under it) and vector.
+
+    With embed_mode 'client' vectors of their content are requested from the
+    embed API here, in batches, and sent with the objects: weaviate doesn't
+    vectorize them. Otherwise the vector is None.
+    """
+    if settings.embed_mode != 'client':
+        for properties in objects:
+            yield properties, chunk_uuid(properties), None
+        return
+
+    from src.common.embed import embed_stream
+    for properties, vector in embed_stream(objects, lambda item: item['content'], stats):
+        yield properties, chunk_uuid(properties), {VECTOR_NAME: vector}
+
+
+def make_batch(collection: Collection):
+    """
+    Batch context of `weaviate_batch_mode`
+    """
+    mode: str = settings.weaviate_batch_mode
+    if mode == 'dynamic':
+        return collection.batch.dynamic()
+    if mode == 'fixed_size':
+        return collection.batch.fixed_size(
+            batch_size=settings.weaviate_batch_size,
+            concurrent_requests=settings.weaviate_batch_concurrency,
+        )
+    if mode == 'rate_limit':
+        return collection.batch.rate_limit(requests_per_minute=settings.weaviate_batch_rate)
+    raise AssertionError(f"Unknown weaviate batch mode: {mode}")
+
+
+def retry_failed(collection: Collection, stats: dict) -> list[ErrorObject]:
+    """
+    Sends failed objects of the last batch again, up to `weaviate_batch_retries`
+    times with exponential backoff. Objects failing every time are recorded to
+    meta.t_dead_letter and returned.
+    """
+    failed: list[ErrorObject] = collection.batch.failed_objects
+    for attempt in range(settings.weaviate_batch_retries):
+        if not failed:
+            return []
+        delay: float = settings.weaviate_batch_backoff * 2 ** attempt
+        logger.warning(f"Weaviate batch: {len(failed)} objects failed, retry in {delay}s: {failed[0].message}")
+        time.sleep(delay)
+        stats['weaviate_retried'] += len(failed)
+        with make_batch(collection) as batch:
+            for item in failed:
+                batch.add_object(
+                    properties=item.object_.properties, uuid=item.object_.uuid, vector=item.object_.vector,
+                )
+        failed = collection.batch.failed_objects
+    if not failed:
+        return []
+
+    logger.error(f"Weaviate batch: {len(failed)} objects failed after retries, see meta.t_dead_letter: {failed[0].message}")
+    stats['weaviate_dead_letter'] += len(failed)
+    with DbConnManager(settings.db_conn_str) as conn:
+        dead_letter_put_many(conn, collection.name, (
+            {'uuid': item.object_.uuid, 'error': item.message, 'properties': item.object_.properties}
+            for item in failed
+        ))
+    return failed
+
+
+def weaviate_prune_chunks(collection: Collection, object_id, keep: set[str]) -> int:
+    """
+    Deletes chunks of the source object except `keep`: chunks whose text or
+    position changed and chunks the object doesn't have anymore.
+
+    Chunks are read `weaviate_prune_page` at a time (the cursor of weaviate
+    doesn't take filters): stale chunks of a page are deleted, kept ones are
+    skipped by the offset of the next page. Weaviate doesn't return objects
+    past offset + limit > `weaviate_delete_limit` (QUERY_MAXIMUM_RESULTS):
+    the last page is cut to fit, stale chunks after more kept ones are left.
+    """
+    where = Filter.by_property("object_id").equal(str(object_id))
+    pruned: int = 0
+    offset: int = 0
+    while (limit := min(settings.weaviate_prune_page, settings.weaviate_delete_limit - offset)) > 0:
+        result = collection.query.fetch_objects(
+            filters=where,
+            offset=offset,
+            limit=limit,
+            return_properties=[],
+        )
+        stale: list[str] = [str(item.uuid) for item in result.objects if str(item.uuid) not in keep]
+        offset += len(result.objects) - len(stale)
+        if stale:
+            deleted = collection.data.delete_many(where=Filter.by_id().contains_any(stale))
+            pruned += deleted.successful
+            if deleted.failed:
+                logger.error(f"Failed to delete {deleted.failed} stale chunks of {object_id}")
+                break
+        if len(result.objects) < limit:
+            break
+    else:
+        logger.warning(f"Stale chunks of {object_id} aren't pruned after {offset} kept ones")
+    return pruned
+
+
+class _Source:
+    """
+    Source object (page, file) written by BatchWriter. Its chunks may span several flushes.
+    """
+    def __init__(self, object_id, object_stats: dict, on_done: Callable[[int, int], None] | None):
+        self.object_id = object_id
+        self.object_stats: dict = object_stats
+        self.on_done: Callable[[int, int], None] | None = on_done
+        self.uuids: set[str] = set()    # Chunks sent and not failed
+        self.size: int = 0              # Their content size
+        self.failed: int = 0            # Dead-lettered chunks
+        self.complete: bool = False     # All chunks are sent
+
+
+class BatchWriter:
+    """
+    One batch import per task run: chunks of all source objects go into the
+    same batch, the vectorizer isn't idle waiting for a flush after every
+    page or file.
+
+    Weaviate reports failed objects only when a batch is closed, so the batch
+    is flushed (closed and opened again) every `weaviate_batch_inflight`
+    objects and every `weaviate_batch_flush_interval` seconds: objects in
+    flight are bounded, progress is saved. Failed objects are retried, then
+    dead-lettered (retry_failed()). A source object is finished at the first
+    flush after its last chunk: written chunks are counted in its stats, its
+    stale chunks are pruned (if none failed), on_done(inserted, failed) is called.
+
+    Source objects with dead-lettered chunks (`dead_letters`, imported again
+    by the task) are removed from meta.t_dead_letter when the writer is closed
+    if all their chunks are written now.
+
+    Stale chunks are pruned in incremental sync mode only (`prune` by default):
+    in full mode the collection is recreated, objects have no old chunks.
+
+    The batch is opened by the first add(): the writer may be created before
+    check_collection_readiness().
+    """
+    def __init__(
+            self,
+            client: WeaviateClient,
+            stats: dict,
+            index_name: str = settings.weaviate_collection,
+            dead_letters: Iterable[str] = (),
+            prune: bool | None = None,
+    ):
+        self.collection: Collection = client.collections.get(index_name)
+        self.stats: dict = stats
+        self.prune: bool = settings.sync_mode == 'incremental' if prune is None else prune
+        self.dead_letters: set[str] = set(dead_letters)
+        self.recovered: list[str] = []          # Of them written completely
+        self.stack: ExitStack | None = None
+        self.batch = None
+        self.sources: list[_Source] = []        # Not finished yet
+        self.owners: dict[str, _Source] = {}    # Objects sent since the last flush: uuid -> source
+        self.flushed: float = time.monotonic()
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._close()
+        if exc_type is None:    # Otherwise objects aren't finished: they are imported again next run
+            self._finish()
+            if self.recovered:
+                with DbConnManager(settings.db_conn_str) as conn:
+                    dead_letter_delete_many(conn, self.collection.name, self.recovered)
+                self.stats['dead_letter_recovered'] += len(self.recovered)
+
+    def _open(self) -> None:
+        self.stack = ExitStack()
+        self.batch = self.stack.enter_context(make_batch(self.collection))
+
+    def _close(self) -> None:
+        if self.stack is not None:
+            stack, self.stack, self.batch = self.stack, None, None
+            stack.close()   # Waits for the objects in flight
+
+    def add(
+            self,
+            object_id,
+            objects: Iterable[dict],
+            object_stats: dict,
+            on_done: Callable[[int, int], None] | None = None,
+    ) -> int:
+        """
+        Sends chunks of the source object. Returns count of the chunks sent.
+        """
+        source = _Source(object_id, object_stats, on_done)
+        self.sources.append(source)
+        sent: int = 0
+        try:
+            for properties, object_uuid, vector in prepare_objects(objects, self.stats):
+                if self.batch is None:
+                    self._open()
+                self.batch.add_object(properties=properties, uuid=object_uuid, vector=vector)
+                source.uuids.add(object_uuid)
+                source.size += len(properties['content'])
+                self.owners[object_uuid] = source
+                sent += 1
+                if (
+                        len(self.owners) >= settings.weaviate_batch_inflight
+                        or time.monotonic() - self.flushed >= settings.weaviate_batch_flush_interval
+                ):
+                    self.flush()
+        except Exception:
+            # Objects failed to come (parse error): the source is never finished, chunks sent
+            # are kept, its old ones aren't pruned, on_done() isn't called
+            self.sources.remove(source)
+            raise
+        source.complete = True
+        return sent
+
+    def flush(self) -> None:
+        """
+        Waits for the objects sent, finishes the complete source objects
+        """
+        self._close()
+        self._finish()
+        self._open()
+
+    def _finish(self) -> None:
+        for item in retry_failed(self.collection, self.stats):
+            if source := self.owners.get(object_uuid := str(item.object_.uuid)):
+                source.uuids.discard(object_uuid)
+                source.size -= len(item.object_.properties['content'])
+                source.failed += 1
+        sent: int = len(self.owners)
+        self.owners.clear()
+        self.flushed = time.monotonic()
+
+        done: list[_Source] = [source for source in self.sources if source.complete]
+        self.sources = [source for source in self.sources if not source.complete]
+        for source in done:
+            inserted: int = len(source.uuids)
+            self.stats['weaviate_inserted'] += inserted
+            self.stats['weaviate_inserted_size'] += source.size
+            source.object_stats['vectordb_inserted'] += inserted
+            if source.failed:
+                # Previous chunks of the object are kept until it's imported completely
+                source.object_stats['dead_letter'] += source.failed
+            else:
+                if self.prune:
+                    self.stats['weaviate_pruned'] += weaviate_prune_chunks(
+                        self.collection, source.object_id, source.uuids,
+                    )
+                if str(source.object_id) in self.dead_letters:
+                    self.recovered.append(str(source.object_id))
+            if source.on_done is not None:
+                source.on_done(inserted, source.failed)
+        if sent or done:
+            logger.info(
+                f"Weaviate batch flushed: {sent} objects, {len(done)} source objects done,"
+                f" {len(self.sources)} in progress, inserted total: {self.stats['weaviate_inserted']}"
+            )
+
+
 def weaviate_insert(
-        client: WeaviateClient,
-        texts: list[Document],
+        writer: BatchWriter,
+        texts: Iterable['Document'],
         doc_attrs: dict,
         stats: dict,
-        index_name: str = settings.weaviate_collection,
         file_name: str = None,
-):
+        duplicates: NearDuplicates | None = None,
+        on_done: Callable[[int, int], None] | None = None,
+) -> int:
     """
     Insert multiple documents into weaviate collection.
 
     We use native create() because we use multiple vector fields.
     Langchain supports only one vector field (property).
+
+    Documents are consumed lazily, page number is taken from metadata['page'].
+    Near-duplicates of the chunks in `duplicates` are skipped.
+
+    Chunks are upserted by the writer, chunks of the object not written now
+    are deleted when it's finished: a re-import doesn't duplicate them.
+    Returns count of the chunks sent, on_done() is called when they are written.
     """
-    logger.info(msg := f"Inserting {len(texts)} docs into weaviate: {index_name} ...")
-    collection: Collection = client.collections.get(index_name)
-    i = 0
-    with collection.batch.dynamic() as batch:
-        for i, text in enumerate(texts, start=1):
-            batch.add_object(
-                properties={
-                    "content": text.page_content,
-                    "chunk_id": i,
-                    **doc_attrs,
-                }
-            )
+    logger.info(msg := f"Inserting docs into weaviate: {writer.collection.name} ...")
+    duplicated: int = 0
 
+    def objects() -> Iterator[dict]:
+        nonlocal duplicated
+        for i, text in enumerate(texts, start=1):
             # Chunk statistics calculation
             chunk_len = (len(text.page_content) // 50) * 50
             stats['vectordb']['chunk'][chunk_len] += 1
@@ -158,30 +464,44 @@ def weaviate_insert(
             elif chunk_len > 1000:
                 stats['file'][file_name]['chunk_len>1000'] += 1
 
-        if batch.number_errors > 1:
-            logger.error(msg := f"Weaviate batch insert errors: {batch.number_errors}")
-            raise AssertionError(msg)
-        stats['vectordb']['weaviate_inserted'] += i
-        logger.info(f"{msg} done: {i}")
-        return i
+            if is_duplicate(
+                    duplicates, text.page_content, (doc_attrs['object_id'], i), stats['vectordb'], stats['file'][file_name]
+            ):
+                duplicated += 1
+                continue
+            yield {
+                "content": text.page_content,
+                "chunk_id": i,
+                "page": text.metadata.get('page'),
+                **doc_attrs,
+            }
+
+    count: int = writer.add(doc_attrs['object_id'], objects(), stats['file'][file_name], on_done)
+    logger.info(f"{msg} done: {count} sent, near-duplicates: {duplicated}")
+    return count
 
 
 def weaviate_insert_plain(
-        client: WeaviateClient,
+        writer: BatchWriter,
         texts: list[str],
         doc_attrs: dict,
         stats: dict,
-        index_name: str = settings.weaviate_collection,
         object_name: str = None,
-):
+        duplicates: NearDuplicates | None = None,
+        on_done: Callable[[int, int], None] | None = None,
+) -> int:
     """
     Insert multiple documents into weaviate collection.
+    Near-duplicates of the chunks in `duplicates` are skipped.
+
+    Chunks are upserted by the writer, chunks of the object not written now
+    are deleted when it's finished: a re-import doesn't duplicate them.
+    Returns count of the chunks sent, on_done() is called when they are written.
     """
-    logger.info(msg := f"Inserting {len(texts)} docs into weaviate: {index_name} ...")
-    collection: Collection = client.collections.get(index_name)
-    inserted_count: int = 0  # Inserted
+    logger.info(msg := f"Inserting {len(texts)} docs into weaviate: {writer.collection.name} ...")
     min_size: int = settings.text_chunk_min_size
-    with collection.batch.dynamic() as batch:
+
+    def objects() -> Iterator[dict]:
         for i, text in enumerate(texts, start=1):
             # Chunk statistics calculation
             chunk_len = (len(text) // 50) * 50
@@ -192,28 +512,52 @@ def weaviate_insert_plain(
                 stats['source_object'][object_name]['chunk_len>1000'] += 1
 
             # Insert
-            if len(text) >= min_size:
-                batch.add_object(
-                    properties={
-                        "content": text,
-                        "chunk_id": i,
-                        **doc_attrs,
-                    }
-                )
-                inserted_count += 1
-                stats['vectordb']['weaviate_inserted'] += 1
-                stats['vectordb']['weaviate_inserted_size'] += len(text)
-            else:
+            if len(text) < min_size:
                 stats['vectordb']['weaviate_skipped'] += 1
                 stats['vectordb']['weaviate_skipped_size'] += len(text)
                 continue
+            if is_duplicate(
+                    duplicates, text, (doc_attrs['object_id'], i), stats['vectordb'], stats['source_object'][object_name]
+            ):
+                continue
+            yield {
+                "content": text,
+                "chunk_id": i,
+                **doc_attrs,
+            }
 
-        if batch.number_errors > 1:
-            logger.error(msg := f"Weaviate batch insert errors: {batch.number_errors}")
-            raise AssertionError(msg)
+    count: int = writer.add(doc_attrs['object_id'], objects(), stats['source_object'][object_name], on_done)
+    logger.info(f"{msg} done: {count} sent")
+    return count
 
-        logger.info(f"{msg} done: {i}")
-        return inserted_count
+
+def weaviate_delete_objects(
+        client: WeaviateClient,
+        object_ids: list,
+        index_name: str = settings.weaviate_collection,
+) -> int:
+    """
+    Delete all chunks of the source objects (pages, files) by object_id.
+
+    One filter delete per call instead of object by object. Weaviate deletes
+    at most `weaviate_delete_limit` objects per request, so it's repeated
+    while there is something left.
+    """
+    if not object_ids:
+        return 0
+    logger.info(msg := f"Deleting chunks of {len(object_ids)} objects from weaviate: {index_name} ...")
+    collection: Collection = client.collections.get(index_name)
+    where = Filter.by_property("object_id").contains_any([str(item) for item in object_ids])
+    deleted: int = 0
+    while True:
+        result = collection.data.delete_many(where=where)
+        deleted += result.successful
+        if result.failed:
+            logger.error(f"Failed to delete {result.failed} chunks")
+        if result.matches < settings.weaviate_delete_limit or not result.successful:
+            break
+    logger.info(f"{msg} done: {deleted}")
+    return deleted
 
 
 def check_collection_readiness(
@@ -246,8 +590,12 @@ def check_collection_readiness(
     while True:
         msg = ""
         try:
-            # Check insert
-            res_uuid = collection.data.insert(properties=properties)
+            # Check insert. Client side embeddings: the model of the embed API is checked too
+            vector: dict | None = None
+            if settings.embed_mode == 'client':
+                from src.common.embed import embed_texts
+                vector = {VECTOR_NAME: embed_texts([properties['content']])[0]}
+            res_uuid = collection.data.insert(properties=properties, vector=vector)
             # Check query by uuid
             document = collection.query.fetch_object_by_id(res_uuid)
             if document is not None:
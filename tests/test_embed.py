@@ -0,0 +1,137 @@
+"""
+Client side embeddings (src.common.embed) against the fake Ollama embed API
+of src.benchmarks.embed on an ephemeral port.
+"""
+import io
+import json
+import threading
+from array import array
+from collections import defaultdict
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.benchmarks.embed import fake_vector, make_handler
+from src.common import embed
+from src.common.settings import settings
+from src.common.utils import make_text_hash
+
+DIM: int = 8
+TEXTS: list[str] = [f'chunk {i}' for i in range(23)]
+
+
+def start(handler: type[BaseHTTPRequestHandler]):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    Embed API with the cache off. Yields texts of every request.
+    """
+    requests: list[list[str]] = []
+    handler = make_handler(DIM, delay=0, item_delay=1)
+
+    class Recorder(handler):
+        def do_POST(self):
+            body: bytes = self.rfile.read(int(self.headers['Content-Length']))
+            requests.append(json.loads(body)['input'])
+            self.rfile = io.BytesIO(body)
+            super().do_POST()
+
+    server = start(Recorder)
+    monkeypatch.setattr(settings, 'embed_api_endpoint', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(settings, 'embed_cache_enabled', False)
+    monkeypatch.setattr(embed, '_session', None)
+    yield requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_embed_texts(api):
+    assert embed.embed_texts(TEXTS[:3]) == [fake_vector(text, DIM) for text in TEXTS[:3]]
+    assert api == [TEXTS[:3]]
+
+
+@pytest.mark.parametrize('batch_size, workers', [(1, 1), (5, 2), (8, 4), (32, 2)])
+def test_embed_stream_order(api, monkeypatch, batch_size, workers):
+    monkeypatch.setattr(settings, 'embed_batch_size', batch_size)
+    monkeypatch.setattr(settings, 'embed_workers', workers)
+    stats: dict = defaultdict(int)
+    items: list[tuple[int, str]] = list(enumerate(TEXTS))
+    result = list(embed.embed_stream(items, lambda item: item[1], stats))
+    assert [item for item, _ in result] == items
+    assert [vector for _, vector in result] == [fake_vector(text, DIM) for text in TEXTS]
+    batches: int = -(-len(TEXTS) // batch_size)
+    last: int = len(TEXTS) - batch_size * (batches - 1)
+    assert sorted(map(len, api), reverse=True) == [batch_size] * (batches - 1) + [last]
+    assert stats['embed_batches'] == batches
+    assert stats['embedded'] == len(TEXTS)
+    assert stats['embed_cache_hits'] == 0
+
+
+def test_embed_stream_empty(api):
+    stats: dict = defaultdict(int)
+    assert list(embed.embed_stream([], str, stats)) == []
+    assert api == []
+    assert stats['embed_batches'] == 0
+
+
+class Broken(BaseHTTPRequestHandler):
+    """
+    One vector less than texts, 500 for a single text
+    """
+    def do_POST(self):
+        texts: list[str] = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['input']
+        if len(texts) == 1:
+            self.send_error(500, 'model not loaded')
+            return
+        data: bytes = json.dumps({'embeddings': [fake_vector(text, DIM) for text in texts[1:]]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_embed_texts_errors(monkeypatch):
+    server = start(Broken)
+    monkeypatch.setattr(settings, 'embed_api_endpoint', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(embed, '_session', None)
+    try:
+        with pytest.raises(AssertionError, match='2 vectors for 3 texts'):
+            embed.embed_texts(TEXTS[:3])
+        with pytest.raises(AssertionError, match='500'):
+            embed.embed_texts(TEXTS[:1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_embed_cached(api, monkeypatch):
+    monkeypatch.setattr(settings, 'embed_cache_enabled', True)
+    cache: dict[str, bytes] = {
+        make_text_hash(text): array('f', [0.5] * DIM).tobytes() for text in TEXTS[::3]
+    }
+    stored: dict[str, bytes] = {}
+    monkeypatch.setattr(embed, 'DbConnManager', lambda conn_str: nullcontext())
+    monkeypatch.setattr(embed, 'embed_cache_get_many', lambda conn, model, hashes: {
+        text_hash: cache[text_hash] for text_hash in hashes if text_hash in cache
+    })
+    monkeypatch.setattr(embed, 'embed_cache_put_many', lambda conn, model, vectors: stored.update(vectors))
+    monkeypatch.setattr(embed, '_evict', lambda count: None)
+
+    vectors, hits = embed.embed_cached(TEXTS)
+    misses: list[str] = [text for text in TEXTS if make_text_hash(text) not in cache]
+    assert hits == len(TEXTS) - len(misses)
+    assert api == [misses]
+    assert set(stored) == {make_text_hash(text) for text in misses}
+    for text, vector in zip(TEXTS, vectors):
+        expected = [0.5] * DIM if make_text_hash(text) in cache else fake_vector(text, DIM)
+        assert vector == pytest.approx(expected)
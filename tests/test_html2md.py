@@ -0,0 +1,35 @@
+"""
+lxml converter (src.common.html2md) gives the same markdown as markdownify
+(heading_style=ATX), the reference converter of settings.html_converter.
+"""
+import pytest
+
+from src.common.html2md import html2markdown
+
+markdownify = pytest.importorskip('markdownify')
+
+PAGES: list[str] = [
+    '',
+    '<!-- comment only -->',
+    '<p>Простой абзац</p>',
+    '<h1>Заголовок</h1><p>Текст <b>жирный</b> и <i>курсив</i>, <code>код</code></p><h3>Подраздел</h3>',
+    '<div><p>Первый</p>\n\n<p>Второй   абзац\nс переносом</p></div>',
+    '<ul><li>один</li><li>два<ul><li>вложенный</li></ul></li></ul><ol start="3"><li>три</li><li>четыре</li></ol>',
+    '<p><a href="https://example.com/doc">Ссылка</a>, <a href="https://example.com">https://example.com</a></p>',
+    '<p>Строка<br>следующая строка<br/>третья</p>',
+    '<table><tr><th>Имя</th><th>Телефон</th></tr><tr><td>Иван</td><td>123</td></tr>'
+    '<tr><td colspan="2">Итого</td></tr></table>',
+    '<table><thead><tr><td>a</td><td>b</td></tr></thead><tbody><tr><td>1</td><td>2</td></tr></tbody></table>',
+    '<blockquote><p>Цитата</p><p>в два абзаца</p></blockquote>',
+    '<pre>  def f():\n      return 1\n</pre><p>после кода</p>',
+    '<p><img src="/a.png" alt="Схема" title="Рисунок 1"> подпись</p><hr><p>конец</p>',
+    '<dl><dt>Термин</dt><dd>Определение</dd></dl>',
+    '<p>Текст со <script>alert(1)</script> скриптом<style>p {}</style></p>',
+    '<h2>Заголовок со <a href="/x">ссылкой</a></h2><p>*звездочки* и _подчеркивания_</p>',
+    '<div>inline <span>span</span> <em>em</em> <strong>strong</strong></div><p>&nbsp;&lt;tag&gt; &amp;</p>',
+]
+
+
+@pytest.mark.parametrize('html', PAGES)
+def test_same_as_markdownify(html: str):
+    assert html2markdown(html) == markdownify.markdownify(html, heading_style="ATX")
@@ -0,0 +1,122 @@
+"""
+Removal of repeated lines (src.common.text): navigation of a site and headers
+and footers of a document go, content and markdown structure stay. Splitting
+of a page into heading sections and chunking by section.
+"""
+from collections import defaultdict
+from itertools import permutations
+
+import pytest
+
+from src.common.html2md import Section, html2markdown, html2markdown_sections
+from src.common.settings import settings
+from src.common.text import chunkate_sections, decode_html2sections, sample_repeated_lines, strip_document_boilerplate
+
+NAV: str = '[Главная](/) [Новости](/news) [Поиск](/search)'
+FOOTER: str = '© Компания, все права защищены'
+
+
+def site_page(name: str, phone: str) -> str:
+    return '\n'.join([
+        NAV,
+        '',
+        '## Контакты',
+        '',
+        '| Имя | Телефон |',
+        '| --- | --- |',
+        f'| {name} | {phone} |',
+        '',
+        '* Режим работы: 9-18',
+        '1. Приемная',
+        '',
+        FOOTER,
+    ])
+
+
+PAGES: list[str] = [
+    site_page('Иван', '123'),
+    site_page('Петр', '456'),
+    site_page('Анна', '789'),
+    site_page('Олег', '000'),
+]
+
+
+def test_site_keeps_markdown_structure():
+    repeated = sample_repeated_lines(PAGES)
+    stats: dict = defaultdict(int)
+    for page in PAGES:
+        text: str = repeated.strip(page, stats)
+        assert NAV not in text
+        assert FOOTER not in text
+        for line in ('## Контакты', '| Имя | Телефон |', '| --- | --- |', '* Режим работы: 9-18', '1. Приемная'):
+            assert line in text.split('\n')
+    assert stats['boilerplate_lines'] == 2 * len(PAGES)
+
+
+def test_site_order_independent():
+    results: set[tuple[str, ...]] = set()
+    for order in permutations(PAGES):
+        repeated = sample_repeated_lines(list(order))
+        results.add(tuple(repeated.strip(page, defaultdict(int)) for page in PAGES))
+    assert len(results) == 1
+
+
+def test_site_small_sample():
+    assert sample_repeated_lines(PAGES[:2]) is None
+
+
+WORDS: list[str] = ['бюджет', 'закупки', 'кадры', 'обучение', 'ремонт']
+
+
+def test_document_edge_lines():
+    # Numbers are ignored in edge lines: page numbers go, content lines differ by words
+    body: dict[int, str] = {
+        n: '\n'.join(f'Раздел {word}, пункт {i}.' for i in range(3)) for n, word in enumerate(WORDS, 1)
+    }
+    pages: list[tuple[int | None, str]] = [(n, f'Отчет за 2024 год\n{text}\n- {n} -') for n, text in body.items()]
+    stats: dict = defaultdict(int)
+    stripped: list[tuple[int | None, str]] = list(strip_document_boilerplate(pages, stats))
+    assert stripped == list(body.items())
+    assert stats['boilerplate_lines'] == 2 * len(WORDS)
+
+
+SECTIONED: str = (
+    '<p>Вступление</p><h2>Контакты</h2><p>Телефон приемной</p>'
+    '<h3>Адрес</h3><p>Москва</p><h2>Документы</h2><ul><li>Устав</li></ul>'
+)
+
+
+def test_sections():
+    text, sections = html2markdown_sections(SECTIONED)
+    assert text == html2markdown(SECTIONED)
+    assert [(section.level, section.title) for section in sections] == [(2, 'Контакты'), (3, 'Адрес'), (2, 'Документы')]
+    for section in sections:
+        assert text[section.start:].startswith(f"{'#' * section.level} {section.title}\n")
+    assert html2markdown_sections('<p>Без заголовков</p>') == ('Без заголовков', [])
+    assert isinstance(sections[0], Section)
+
+
+def test_decode_sections():
+    sections: list[str] = decode_html2sections(SECTIONED)
+    assert ''.join(sections) == html2markdown(SECTIONED)
+    assert [text.split('\n')[0] for text in sections] == ['Вступление', '## Контакты', '### Адрес', '## Документы']
+
+
+def test_chunkate_sections(monkeypatch):
+    monkeypatch.setattr(settings, 'text_chunk_size', 200)
+    monkeypatch.setattr(settings, 'text_chunk_overlap', 0)
+    monkeypatch.setattr(settings, 'text_chunk_min_size', 50)
+    first: str = '## Первый\n\n' + 'слово ' * 20
+    second: str = '## Второй\n\n' + 'текст ' * 20
+    short: str = '## Короткий\n\nмало'
+    chunks: list[str] = chunkate_sections([first, '', second, short], defaultdict(int))
+    # Chunks don't cross a section boundary, a short section is joined to the previous one
+    assert chunks == [first.strip(), (second + '\n\n' + short).strip()]
+
+
+@pytest.mark.parametrize('converter', ['lxml', 'markdownify'])
+def test_decode_sections_converter(monkeypatch, converter):
+    if converter == 'markdownify':
+        pytest.importorskip('markdownify')
+    monkeypatch.setattr(settings, 'html_converter', converter)
+    assert '\n'.join(decode_html2sections(SECTIONED)).count('Москва') == 1